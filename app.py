@@ -1,14 +1,261 @@
+import io
+import sys
+import argparse
+import csv
+import codecs
+import zipfile
+import base64
 import os
+import re
+import math
 import json
+import time
+import hashlib
+import functools
+import zlib
+import tempfile
 import threading
-from flask import Flask, request, jsonify, render_template
+import queue
+import logging
+import logging.handlers
+import contextvars
+from collections import OrderedDict, deque, namedtuple
+import uuid
+import random
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Request, request, jsonify, render_template, Response, stream_with_context, g
 from werkzeug.utils import secure_filename
 import requests
-from datetime import datetime
+from requests.adapters import HTTPAdapter
+from datetime import datetime, timedelta
 from contextlib import contextmanager
+import atexit
 import sqlite3
+from xml.sax.saxutils import quoteattr
+
+# Optional OCR / PDF dependencies
+try:
+    from pypdf import PdfReader
+except ImportError:
+    PdfReader = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+try:
+    from PIL import Image as PILImage
+except ImportError:
+    PILImage = None
+
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+# Optional libSQL client for Turso embedded replicas
+try:
+    import libsql_experimental as libsql
+except ImportError:
+    libsql = None
+
+# Logging: records are queued and written by a listener thread so request threads never block on stdout
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text')
+LOG_SLOW_REQUEST_MS = float(os.getenv('LOG_SLOW_REQUEST_MS', '1000'))
+
+class TextLogFormatter(logging.Formatter):
+    """Message followed by any structured fields as key=value"""
+    
+    def format(self, record):
+        message = record.getMessage()
+        fields = getattr(record, 'fields', None)
+        if fields:
+            message += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        return message
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line; structured fields come from extra={'fields': {...}}"""
+    
+    def format(self, record):
+        entry = {'ts': round(record.created, 3), 'level': record.levelname.lower(),
+                 'thread': record.threadName, 'msg': record.getMessage()}
+        entry.update(getattr(record, 'fields', None) or {})
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+_log_queue = queue.SimpleQueue()
+_log_handler = logging.StreamHandler(sys.stdout)
+_log_handler.setFormatter(JsonLogFormatter() if LOG_FORMAT == 'json' else TextLogFormatter())
+_log_listener = None
+
+def start_log_listener():
+    """(Re)start the thread draining the log queue; forked workers need their own"""
+    global _log_listener
+    _log_listener = logging.handlers.QueueListener(_log_queue, _log_handler)
+    _log_listener.start()
+
+logger = logging.getLogger('datavault')
+logger.setLevel(LOG_LEVEL)
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.propagate = False
+start_log_listener()
+atexit.register(lambda: _log_listener.stop())
+os.register_at_fork(after_in_child=start_log_listener)
+
+# Metrics: Prometheus text exposition at /metrics
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+_metrics = []
+_metric_collectors = []
+
+def _label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label_text(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_label_value(value)}"' for name, value in zip(names, values)) + '}'
+
+class Counter:
+    """Monotonic counter per label set"""
+    
+    kind = 'counter'
+    
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.values = {}
+        self.lock = threading.Lock()
+        _metrics.append(self)
+    
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+    
+    def samples(self):
+        with self.lock:
+            return [(self.name, _label_text(self.labels, key), value) for key, value in self.values.items()]
+
+class Gauge(Counter):
+    """Value that goes up and down (in-flight work)"""
+    
+    kind = 'gauge'
+    
+    def dec(self, *label_values):
+        self.inc(*label_values, amount=-1)
+
+class Histogram:
+    """Cumulative-bucket latency histogram per label set"""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, help_text, labels=(), buckets=METRIC_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+        _metrics.append(self)
+    
+    def observe(self, value, *label_values):
+        index = 0
+        while index < len(self.buckets) and value > self.buckets[index]:
+            index += 1
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+    
+    def samples(self):
+        samples = []
+        with self.lock:
+            series = [(key, list(counts), total) for key, (counts, total) in self.series.items()]
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                samples.append((f"{self.name}_bucket", _label_text(self.labels + ('le',), key + (le,)), cumulative))
+            samples.append((f"{self.name}_sum", _label_text(self.labels, key), round(total, 6)))
+            samples.append((f"{self.name}_count", _label_text(self.labels, key), cumulative))
+        return samples
+
+def register_collector(func):
+    """func() -> [(name, kind, help, {label tuple: value}, label names)] sampled at scrape time"""
+    _metric_collectors.append(func)
+    return func
+
+def render_metrics():
+    lines = []
+    for metric in _metrics:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(f"{name}{labels} {value}" for name, labels, value in metric.samples())
+    for collector in _metric_collectors:
+        for name, kind, help_text, values, label_names in collector():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            lines.extend(f"{name}{_label_text(label_names, key)} {value}" for key, value in values.items())
+    return '\n'.join(lines) + '\n'
+
+HTTP_SECONDS = Histogram('dv_http_request_seconds', 'Request latency by route', ('method', 'route', 'status'))
+HTTP_IN_FLIGHT = Gauge('dv_http_requests_in_flight', 'Requests being handled', ('route',))
+SPAN_SECONDS = Histogram('dv_span_seconds', 'Duration of pipeline stages', ('span',))
+SPANS_IN_FLIGHT = Gauge('dv_spans_in_flight', 'Pipeline stages currently running', ('span',))
+SPAN_ERRORS = Counter('dv_span_errors_total', 'Pipeline stages that raised', ('span',))
+PROVIDER_RESPONSES = Counter('dv_provider_responses_total', 'Provider responses after retries', ('provider', 'status'))
+DB_POOL_WAIT = Histogram('dv_db_pool_wait_seconds', 'Time spent waiting for a pooled connection')
+OCR_IMAGE_BYTES = Counter('dv_ocr_image_bytes_total', 'Image bytes before and after OCR preprocessing', ('stage',))
+OCR_TILES = Counter('dv_ocr_tiles_total', 'Image tiles sent to OCR')
+
+# Spans: timed pipeline stages, recorded in SPAN_SECONDS and summed into the current request's trace
+_trace = contextvars.ContextVar('dv_trace', default=None)
+
+@contextmanager
+def span(name):
+    SPANS_IN_FLIGHT.inc(name)
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        SPAN_ERRORS.inc(name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        SPANS_IN_FLIGHT.dec(name)
+        SPAN_SECONDS.observe(elapsed, name)
+        trace = _trace.get()
+        if trace is not None:
+            total, count = trace.get(name, (0.0, 0))
+            trace[name] = (total + elapsed, count + 1)
+
+def traced(name):
+    """Decorator running a function inside span(name)"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Uploads larger than this spill from memory to an anonymous temp file in UPLOAD_FOLDER
+UPLOAD_SPOOL_BYTES = int(os.getenv('UPLOAD_SPOOL_MAX_BYTES', str(8 * 1024 * 1024)))
+
+class SpooledUploadRequest(Request):
+    """Keep multipart file parts in memory up to UPLOAD_SPOOL_BYTES instead of werkzeug's 500KB"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(
+            max_size=UPLOAD_SPOOL_BYTES, prefix='dv-upload-', dir=app.config['UPLOAD_FOLDER']
+        )
 
 app = Flask(__name__)
+app.request_class = SpooledUploadRequest
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'pdf', 'gif'}
@@ -21,46 +268,527 @@ GROQ_API_KEY = os.getenv('GROQ_API_KEY', '')
 TURSO_URL = os.getenv('TURSO_DATABASE_URL', '')
 TURSO_TOKEN = os.getenv('TURSO_AUTH_TOKEN', '')
 
-# Force SQLite for stability
-USE_TURSO = False
-if TURSO_URL and TURSO_TOKEN:
-    print("⚠️ Turso credentials found but disabled (use SQLite for stability)", flush=True)
+# Provider endpoints (overridable to point at a local stub server)
+OCR_API_URL = os.getenv('OCR_API_URL', 'https://api.ocr.space/parse/image')
+GROQ_API_URL = os.getenv('GROQ_API_URL', 'https://api.groq.com/openai/v1/chat/completions')
+
+# OCR settings
+OCR_BACKEND = os.getenv('OCR_BACKEND', 'ocrspace')
+OCR_PAGE_WORKERS = int(os.getenv('OCR_PAGE_WORKERS', '4'))
+OCR_PDF_DPI = int(os.getenv('OCR_PDF_DPI', '200'))
+PDF_MIN_PAGE_CHARS = 20
+TESSERACT_CMD = os.getenv('TESSERACT_CMD', '')
+TESSERACT_LANG = os.getenv('TESSERACT_LANG', 'eng')
+
+# Image preprocessing before OCR: downsample, grayscale, deskew, binarize, tile and re-encode
+OCR_PREPROCESS = os.getenv('OCR_PREPROCESS', 'true').lower() in ('1', 'true', 'yes')
+OCR_TARGET_DPI = int(os.getenv('OCR_TARGET_DPI', '300'))
+OCR_MAX_IMAGE_PIXELS = int(os.getenv('OCR_MAX_IMAGE_PIXELS', str(40_000_000)))
+OCR_DESKEW = os.getenv('OCR_DESKEW', 'true').lower() in ('1', 'true', 'yes')
+OCR_DESKEW_MAX_ANGLE = 5.0
+OCR_BINARIZE = os.getenv('OCR_BINARIZE', 'true').lower() in ('1', 'true', 'yes')
+OCR_TILE_SIDE = int(os.getenv('OCR_TILE_SIDE', '2400'))
+OCR_TILE_OVERLAP = int(os.getenv('OCR_TILE_OVERLAP', '200'))
+OCR_TILE_DEDUP_LINES = 3
+
+# LLM settings (part of the model cache key)
+GROQ_MODEL = 'llama-3.3-70b-versatile'
+GROQ_TEMPERATURE = 0.1
+PROMPT_VERSION = '3'
+
+# Token governor: completion budget sized per call, oversized prompts rejected before sending
+GROQ_MAX_TOKENS = int(os.getenv('GROQ_MAX_TOKENS', '4000'))
+GROQ_MIN_TOKENS = 1024
+GROQ_MAX_PROMPT_TOKENS = int(os.getenv('GROQ_MAX_PROMPT_TOKENS', '24000'))
+COMPACT_PROMPT_MAX_TABLES = int(os.getenv('COMPACT_PROMPT_MAX_TABLES', '8'))
+GROQ_CONTINUATIONS = int(os.getenv('GROQ_CONTINUATIONS', '2'))
+COMPLETION_BASE_TOKENS = 300
+COMPLETION_TOKENS_PER_TABLE = {'full': 260, 'compact': 180}
+COMPLETION_TOKENS_PER_COLUMN = 4
+
+# Generation mode: 'llm', 'rules' (local classifier only) or 'hybrid'
+DEFAULT_GENERATION_MODE = os.getenv('DEFAULT_GENERATION_MODE', 'llm')
+
+# Large schemas are split into table-aligned chunks converted in parallel
+SCHEMA_CHUNK_CHARS = int(os.getenv('SCHEMA_CHUNK_CHARS', '3000'))
+GENERATION_CONCURRENCY = int(os.getenv('GENERATION_CONCURRENCY', '4'))
+
+# Model cache settings
+MODEL_CACHE_TTL = int(os.getenv('MODEL_CACHE_TTL_SECONDS', str(7 * 24 * 3600)))
+MODEL_CACHE_MAX_ENTRIES = int(os.getenv('MODEL_CACHE_MAX_ENTRIES', '500'))
+MODEL_CACHE_HOT_SIZE = int(os.getenv('MODEL_CACHE_HOT_SIZE', '64'))
 
-print(f"🔧 Database: SQLite (stable mode)", flush=True)
-print(f"🔑 OCR configured: {bool(OCR_API_KEY)}", flush=True)
-print(f"🔑 GROQ configured: {bool(GROQ_API_KEY)}", flush=True)
+# Knowledge retrieval settings
+KNOWLEDGE_CHUNK_CHARS = int(os.getenv('KNOWLEDGE_CHUNK_CHARS', '800'))
+KNOWLEDGE_TOP_K = int(os.getenv('KNOWLEDGE_TOP_K', '8'))
+KNOWLEDGE_TOKEN_BUDGET = int(os.getenv('KNOWLEDGE_TOKEN_BUDGET', '600'))
+
+# Background job settings
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '8'))
+JOB_MAX_PENDING = int(os.getenv('JOB_MAX_PENDING', '100'))
+JOB_RETENTION = int(os.getenv('JOB_RETENTION_SECONDS', str(24 * 3600)))
+# Running jobs are leased: the owning process renews heartbeat_at, other processes fail them once it lapses
+JOB_HEARTBEAT_SECONDS = float(os.getenv('JOB_HEARTBEAT_SECONDS', '15'))
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', '60'))
+
+# Idempotency-Key responses are replayed for this long
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+# An unfinished claim older than this (the gunicorn --timeout) belongs to a killed worker and may be taken over
+IDEMPOTENCY_CLAIM_TIMEOUT = int(os.getenv('IDEMPOTENCY_CLAIM_TIMEOUT_SECONDS', '180'))
+
+# Batch conversion
+BATCH_CONCURRENCY = int(os.getenv('BATCH_CONCURRENCY', '4'))
+BATCH_MAX_FILES = int(os.getenv('BATCH_MAX_FILES', '200'))
+
+# Server-side graph layout
+LAYOUT_BAND_HUBS = int(os.getenv('LAYOUT_BAND_HUBS', '40'))
+
+# Model history pagination
+MODELS_PAGE_SIZE = int(os.getenv('MODELS_PAGE_SIZE', '50'))
+MODELS_MAX_PAGE_SIZE = 200
+
+# Storage backend: 'sqlite' (local file) or 'libsql' (embedded replica of TURSO_DATABASE_URL)
+DB_BACKEND = os.getenv('DB_BACKEND', 'sqlite')
+DB_PATH = os.getenv('DB_PATH', 'db/datavault.db')
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT_SECONDS', '30'))
+DB_CONN_MAX_AGE = int(os.getenv('DB_CONN_MAX_AGE_SECONDS', '900'))
+DB_STATEMENT_CACHE = int(os.getenv('DB_STATEMENT_CACHE', '256'))
+DB_WRITE_BATCH = int(os.getenv('DB_WRITE_BATCH', '50'))
+DB_WRITE_FLUSH_SECONDS = float(os.getenv('DB_WRITE_FLUSH_SECONDS', '1'))
+TURSO_REPLICA_PATH = os.getenv('TURSO_REPLICA_PATH', 'db/replica.db')
+TURSO_SYNC_INTERVAL = float(os.getenv('TURSO_SYNC_INTERVAL_SECONDS', '5'))
+
+if DB_BACKEND == 'libsql' and (libsql is None or not TURSO_URL):
+    logger.warning("⚠️ libSQL backend needs libsql-experimental and TURSO_DATABASE_URL, using SQLite")
+    DB_BACKEND = 'sqlite'
+elif DB_BACKEND != 'libsql' and TURSO_URL:
+    logger.warning("⚠️ Turso credentials found but DB_BACKEND is not 'libsql', using SQLite")
+
+logger.info(f"🔧 Database: {'libSQL replica of ' + TURSO_URL if DB_BACKEND == 'libsql' else 'SQLite ' + DB_PATH}")
+logger.info(f"🔑 OCR configured: {bool(OCR_API_KEY)} (backend: {OCR_BACKEND})")
+logger.info(f"🔑 GROQ configured: {bool(GROQ_API_KEY)}")
 
-# Thread-local storage
-_local = threading.local()
 _db_initialized = False
 _db_init_lock = threading.Lock()
+_fts_available = False
+
+DB_ERRORS = (sqlite3.Error,) + ((libsql.Error,) if libsql is not None else ())
+
+class SqliteBackend:
+    """Local SQLite file in WAL mode"""
+    
+    name = 'sqlite'
+    # Take the write lock up front so concurrent writers wait on busy_timeout instead of deadlocking
+    begin_write = 'BEGIN IMMEDIATE'
+    supports_vacuum = True
+    
+    def __init__(self, path=DB_PATH):
+        self.path = path
+    
+    def connect(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        conn = sqlite3.connect(
+            self.path,
+            timeout=30.0,
+            check_same_thread=False,
+            isolation_level='DEFERRED',
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA busy_timeout=30000')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA cache_size=10000')
+        return conn
+    
+    def refresh(self, conn):
+        pass
+    
+    def after_write(self, conn):
+        pass
+    
+    def describe(self):
+        return {'backend': self.name, 'path': self.path}
+
+class LibsqlRow:
+    """sqlite3.Row stand-in for libSQL results: index, column name and dict() access"""
+    
+    __slots__ = ('_values', '_columns')
+    
+    def __init__(self, values, columns):
+        self._values = values
+        self._columns = columns
+    
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self._values[self._columns[key]]
+        return self._values[key]
+    
+    def __iter__(self):
+        return iter(self._values)
+    
+    def __len__(self):
+        return len(self._values)
+    
+    def keys(self):
+        return list(self._columns)
+
+class LibsqlCursor:
+    """DB-API cursor wrapper returning LibsqlRow rows"""
+    
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self._cursor = cursor
+        self._columns = None
+    
+    def execute(self, sql, params=()):
+        self._cursor.execute(sql, tuple(params))
+        self._columns = None
+        return self
+    
+    def executemany(self, sql, seq_of_params):
+        self._cursor.executemany(sql, [tuple(params) for params in seq_of_params])
+        self._columns = None
+        return self
+    
+    def _row(self, values):
+        if values is None:
+            return None
+        if self._columns is None:
+            self._columns = {column[0]: index for index, column in enumerate(self._cursor.description or ())}
+        return LibsqlRow(values, self._columns)
+    
+    def fetchone(self):
+        return self._row(self._cursor.fetchone())
+    
+    def fetchmany(self, size=None):
+        return [self._row(values) for values in self._cursor.fetchmany(size or self._cursor.arraysize)]
+    
+    def fetchall(self):
+        return [self._row(values) for values in self._cursor.fetchall()]
+    
+    def __iter__(self):
+        row = self.fetchone()
+        while row is not None:
+            yield row
+            row = self.fetchone()
+    
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+    
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+    
+    @property
+    def description(self):
+        return self._cursor.description
+
+class LibsqlConnection:
+    """libSQL connection with the sqlite3 surface the app relies on"""
+    
+    def __init__(self, conn):
+        self.raw = conn
+    
+    def cursor(self):
+        return LibsqlCursor(self, self.raw.cursor())
+    
+    def execute(self, sql, params=()):
+        return self.cursor().execute(sql, params)
+    
+    def executemany(self, sql, seq_of_params):
+        return self.cursor().executemany(sql, seq_of_params)
+    
+    @property
+    def in_transaction(self):
+        return self.raw.in_transaction
+    
+    def commit(self):
+        self.raw.commit()
+    
+    def rollback(self):
+        self.raw.rollback()
+    
+    def close(self):
+        self.raw.close()
+
+class LibsqlReplicaBackend:
+    """libSQL embedded replica: reads hit a local copy, writes go to the primary and are synced back"""
+    
+    name = 'libsql'
+    begin_write = None
+    supports_vacuum = False
+    
+    def __init__(self, url=TURSO_URL, token=TURSO_TOKEN, replica_path=TURSO_REPLICA_PATH,
+                 sync_interval=TURSO_SYNC_INTERVAL):
+        self.url = url
+        self.token = token
+        self.replica_path = replica_path
+        self.sync_interval = sync_interval
+        # file: URLs open a shared local file directly (local stand-in for a sqld primary)
+        self.local_only = url.startswith('file:')
+        self._sync_lock = threading.Lock()
+        self._last_sync = 0.0
+    
+    def connect(self):
+        if self.local_only:
+            path = self.url[len('file:'):]
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            conn = LibsqlConnection(libsql.connect(path))
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA busy_timeout=30000')
+            return conn
+        os.makedirs(os.path.dirname(self.replica_path) or '.', exist_ok=True)
+        conn = LibsqlConnection(libsql.connect(self.replica_path, sync_url=self.url, auth_token=self.token))
+        self.sync(conn, force=True)
+        return conn
+    
+    def sync(self, conn, force=False):
+        """Pull frames from the primary into the local replica (at most once per sync interval)"""
+        if self.local_only:
+            return
+        with self._sync_lock:
+            if not force and time.time() - self._last_sync < self.sync_interval:
+                return
+            conn.raw.sync()
+            self._last_sync = time.time()
+    
+    def refresh(self, conn):
+        self.sync(conn)
+    
+    def after_write(self, conn):
+        # Read-your-writes: the local replica only sees a delegated write after a sync
+        self.sync(conn, force=True)
+    
+    def describe(self):
+        return {'backend': self.name, 'url': self.url, 'replica': None if self.local_only else self.replica_path,
+                'sync_interval': self.sync_interval}
 
-def get_sqlite_connection():
-    """Get thread-safe SQLite connection"""
-    if not hasattr(_local, 'conn') or _local.conn is None:
+class Database:
+    """Bounded connection pool with read/write units of work and deferred write batching"""
+    
+    def __init__(self, backend, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, max_age=DB_CONN_MAX_AGE):
+        self.backend = backend
+        self.size = size
+        self.timeout = timeout
+        self.max_age = max_age
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._flusher = None
+        self._stats = {'opened': 0, 'recycled': 0, 'in_use': 0, 'checkouts': 0, 'waits': 0, 'wait_ms': 0.0,
+                       'transactions': 0, 'rollbacks': 0, 'deferred_writes': 0, 'flushes': 0}
+    
+    def _acquire(self):
+        started = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            if not self._slots.acquire(timeout=self.timeout):
+                raise RuntimeError(f"Database pool exhausted ({self.size} connections busy)")
+            waited = time.perf_counter() - started
+            DB_POOL_WAIT.observe(waited)
+            with self._lock:
+                self._stats['waits'] += 1
+                self._stats['wait_ms'] += waited * 1000
+        
+        with self._lock:
+            self._stats['checkouts'] += 1
+            self._stats['in_use'] += 1
+            entry = self._idle.pop() if self._idle else None
+        
+        if entry and time.time() - entry[1] > self.max_age:
+            self._close(entry[0])
+            with self._lock:
+                self._stats['recycled'] += 1
+            entry = None
+        if entry:
+            return entry
+        
         try:
-            os.makedirs('db', exist_ok=True)
-            _local.conn = sqlite3.connect(
-                'db/datavault.db',
-                timeout=30.0,
-                check_same_thread=False,
-                isolation_level='DEFERRED'
-            )
-            _local.conn.row_factory = sqlite3.Row
-            _local.conn.execute('PRAGMA journal_mode=WAL')
-            _local.conn.execute('PRAGMA busy_timeout=30000')
-            _local.conn.execute('PRAGMA synchronous=NORMAL')
-            _local.conn.execute('PRAGMA cache_size=10000')
-            print(f"✅ SQLite connection created for thread {threading.current_thread().name}", flush=True)
-        except Exception as e:
-            print(f"❌ SQLite connection error: {e}", flush=True)
+            conn = self.backend.connect()
+        except Exception:
+            with self._lock:
+                self._stats['in_use'] -= 1
+            self._slots.release()
+            raise
+        with self._lock:
+            self._stats['opened'] += 1
+        logger.info(f"✅ {self.backend.name} connection opened ({self._stats['opened']} total)")
+        return conn, time.time()
+    
+    def _release(self, entry, broken=False):
+        conn = entry[0]
+        if not broken and conn.in_transaction:
+            try:
+                conn.rollback()
+            except DB_ERRORS:
+                broken = True
+        with self._lock:
+            self._stats['in_use'] -= 1
+            if not broken:
+                self._idle.append(entry)
+        if broken:
+            self._close(conn)
+        self._slots.release()
+    
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+    
+    @contextmanager
+    def connection(self, bind=True):
+        """Check out a connection; nested calls on the same thread share it unless bind=False"""
+        held = getattr(self._local, 'conn', None) if bind else None
+        if held is not None:
+            yield held
+            return
+        
+        entry = self._acquire()
+        broken = False
+        if bind:
+            self._local.conn = entry[0]
+        try:
+            self.backend.refresh(entry[0])
+            yield entry[0]
+        except DB_ERRORS as e:
+            broken = not isinstance(e, (sqlite3.IntegrityError, sqlite3.OperationalError))
+            raise
+        finally:
+            if bind:
+                self._local.conn = None
+            self._release(entry, broken)
+    
+    @contextmanager
+    def read(self):
+        """Cursor for reads"""
+        with self.connection() as conn:
+            yield conn.cursor()
+    
+    @contextmanager
+    def write(self):
+        """Cursor inside one transaction: commit on success, roll back on error, nested calls join"""
+        with self.connection() as conn:
+            if getattr(self._local, 'writing', False):
+                yield conn.cursor()
+                return
+            
+            self._local.writing = True
+            try:
+                with span('db_write'):
+                    if self.backend.begin_write and not conn.in_transaction:
+                        conn.execute(self.backend.begin_write)
+                    try:
+                        yield conn.cursor()
+                        conn.commit()
+                    except BaseException:
+                        conn.rollback()
+                        with self._lock:
+                            self._stats['rollbacks'] += 1
+                        raise
+            finally:
+                self._local.writing = False
+            
+            with self._lock:
+                self._stats['transactions'] += 1
+            self.backend.after_write(conn)
+    
+    def query(self, sql, params=()):
+        with self.read() as cursor:
+            return cursor.execute(sql, params).fetchall()
+    
+    def query_one(self, sql, params=()):
+        with self.read() as cursor:
+            return cursor.execute(sql, params).fetchone()
+    
+    def execute(self, sql, params=()):
+        """Single write statement in its own transaction; returns lastrowid"""
+        with self.write() as cursor:
+            cursor.execute(sql, params)
+            return cursor.lastrowid
+    
+    def defer(self, sql, params=()):
+        """Queue a write nothing reads back immediately; flushed in batches by a background thread"""
+        with self._pending_lock:
+            self._pending.append((sql, tuple(params)))
+            full = len(self._pending) >= DB_WRITE_BATCH
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name='db-flusher', daemon=True)
+                self._flusher.start()
+        if full:
+            self.flush()
+    
+    def _flush_loop(self):
+        while True:
+            time.sleep(DB_WRITE_FLUSH_SECONDS)
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"⚠️ Deferred writes not flushed: {e}")
+    
+    def flush(self):
+        """Write all queued statements in one transaction"""
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return 0
+        try:
+            with self.write() as cursor:
+                for sql, params in pending:
+                    cursor.execute(sql, params)
+        except Exception:
+            with self._pending_lock:
+                self._pending[:0] = pending
             raise
+        with self._lock:
+            self._stats['deferred_writes'] += len(pending)
+            self._stats['flushes'] += 1
+        return len(pending)
+    
+    def reset(self):
+        """Drop idle connections so the next checkouts reconnect (after fork or a backend change)"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._close(conn)
     
-    return _local.conn
+    def vacuum(self):
+        if self.backend.supports_vacuum:
+            with self.connection() as conn:
+                conn.execute("VACUUM")
+    
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, size=self.size, idle=len(self._idle))
+        with self._pending_lock:
+            stats['pending_writes'] = len(self._pending)
+        stats['wait_ms'] = round(stats['wait_ms'], 1)
+        stats.update(self.backend.describe())
+        return stats
+
+db = Database(LibsqlReplicaBackend() if DB_BACKEND == 'libsql' else SqliteBackend())
+atexit.register(lambda: db.flush())
+# SQLite handles must not cross fork (gunicorn --preload); children reconnect lazily
+os.register_at_fork(after_in_child=db.reset)
 
-def init_db():
-    """Initialize database with required tables"""
-    global _db_initialized
+def ensure_column(cursor, table, column, definition):
+    """Add a column to an existing table if it is missing"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        logger.info(f"✅ Added column {table}.{column}")
+
+def init_db(recover_jobs=True):
+    """Initialize database with required tables; recover_jobs=False for tools that share the
+    database with a running server (the batch CLI) and must leave its jobs alone"""
+    global _db_initialized, _fts_available
     
     if _db_initialized:
         return True
@@ -70,345 +798,3411 @@ def init_db():
             return True
         
         try:
-            print("📝 Initializing database...", flush=True)
-            conn = get_sqlite_connection()
-            cursor = conn.cursor()
-            
-            # Create tables
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS ocr_results (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    filename TEXT NOT NULL,
-                    extracted_text TEXT NOT NULL,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS dv_models (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    ocr_id INTEGER NOT NULL,
-                    model_json TEXT NOT NULL,
-                    grounded INTEGER DEFAULT 0,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY (ocr_id) REFERENCES ocr_results(id)
-                )
-            """)
-            
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS knowledge_docs (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    name TEXT NOT NULL,
-                    content TEXT NOT NULL,
-                    uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            
-            # Create indexes
-            try:
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_ocr_created ON ocr_results(created_at DESC)")
-                cursor.execute("CREATE INDEX IF NOT EXISTS idx_models_ocr ON dv_models(ocr_id)")
-            except:
-                pass
+            logger.info("📝 Initializing database...")
+            with db.write() as cursor:
+                # Create tables
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS ocr_results (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        filename TEXT NOT NULL,
+                        extracted_text TEXT NOT NULL,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS dv_models (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        ocr_id INTEGER NOT NULL,
+                        model_json TEXT NOT NULL,
+                        grounded INTEGER DEFAULT 0,
+                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                        FOREIGN KEY (ocr_id) REFERENCES ocr_results(id)
+                    )
+                """)
+                
+                # Normalized model storage: one row per node / edge, reasoning compressed per model
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS dv_model_nodes (
+                        model_id INTEGER NOT NULL,
+                        position INTEGER NOT NULL,
+                        node_id TEXT NOT NULL,
+                        type TEXT,
+                        parent TEXT,
+                        business_key TEXT,
+                        attributes TEXT,
+                        connects TEXT,
+                        extra TEXT,
+                        PRIMARY KEY (model_id, position)
+                    ) WITHOUT ROWID
+                """)
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS dv_model_edges (
+                        model_id INTEGER NOT NULL,
+                        position INTEGER NOT NULL,
+                        from_node TEXT,
+                        to_node TEXT,
+                        extra TEXT,
+                        PRIMARY KEY (model_id, position)
+                    ) WITHOUT ROWID
+                """)
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS dv_model_reasoning (
+                        model_id INTEGER PRIMARY KEY,
+                        codec TEXT NOT NULL,
+                        data BLOB NOT NULL
+                    )
+                """)
+                
+                # Per-model table fingerprints, the baseline for incremental regeneration
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS dv_model_tables (
+                        model_id INTEGER NOT NULL,
+                        table_key TEXT NOT NULL,
+                        table_name TEXT NOT NULL,
+                        digest TEXT NOT NULL,
+                        PRIMARY KEY (model_id, table_key)
+                    ) WITHOUT ROWID
+                """)
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS dv_model_layouts (
+                        model_id INTEGER PRIMARY KEY,
+                        version TEXT NOT NULL,
+                        data BLOB NOT NULL
+                    )
+                """)
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS model_cache (
+                        cache_key TEXT PRIMARY KEY,
+                        model_json TEXT NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_accessed REAL NOT NULL,
+                        hit_count INTEGER DEFAULT 0
+                    )
+                """)
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS jobs (
+                        id TEXT PRIMARY KEY,
+                        kind TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        progress TEXT,
+                        params_json TEXT,
+                        result_json TEXT,
+                        error TEXT,
+                        created_at REAL NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS llm_usage (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        created_at REAL NOT NULL,
+                        kind TEXT NOT NULL,
+                        model TEXT,
+                        prompt_variant TEXT,
+                        tables INTEGER,
+                        estimated_prompt_tokens INTEGER,
+                        prompt_tokens INTEGER,
+                        completion_tokens INTEGER,
+                        max_tokens INTEGER,
+                        finish_reason TEXT,
+                        latency_ms REAL,
+                        error TEXT
+                    )
+                """)
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS idempotency_keys (
+                        key TEXT PRIMARY KEY,
+                        fingerprint TEXT NOT NULL,
+                        status INTEGER,
+                        mimetype TEXT,
+                        body BLOB,
+                        created_at REAL NOT NULL,
+                        completed_at REAL
+                    )
+                """)
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS batches (
+                        id TEXT PRIMARY KEY,
+                        source TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        options_json TEXT,
+                        created_at REAL NOT NULL,
+                        updated_at REAL NOT NULL
+                    )
+                """)
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS batch_items (
+                        batch_id TEXT NOT NULL,
+                        item_key TEXT NOT NULL,
+                        filename TEXT NOT NULL,
+                        file_digest TEXT NOT NULL,
+                        status TEXT NOT NULL,
+                        duplicate_of TEXT,
+                        source_path TEXT,
+                        content BLOB,
+                        ocr_id INTEGER,
+                        model_id INTEGER,
+                        reused INTEGER DEFAULT 0,
+                        error TEXT,
+                        ocr_seconds REAL,
+                        generate_seconds REAL,
+                        total_seconds REAL,
+                        updated_at REAL,
+                        PRIMARY KEY (batch_id, item_key)
+                    )
+                """)
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS knowledge_docs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name TEXT NOT NULL,
+                        content TEXT NOT NULL,
+                        uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                    )
+                """)
+                
+                cursor.execute("""
+                    CREATE TABLE IF NOT EXISTS knowledge_chunks (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        doc_id INTEGER NOT NULL,
+                        chunk_index INTEGER NOT NULL,
+                        content TEXT NOT NULL,
+                        FOREIGN KEY (doc_id) REFERENCES knowledge_docs(id)
+                    )
+                """)
+                
+                # Full-text index over knowledge chunks (BM25 fallback in Python without FTS5)
+                try:
+                    cursor.execute("""
+                        CREATE VIRTUAL TABLE IF NOT EXISTS knowledge_fts USING fts5(
+                            content, content='knowledge_chunks', content_rowid='id'
+                        )
+                    """)
+                    _fts_available = True
+                except DB_ERRORS as e:
+                    logger.warning(f"⚠️ FTS5 unavailable, using in-process BM25: {e}")
+                    _fts_available = False
+                
+                # Migrate older databases
+                ensure_column(cursor, 'ocr_results', 'file_digest', 'TEXT')
+                ensure_column(cursor, 'dv_models', 'storage', "TEXT DEFAULT 'json'")
+                ensure_column(cursor, 'dv_models', 'parent_id', 'INTEGER')
+                ensure_column(cursor, 'dv_models', 'version', 'INTEGER DEFAULT 1')
+                ensure_column(cursor, 'dv_models', 'mode', 'TEXT')
+                ensure_column(cursor, 'dv_models', 'context_digest', 'TEXT')
+                ensure_column(cursor, 'dv_models', 'knowledge_digest', 'TEXT')
+                ensure_column(cursor, 'dv_model_nodes', 'source_table', 'TEXT')
+                ensure_column(cursor, 'jobs', 'owner', 'TEXT')
+                ensure_column(cursor, 'jobs', 'heartbeat_at', 'REAL')
+                ensure_column(cursor, 'idempotency_keys', 'claimed_at', 'REAL')
+                
+                # Create indexes
+                try:
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ocr_created ON ocr_results(created_at DESC)")
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_models_ocr ON dv_models(ocr_id)")
+                    # Covering indexes for the keyset-paginated model history
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_models_created ON dv_models(created_at DESC, id DESC, ocr_id, grounded)")
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_models_grounded ON dv_models(grounded, created_at DESC, id DESC, ocr_id)")
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON model_cache(last_accessed)")
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_ocr_digest ON ocr_results(file_digest)")
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_jobs_updated ON jobs(updated_at)")
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_batches_source ON batches(source, created_at DESC)")
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_created ON llm_usage(created_at)")
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON knowledge_chunks(doc_id, chunk_index)")
+                    cursor.execute("CREATE INDEX IF NOT EXISTS idx_idempotency_created ON idempotency_keys(created_at)")
+                except:
+                    pass
+                
+                # Index knowledge docs uploaded before chunking existed
+                cursor.execute("""
+                    SELECT id, content FROM knowledge_docs
+                    WHERE id NOT IN (SELECT DISTINCT doc_id FROM knowledge_chunks)
+                """)
+                for doc in cursor.fetchall():
+                    index_knowledge_doc(cursor, doc['id'], doc['content'])
+                
+                # Jobs whose process is gone can never finish; live instances keep their leases
+                if recover_jobs:
+                    recover_stale_jobs()
+                
+                # Move JSON blobs into the normalized tables
+                migrated = migrate_model_storage(cursor)
             
-            conn.commit()
+            if migrated:
+                # Reclaim the space freed by the emptied blobs
+                db.vacuum()
             _db_initialized = True
-            print("✅ Database initialized", flush=True)
+            logger.info("✅ Database initialized")
             return True
             
         except Exception as e:
-            print(f"❌ Database init error: {e}", flush=True)
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"❌ Database init error: {e}")
             return False
 
-def allowed_file(filename):
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+# Repositories: routes and pipeline helpers read and write OCR results, models, jobs, batches,
+# idempotency keys, knowledge docs and usage through these functions instead of holding cursors.
+# Calls made inside an outer db.write() join its transaction. Model nodes, edges and reasoning
+# are stored by the normalized model storage functions further down (store_dv_model, load_stored_model)
+# OCR results
+def insert_ocr_result(filename, extracted_text, file_digest=None):
+    """Insert an OCR row and return its id"""
+    return db.execute(
+        "INSERT INTO ocr_results (filename, extracted_text, file_digest, created_at) VALUES (?, ?, ?, ?)",
+        (filename, extracted_text, file_digest, datetime.now().isoformat())
+    )
 
-def extract_text_ocr(filepath):
-    """Extract text from image using OCR.space API"""
-    if not OCR_API_KEY:
-        raise ValueError("OCR_SPACE_KEY not configured")
-    
-    try:
-        print(f"📤 Sending to OCR.space...", flush=True)
-        
-        with open(filepath, 'rb') as f:
-            response = requests.post(
-                'https://api.ocr.space/parse/image',
-                files={'file': f},
-                data={
-                    'apikey': OCR_API_KEY,
-                    'language': 'eng',
-                    'isOverlayRequired': 'false',
-                    'detectOrientation': 'true',
-                    'scale': 'true',
-                    'OCREngine': '2'
-                },
-                timeout=120
-            )
-        
-        print(f"📥 OCR status: {response.status_code}", flush=True)
-        response.raise_for_status()
-        result = response.json()
-        
-        if result.get('IsErroredOnProcessing'):
-            raise Exception(result.get('ErrorMessage', 'OCR failed'))
-        
-        if not result.get('ParsedResults') or len(result['ParsedResults']) == 0:
-            raise Exception('No OCR results')
-        
-        text = result['ParsedResults'][0].get('ParsedText', '')
-        if not text:
-            raise Exception('Empty OCR text')
-        
-        print(f"✅ OCR extracted {len(text)} chars", flush=True)
-        return text
-    
-    except requests.exceptions.Timeout:
-        raise Exception("OCR timeout - try smaller image")
-    except Exception as e:
-        print(f"❌ OCR error: {e}", flush=True)
-        raise Exception(f"OCR error: {str(e)}")
+def find_ocr_by_digest(file_digest):
+    """Return the most recent OCR row for an identical upload, if any"""
+    return db.query_one(
+        "SELECT id, extracted_text FROM ocr_results WHERE file_digest = ? ORDER BY id DESC LIMIT 1",
+        (file_digest,)
+    )
 
-def validate_dv_model(model):
-    """Validate model structure and naming conventions"""
-    if not isinstance(model, dict):
-        raise ValueError("Model must be dict")
-    if 'nodes' not in model or not isinstance(model['nodes'], list):
-        raise ValueError("Model must have 'nodes' array")
-    if len(model['nodes']) == 0:
-        raise ValueError("Model must have nodes")
-    
-    node_ids = set()
-    for node in model['nodes']:
-        if 'id' not in node or not node['id']:
-            raise ValueError("All nodes need 'id'")
-        if 'type' not in node:
-            raise ValueError(f"Node {node['id']} needs 'type'")
-        
-        node_type = node['type']
-        node_id = node['id']
-        
-        # Enforce naming convention
-        if node_type == 'hub' and not node_id.startswith('Hub_'):
-            raise ValueError(f"Hub must be named 'Hub_*', got: {node_id}")
-        if node_type == 'link' and not node_id.startswith('Link_'):
-            raise ValueError(f"Link must be named 'Link_*', got: {node_id}")
-        if node_type == 'satellite' and not node_id.startswith('Sat_'):
-            raise ValueError(f"Satellite must be named 'Sat_*', got: {node_id}")
-        
-        # Check for reasoning
-        if 'reasoning' not in node or not node['reasoning']:
-            raise ValueError(f"Node {node_id} must have 'reasoning' field")
-        
-        node_ids.add(node_id)
-    
-    return True
+def get_ocr_text(ocr_id):
+    """Extracted text of an OCR result, or None"""
+    row = db.query_one("SELECT extracted_text FROM ocr_results WHERE id = ?", (ocr_id,))
+    return row['extracted_text'] if row else None
 
-def generate_dv_model(ocr_text, grounded=False, knowledge_content=''):
-    """Generate Data Vault model using GROQ with reasoning and strict naming"""
-    if not GROQ_API_KEY:
-        raise ValueError("GROQ_API_KEY not configured")
-    
-    system_prompt = "You are an expert Data Vault 2.1 modeler with deep understanding of hub, link, and satellite structures."
-    if grounded and knowledge_content:
-        system_prompt = f"""You are a Data Vault 2.1 expert. Use these guidelines:
-{knowledge_content[:2000]}"""
-    
-    user_prompt = f"""Analyze this source schema and convert it to Data Vault 2.1 model WITH REASONING.
+def ocr_result_exists(ocr_id):
+    return db.query_one("SELECT 1 FROM ocr_results WHERE id = ?", (ocr_id,)) is not None
 
-SOURCE SCHEMA:
-{ocr_text[:3000]}
+def replace_ocr_text(ocr_id, extracted_text):
+    """Overwrite an OCR result's text; returns the previous text, or None if there is no such result"""
+    with db.write() as cursor:
+        previous = cursor.execute("SELECT extracted_text FROM ocr_results WHERE id = ?", (ocr_id,)).fetchone()
+        if not previous:
+            return None
+        cursor.execute("UPDATE ocr_results SET extracted_text = ? WHERE id = ?", (extracted_text, ocr_id))
+    return previous['extracted_text']
 
-CLASSIFICATION DECISION TREE:
+# Models (nodes, edges and reasoning are read and written by the normalized model storage helpers)
+def models_etag():
+    """History listing validator taken from the table itself, so models written by other
+    processes (the batch CLI, other replica instances) change it too"""
+    row = db.query_one("SELECT COALESCE(MAX(id), 0) AS last_id, COUNT(*) AS total FROM dv_models")
+    return f"models-{row['last_id']}-{row['total']}"
 
-STEP 1: "Is this a PRIMARY THING the business cares about independently?"
-   - YES → HUB (Customer, Product, Film, Store, Employee, Actor, Inventory, City, Country)
-   - NO → Go to STEP 2
+def list_models(limit, filename=None, node=None, grounded=None, created_from=None, created_to=None, before=None):
+    """Up to limit models newest first with their OCR filename; LIKE patterns come escaped,
+    before is the (created_at, id) keyset cursor"""
+    where = []
+    params = []
+    if filename:
+        where.append("o.filename LIKE ? ESCAPE '\\'")
+        params.append(filename)
+    if node:
+        where.append("""EXISTS (SELECT 1 FROM dv_model_nodes n WHERE n.model_id = m.id
+                        AND (n.node_id LIKE ? ESCAPE '\\' OR n.business_key LIKE ? ESCAPE '\\'))""")
+        params.extend([node] * 2)
+    if grounded is not None:
+        where.append("m.grounded = ?")
+        params.append(1 if grounded else 0)
+    if created_from:
+        where.append("m.created_at >= ?")
+        params.append(created_from)
+    if created_to:
+        where.append("m.created_at < ?")
+        params.append(created_to)
+    if before:
+        where.append("(m.created_at, m.id) < (?, ?)")
+        params.extend(before)
+    
+    return db.query(f"""
+        SELECT m.id, m.ocr_id, o.filename, m.grounded, m.created_at
+        FROM dv_models m
+        JOIN ocr_results o ON m.ocr_id = o.id
+        {'WHERE ' + ' AND '.join(where) if where else ''}
+        ORDER BY m.created_at DESC, m.id DESC
+        LIMIT ?
+    """, params + [limit])
 
-STEP 2: "Does it CONNECT multiple business things (many-to-many relationship)?"
-   - YES → LINK (Actor_Film, Customer_Order, Film_Category, Inventory_Store, City_Country)
-   - NO → Go to STEP 3
+def model_exists(model_id):
+    return db.query_one("SELECT 1 FROM dv_models WHERE id = ?", (model_id,)) is not None
 
-STEP 3: "Does it DESCRIBE/ADD CONTEXT to another entity with non-key attributes?"
-   - YES → SATELLITE (Customer_Details, Order_Status, Film_Metadata)
-   - NO → Likely an error or derived table
+def existing_model_ids(model_ids):
+    """The subset of model_ids that are stored"""
+    found = set()
+    for start in range(0, len(model_ids), 500):
+        batch = model_ids[start:start + 500]
+        rows = db.query(f"SELECT id FROM dv_models WHERE id IN ({', '.join('?' * len(batch))})", batch)
+        found.update(row['id'] for row in rows)
+    return found
 
-KEY TESTS FOR CLASSIFICATION:
-- HUB test: "Would we query/care about this entity independently?" If YES → HUB
-- LINK test: "Does this answer 'many X relate to many Y'?" If YES → LINK
-- SAT test: "Is this only useful as context for something else?" If YES → SATELLITE
+def load_model_version(model_id, types=None, include_reasoning=True):
+    """{'model', 'version', 'parent_id'} of a stored model, optionally only some node types or
+    without reasoning; None if it doesn't exist"""
+    with db.read() as cursor:
+        row = cursor.execute("SELECT model_json, storage, version, parent_id FROM dv_models WHERE id = ?",
+                             (model_id,)).fetchone()
+        if not row:
+            return None
+        if row['storage'] == 'normalized':
+            model = load_stored_model(cursor, model_id, types, include_reasoning)
+        else:
+            model = json.loads(row['model_json'])
+    return {'model': model, 'version': row['version'] or 1, 'parent_id': row['parent_id']}
 
-MANDATORY NAMING CONVENTION - STRICT ENFORCEMENT:
-- ALL Hubs MUST start with "Hub_" → Hub_Actor, Hub_Film, Hub_Customer, Hub_Store, Hub_City
-- ALL Links MUST start with "Link_" → Link_Actor_Film, Link_Customer_Order, Link_Film_Category
-- ALL Satellites MUST start with "Sat_" → Sat_Actor_Profile, Sat_Film_Details, Sat_Customer_Contact
+def load_model_any(model_id):
+    """Full model by id from either storage format, or None"""
+    with db.read() as cursor:
+        row = cursor.execute("SELECT model_json, storage, parent_id FROM dv_models WHERE id = ?",
+                             (model_id,)).fetchone()
+        if not row:
+            return None, None
+        if row['storage'] == 'normalized':
+            return load_stored_model(cursor, model_id, include_reasoning=False), row['parent_id']
+    return json.loads(row['model_json']), row['parent_id']
 
-This prevents confusion and ensures clarity. FAILURE TO FOLLOW NAMING = INVALID MODEL.
+def load_patch_parent(model_id):
+    """(model, node id → source table) of a stored normalized model, for patching it"""
+    with db.read() as cursor:
+        return load_stored_model(cursor, model_id), load_node_tables(cursor, model_id)
 
-DATA VAULT 2.1 STRUCTURE:
+# Jobs
+def insert_job(job_id, kind, params, owner):
+    """Queue a job row owned by this instance and drop finished jobs past JOB_RETENTION"""
+    now = time.time()
+    with db.write() as cursor:
+        cursor.execute(
+            """INSERT INTO jobs (id, kind, status, progress, params_json, created_at, updated_at, owner, heartbeat_at)
+               VALUES (?, ?, 'queued', 'Queued', ?, ?, ?, ?, ?)""",
+            (job_id, kind, json.dumps(params), now, now, owner, now)
+        )
+        cursor.execute(
+            "DELETE FROM jobs WHERE status IN ('succeeded', 'failed') AND updated_at < ?",
+            (now - JOB_RETENTION,)
+        )
 
-1. HUBS = Core business entities (main tables/nouns)
-   - Primary entities that exist independently
-   - Contain ONLY the business key column
-   - Examples: Hub_Customer, Hub_Actor, Hub_Film, Hub_Store, Hub_City, Hub_Country
-   - Name format: Hub_EntityName
+def find_job(job_id):
+    return db.query_one("SELECT * FROM jobs WHERE id = ?", (job_id,))
 
-2. LINKS = Relationships BETWEEN Hubs (association/junction tables)
-   - Represent many-to-many relationships or business events
-   - Must have "connects" array listing Hub IDs it bridges
-   - Examples: Link_Actor_Film, Link_Customer_Order, Link_Inventory_Store
-   - Name format: Link_Entity1_Entity2
-   - CRITICAL: Links connect 2+ independent Hubs
+def update_job_row(job_id, **fields):
+    fields['updated_at'] = time.time()
+    db.execute(f"UPDATE jobs SET {', '.join(f'{name} = ?' for name in fields)} WHERE id = ?",
+               list(fields.values()) + [job_id])
 
-3. SATELLITES = Descriptive attributes (non-key columns)
-   - Contains all descriptive/contextual data
-   - Must have a parent Hub or Link
-   - Examples: Sat_Customer_Details, Sat_Film_Metadata, Sat_Actor_Profile
-   - Name format: Sat_ParentEntity_Descriptor
-   - Each satellite should have a clear, descriptive purpose
+def renew_job_leases(owner):
+    """Heartbeat for the unfinished jobs an instance owns"""
+    db.execute("UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ('queued', 'running')",
+               (time.time(), owner))
+
+def recover_stale_jobs(job_id=None):
+    """Fail queued/running jobs whose owner stopped renewing their lease (crashed, killed or
+    redeployed); returns how many were failed"""
+    now = time.time()
+    sql = """UPDATE jobs SET status = 'failed', progress = 'Failed', error = ?, updated_at = ?
+             WHERE status IN ('queued', 'running') AND COALESCE(heartbeat_at, updated_at) < ?"""
+    params = ['Interrupted: the server running it stopped', now, now - JOB_LEASE_SECONDS]
+    if job_id:
+        sql += " AND id = ?"
+        params.append(job_id)
+    with db.write() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+# Batches
+def insert_batch(batch_id, source, options, item_rows):
+    """Batch row plus its items as (batch_id, item_key, filename, file_digest, status, duplicate_of,
+    source_path, content) tuples"""
+    now = time.time()
+    with db.write() as cursor:
+        cursor.execute(
+            "INSERT INTO batches (id, source, status, options_json, created_at, updated_at) VALUES (?, ?, 'pending', ?, ?, ?)",
+            (batch_id, source, json.dumps(options), now, now)
+        )
+        cursor.executemany("""
+            INSERT INTO batch_items (batch_id, item_key, filename, file_digest, status, duplicate_of, source_path, content)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, item_rows)
+
+def find_resumable_batch(source):
+    """Most recent unfinished batch for a source, if any"""
+    row = db.query_one(
+        "SELECT id FROM batches WHERE source = ? AND status != 'completed' ORDER BY created_at DESC LIMIT 1",
+        (source,)
+    )
+    return row['id'] if row else None
+
+def start_batch_run(batch_id, retry_failed=False):
+    """Mark a batch running and put its unfinished items back to pending; returns (batch, pending items),
+    or (None, None) if there is no such batch"""
+    with db.write() as cursor:
+        batch = cursor.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if not batch:
+            return None, None
+        
+        # Rows left 'running' by an interrupted run start over
+        retry = ('running', 'failed') if retry_failed else ('running',)
+        cursor.execute(
+            f"UPDATE batch_items SET status = 'pending' WHERE batch_id = ? AND status IN ({', '.join('?' * len(retry))})",
+            (batch_id, *retry)
+        )
+        cursor.execute("UPDATE batches SET status = 'running', updated_at = ? WHERE id = ?", (time.time(), batch_id))
+        items = cursor.execute(
+            "SELECT * FROM batch_items WHERE batch_id = ? AND status = 'pending' ORDER BY item_key", (batch_id,)
+        ).fetchall()
+    return batch, items
+
+def set_batch_status(batch_id, status):
+    db.execute("UPDATE batches SET status = ?, updated_at = ? WHERE id = ?", (status, time.time(), batch_id))
+
+def update_batch_item(batch_id, item_key, **fields):
+    fields['updated_at'] = time.time()
+    db.execute(
+        f"UPDATE batch_items SET {', '.join(f'{name} = ?' for name in fields)} WHERE batch_id = ? AND item_key = ?",
+        list(fields.values()) + [batch_id, item_key]
+    )
+
+def load_batch(batch_id):
+    """(batch, item rows) of a batch, or (None, None)"""
+    with db.read() as cursor:
+        batch = cursor.execute("SELECT * FROM batches WHERE id = ?", (batch_id,)).fetchone()
+        if not batch:
+            return None, None
+        
+        rows = cursor.execute("""
+            SELECT item_key, filename, file_digest, status, duplicate_of, ocr_id, model_id, reused, error,
+                   ocr_seconds, generate_seconds, total_seconds
+            FROM batch_items WHERE batch_id = ? ORDER BY item_key
+        """, (batch_id,)).fetchall()
+    return batch, rows
+
+# Idempotency keys
+def purge_idempotency_keys(before):
+    db.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (before,))
+
+def insert_idempotency_key(key, fingerprint, now):
+    """Claim a new key; False if it already exists"""
+    with db.write() as cursor:
+        cursor.execute(
+            "INSERT OR IGNORE INTO idempotency_keys (key, fingerprint, created_at, claimed_at) VALUES (?, ?, ?, ?)",
+            (key, fingerprint, now, now)
+        )
+        return cursor.rowcount > 0
+
+def take_over_idempotency_key(key, fingerprint, now, stale_before):
+    """Re-claim an unanswered key whose claim is older than stale_before; False if it isn't one"""
+    with db.write() as cursor:
+        cursor.execute("""
+            UPDATE idempotency_keys SET claimed_at = ?
+            WHERE key = ? AND fingerprint = ? AND status IS NULL AND COALESCE(claimed_at, created_at) < ?
+        """, (now, key, fingerprint, stale_before))
+        return cursor.rowcount > 0
+
+def get_idempotency_key(key):
+    return db.query_one("SELECT * FROM idempotency_keys WHERE key = ?", (key,))
+
+def delete_idempotency_key(key):
+    db.execute("DELETE FROM idempotency_keys WHERE key = ?", (key,))
+
+def save_idempotent_response(key, status, mimetype, body):
+    db.execute(
+        "UPDATE idempotency_keys SET status = ?, mimetype = ?, body = ?, completed_at = ? WHERE key = ?",
+        (status, mimetype, body, time.time(), key)
+    )
+
+# Knowledge docs and usage
+def insert_knowledge_doc(name, content):
+    """Store and index a methodology doc; returns its chunk count"""
+    with db.write() as cursor:
+        cursor.execute(
+            "INSERT INTO knowledge_docs (name, content, uploaded_at) VALUES (?, ?, ?)",
+            (name, content, datetime.now().isoformat())
+        )
+        return index_knowledge_doc(cursor, cursor.lastrowid, content)
+
+def llm_usage_since(since):
+    """llm_usage rows from since on, oldest first, including deferred writes not yet flushed"""
+    db.flush()
+    return db.query("SELECT * FROM llm_usage WHERE created_at >= ? ORDER BY created_at", (since,))
+
+# Outbound HTTP clients: pooled sessions, retry/backoff, rate limiting, circuit breaking
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class CircuitOpenError(Exception):
+    pass
+
+class TokenBucket:
+    """Thread-safe token bucket; acquire() blocks until a token is available"""
+    
+    def __init__(self, rate, capacity):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+    
+    def try_acquire(self):
+        """Take a token if one is available; returns 0 or the seconds until the next one"""
+        if self.rate <= 0:
+            return 0.0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+    
+    def acquire(self):
+        waited = 0.0
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+class CircuitBreaker:
+    """Opens after consecutive failures, then lets one probe through after reset_timeout"""
+    
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+    
+    @property
+    def state(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 'closed'
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return 'half_open'
+            return 'open'
+    
+    def allow(self):
+        """False while open; 'probe' for the one half-open trial call, which must end in
+        record_success/record_failure or release_probe; True when closed"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at >= self.reset_timeout and not self.probing:
+                self.probing = True
+                return 'probe'
+            return False
+    
+    def release_probe(self):
+        """Give up a probe that ended without an outcome, so the next call can probe again"""
+        with self.lock:
+            self.probing = False
+    
+    def retry_in(self):
+        with self.lock:
+            if self.opened_at is None:
+                return 0
+            return max(0, int(self.reset_timeout - (time.monotonic() - self.opened_at)))
+    
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+    
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+            self.probing = False
+
+class ProviderClient:
+    """Shared keep-alive session for one upstream provider"""
+    
+    def __init__(self, name, pool_size, rate, burst, max_retries, backoff_base, backoff_cap,
+                 failure_threshold, reset_timeout, span_name='provider_call'):
+        self.name = name
+        self.span_name = span_name
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.bucket = TokenBucket(rate, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.stats = {'requests': 0, 'retries': 0, 'failures': 0, 'rejected': 0, 'throttled_seconds': 0.0}
+        self.stats_lock = threading.Lock()
+        
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+    
+    def _bump(self, name, amount=1):
+        with self.stats_lock:
+            self.stats[name] += amount
+    
+    def _backoff(self, attempt, response=None):
+        """Delay before the next attempt, honoring Retry-After when present"""
+        if response is not None:
+            retry_after = response.headers.get('Retry-After')
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_cap)
+                except ValueError:
+                    pass
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+    
+    def post(self, url, **kwargs):
+        """POST with retries on 429/5xx and connection errors"""
+        with span(self.span_name):
+            response = self._post(url, **kwargs)
+        PROVIDER_RESPONSES.inc(self.name, response.status_code)
+        return response
+    
+    def _post(self, url, **kwargs):
+        attempt = 0
+        while True:
+            admitted = self.breaker.allow()
+            if not admitted:
+                self._bump('rejected')
+                raise CircuitOpenError(
+                    f"{self.name} temporarily unavailable (circuit open), retry in {self.breaker.retry_in()}s"
+                )
+            
+            try:
+                self._bump('throttled_seconds', self.bucket.acquire())
+                self._bump('requests')
+                
+                try:
+                    response = self.session.post(url, **kwargs)
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                    self.breaker.record_failure()
+                    self._bump('failures')
+                    if attempt >= self.max_retries or isinstance(e, requests.exceptions.ReadTimeout):
+                        raise
+                    delay = self._backoff(attempt)
+                else:
+                    if response.status_code not in RETRY_STATUSES:
+                        self.breaker.record_success()
+                        return response
+                    
+                    # 429 means we are being throttled, not that the provider is down
+                    if response.status_code >= 500:
+                        self.breaker.record_failure()
+                        self._bump('failures')
+                    else:
+                        self.breaker.record_success()
+                    
+                    if attempt >= self.max_retries:
+                        return response
+                    delay = self._backoff(attempt, response)
+                    response.close()
+            finally:
+                # Any other exception (ChunkedEncodingError, InvalidURL...) must not leave the probe taken
+                if admitted == 'probe':
+                    self.breaker.release_probe()
+            
+            attempt += 1
+            self._bump('retries')
+            logger.info(f"🔁 {self.name} retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            time.sleep(delay)
+    
+    def snapshot(self):
+        with self.stats_lock:
+            stats = dict(self.stats)
+        stats['throttled_seconds'] = round(stats['throttled_seconds'], 3)
+        stats['circuit'] = self.breaker.state
+        return stats
+
+def _client_setting(provider, name, default, minimum=None):
+    value = type(default)(os.getenv(f'{provider}_{name}', str(default)))
+    if minimum is not None and value < minimum:
+        raise ValueError(f"{provider}_{name} must be at least {minimum} (got {value})")
+    return value
+
+ocr_client = ProviderClient(
+    'OCR.space',
+    pool_size=_client_setting('OCR', 'POOL_SIZE', 8),
+    rate=_client_setting('OCR', 'RATE_PER_SEC', 1.0),
+    burst=_client_setting('OCR', 'RATE_BURST', 3, minimum=1),
+    max_retries=_client_setting('OCR', 'MAX_RETRIES', 2),
+    backoff_base=_client_setting('OCR', 'BACKOFF_BASE', 1.0),
+    backoff_cap=_client_setting('OCR', 'BACKOFF_CAP', 20.0),
+    failure_threshold=_client_setting('OCR', 'BREAKER_THRESHOLD', 5),
+    reset_timeout=_client_setting('OCR', 'BREAKER_RESET', 30.0),
+    span_name='ocr_http'
+)
+
+groq_client = ProviderClient(
+    'GROQ',
+    pool_size=_client_setting('GROQ', 'POOL_SIZE', 8),
+    rate=_client_setting('GROQ', 'RATE_PER_SEC', 1.0),
+    burst=_client_setting('GROQ', 'RATE_BURST', 10, minimum=1),
+    max_retries=_client_setting('GROQ', 'MAX_RETRIES', 3),
+    backoff_base=_client_setting('GROQ', 'BACKOFF_BASE', 1.0),
+    backoff_cap=_client_setting('GROQ', 'BACKOFF_CAP', 20.0),
+    failure_threshold=_client_setting('GROQ', 'BREAKER_THRESHOLD', 5),
+    reset_timeout=_client_setting('GROQ', 'BREAKER_RESET', 30.0),
+    span_name='llm_call'
+)
+
+# Pipeline steps: the generation pipeline is written once as generators that yield the I/O they need.
+# run_steps performs each step with blocking calls; asgi.py drives the same generators with awaits.
+Post = namedtuple('Post', 'client url kwargs')          # ProviderClient.post -> response
+Blocking = namedtuple('Blocking', 'executor func args')  # func(*args) on the 'db' or 'cpu' executor -> result
+Gather = namedtuple('Gather', 'steps')                   # step generators run concurrently -> their results
+
+def run_steps(steps):
+    """Drive a step generator with blocking calls; returns its result"""
+    value, error = None, None
+    while True:
+        try:
+            step = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            if isinstance(step, Post):
+                value = step.client.post(step.url, **step.kwargs)
+            elif isinstance(step, Gather):
+                value = gather_steps(step.steps)
+            else:
+                value = step.func(*step.args)
+        except Exception as e:
+            error = e
+
+def gather_steps(steps_list):
+    """Run step generators on the chunk executor; the first failure (in order) cancels the rest"""
+    futures = [_chunk_executor.submit(run_steps, steps) for steps in steps_list]
+    results = []
+    for future in futures:
+        try:
+            results.append(future.result())
+        except Exception:
+            for pending in futures:
+                pending.cancel()
+            raise
+    return results
+
+def allowed_file(filename):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
+
+# Leading bytes of each accepted upload type
+FILE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'%PDF-', 'pdf'),
+)
+EXTENSION_TYPES = {'png': 'png', 'jpg': 'jpeg', 'jpeg': 'jpeg', 'gif': 'gif', 'pdf': 'pdf'}
+
+def sniff_file_type(head):
+    """Detect the upload type from its magic bytes"""
+    for signature, kind in FILE_SIGNATURES:
+        if head.startswith(signature):
+            return kind
+    return None
+
+@traced('file_save')
+def read_upload(file_storage, chunk_size=64 * 1024):
+    """Read an upload stream in chunks, returning (bytes, sha256 hex digest); raises ValueError on bad content"""
+    digest = hashlib.sha256()
+    buffer = io.BytesIO()
+    head = file_storage.stream.read(chunk_size)
+    
+    kind = sniff_file_type(head)
+    expected = EXTENSION_TYPES.get(file_storage.filename.rsplit('.', 1)[-1].lower())
+    if kind is None:
+        raise ValueError('Unsupported file content (expected PNG, JPEG, GIF or PDF)')
+    if kind != expected:
+        raise ValueError(f"File content is {kind.upper()} but the name says {expected or 'unknown'}")
+    
+    chunk = head
+    while chunk:
+        digest.update(chunk)
+        buffer.write(chunk)
+        chunk = file_storage.stream.read(chunk_size)
+    return buffer.getvalue(), digest.hexdigest()
+
+# OCR backends
+class OcrSpaceBackend:
+    """OCR.space cloud API (accepts images and whole PDFs)"""
+    
+    name = 'ocrspace'
+    accepts_pdf = True
+    
+    def check(self):
+        if not OCR_API_KEY:
+            raise ValueError("OCR_SPACE_KEY not configured")
+    
+    def available(self):
+        return bool(OCR_API_KEY)
+    
+    def request_args(self, file_bytes, filename):
+        """Keyword arguments of the OCR.space POST (shared with the async client)"""
+        return {
+            'files': {'file': (filename, file_bytes)},
+            'data': {
+                'apikey': OCR_API_KEY,
+                'language': 'eng',
+                'isOverlayRequired': 'false',
+                'detectOrientation': 'true',
+                'scale': 'true',
+                'OCREngine': '2'
+            },
+            'timeout': 120
+        }
+    
+    def image_to_text(self, file_bytes, filename):
+        logger.info(f"📤 Sending to OCR.space...")
+        response = ocr_client.post(OCR_API_URL, **self.request_args(file_bytes, filename))
+        return self.read_response(response)
+    
+    def read_response(self, response):
+        logger.info(f"📥 OCR status: {response.status_code}")
+        response.raise_for_status()
+        result = response.json()
+        
+        if result.get('IsErroredOnProcessing'):
+            raise Exception(result.get('ErrorMessage', 'OCR failed'))
+        
+        if not result.get('ParsedResults') or len(result['ParsedResults']) == 0:
+            raise Exception('No OCR results')
+        
+        # One ParsedResult per page for multi-page documents
+        return '\n\n'.join(r.get('ParsedText', '').strip() for r in result['ParsedResults'] if r.get('ParsedText'))
+
+class TesseractBackend:
+    """Local Tesseract engine (offline; pytesseract runs the tesseract binary as a subprocess)"""
+    
+    name = 'tesseract'
+    accepts_pdf = False
+    
+    def check(self):
+        if pytesseract is None or PILImage is None:
+            raise ValueError("Tesseract backend requires pytesseract and Pillow")
+        if not self.available():
+            raise ValueError("Tesseract is not installed (set TESSERACT_CMD)")
+    
+    _available = None
+    
+    def available(self):
+        if pytesseract is None or PILImage is None:
+            return False
+        if self._available is None:
+            try:
+                if TESSERACT_CMD:
+                    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+                pytesseract.get_tesseract_version()
+                self._available = True
+            except Exception:
+                self._available = False
+        return self._available
+    
+    def image_to_text(self, file_bytes, filename):
+        logger.info(f"🔍 Running Tesseract on {filename}...")
+        if TESSERACT_CMD:
+            pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+        try:
+            with PILImage.open(io.BytesIO(file_bytes)) as image:
+                return pytesseract.image_to_string(image, lang=TESSERACT_LANG)
+        except Exception as e:
+            raise RuntimeError(f"Tesseract failed: {e}")
+
+OCR_BACKENDS = {backend.name: backend for backend in (OcrSpaceBackend(), TesseractBackend())}
+
+# Pages and tiles of both backends share one thread pool: OCR.space waits on the network and
+# pytesseract on the tesseract subprocess, so a process pool (forking a threaded worker) adds nothing
+_ocr_thread_pool = ThreadPoolExecutor(max_workers=OCR_PAGE_WORKERS, thread_name_prefix='ocr-page')
+
+def get_ocr_backend(name=None):
+    """Resolve an OCR backend by name (defaults to OCR_BACKEND)"""
+    name = (name or OCR_BACKEND).lower()
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend '{name}' (choose from {', '.join(OCR_BACKENDS)})")
+    return OCR_BACKENDS[name]
+
+def ocr_configured():
+    """Whether the default OCR backend can run"""
+    try:
+        return get_ocr_backend().available()
+    except ValueError:
+        return False
+
+# Image preprocessing: large scans and ERD exports are shrunk to what OCR needs before upload.
+# Images are downsampled to OCR_TARGET_DPI (or OCR_MAX_IMAGE_PIXELS), converted to grayscale,
+# deskewed, binarized and re-encoded as PNG; anything wider or taller than OCR_TILE_SIDE is cut
+# into overlapping tiles that are read in parallel and merged back in reading order
+def ink_threshold(histogram):
+    """Otsu threshold of a grayscale histogram, and whether the ink is lighter than the background"""
+    total = sum(histogram)
+    weighted_total = sum(value * count for value, count in enumerate(histogram))
+    weight = weighted = 0
+    best_variance, threshold = -1.0, 127
+    
+    for value, count in enumerate(histogram):
+        weight += count
+        if not weight:
+            continue
+        remaining = total - weight
+        if not remaining:
+            break
+        weighted += value * count
+        mean_dark = weighted / weight
+        mean_light = (weighted_total - weighted) / remaining
+        variance = weight * remaining * (mean_dark - mean_light) ** 2
+        if variance > best_variance:
+            best_variance, threshold = variance, value
+    
+    # Ink is the minority class: mostly-dark images are light text on a dark background
+    light_ink = sum(histogram[:threshold + 1]) > total / 2
+    return threshold, light_ink
+
+def _row_profile_score(image):
+    """Variance of per-row ink density, highest when text lines run horizontally"""
+    rows = list(image.resize((1, image.height), PILImage.BOX).getdata())
+    mean = sum(rows) / len(rows)
+    return sum((row - mean) ** 2 for row in rows) / len(rows)
+
+def estimate_skew(image, threshold, light_ink, sample_side=800):
+    """Rotation in degrees that straightens text lines (0.0 when none clearly helps)"""
+    sample = image.copy()
+    sample.thumbnail((sample_side, sample_side))
+    # Ink bright on black, so the corners filled in by rotation count as empty
+    sample = sample.point([255 if (value <= threshold) != light_ink else 0 for value in range(256)])
+    
+    baseline = _row_profile_score(sample)
+    scores = {0.0: baseline}
+    
+    def score(angle):
+        if angle not in scores:
+            scores[angle] = _row_profile_score(sample.rotate(angle, resample=PILImage.BILINEAR))
+        return scores[angle]
+    
+    coarse = max((float(a) for a in range(-int(OCR_DESKEW_MAX_ANGLE), int(OCR_DESKEW_MAX_ANGLE) + 1)), key=score)
+    best = max((coarse + step / 4 for step in range(-3, 4)), key=score)
+    
+    return best if abs(best) >= 0.25 and score(best) > baseline * 1.05 else 0.0
+
+def _tile_spans(length, side, overlap):
+    """Evenly spaced (start, end) spans covering length with at least overlap pixels shared;
+    lengths within one overlap of the tile side stay whole rather than add a sliver tile"""
+    if length <= side + overlap:
+        return [(0, length)]
+    count = math.ceil((length - overlap) / (side - overlap))
+    return [(start, start + side) for start in (round(i * (length - side) / (count - 1)) for i in range(count))]
+
+def split_tiles(image):
+    """Cut an image into overlapping OCR_TILE_SIDE tiles in row-major order; returns (tiles, columns)"""
+    xs = _tile_spans(image.width, OCR_TILE_SIDE, OCR_TILE_OVERLAP)
+    ys = _tile_spans(image.height, OCR_TILE_SIDE, OCR_TILE_OVERLAP)
+    tiles = [image.crop((left, top, right, bottom)) for top, bottom in ys for left, right in xs]
+    return tiles, len(xs)
+
+def _encode_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+def prepare_ocr_image(file_bytes, filename):
+    """Preprocessed image parts to OCR as ([(name, bytes)], columns); the original bytes when
+    preprocessing is off, Pillow is missing or the result would not be smaller"""
+    original = [(filename, file_bytes)], 1
+    if not OCR_PREPROCESS or PILImage is None:
+        return original
+    
+    start = time.perf_counter()
+    with span('image_preprocess'):
+        try:
+            with PILImage.open(io.BytesIO(file_bytes)) as source:
+                # First frame of animated GIFs; transparent exports are flattened onto white
+                source.seek(0)
+                dpi = source.info.get('dpi')
+                if source.mode in ('RGBA', 'LA', 'PA') or 'transparency' in source.info:
+                    flattened = PILImage.new('RGBA', source.size, 'white')
+                    flattened.alpha_composite(source.convert('RGBA'))
+                    image = flattened.convert('L')
+                else:
+                    image = source.convert('L')
+            width, height = image.size
+            
+            # Downsample (never upsample) to the target DPI and pixel budget
+            scale = 1.0
+            if dpi and dpi[0] and dpi[0] > OCR_TARGET_DPI:
+                scale = OCR_TARGET_DPI / float(dpi[0])
+            if width * height * scale * scale > OCR_MAX_IMAGE_PIXELS:
+                scale = math.sqrt(OCR_MAX_IMAGE_PIXELS / (width * height))
+            if scale < 1.0:
+                image = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), PILImage.LANCZOS)
+            
+            threshold, light_ink = ink_threshold(image.histogram())
+            angle = estimate_skew(image, threshold, light_ink) if OCR_DESKEW else 0.0
+            if angle:
+                background = 0 if light_ink else 255
+                image = image.rotate(angle, resample=PILImage.BICUBIC, expand=True, fillcolor=background)
+            
+            if OCR_BINARIZE:
+                # Dark ink on white regardless of the source polarity
+                image = image.point([0 if (value <= threshold) != light_ink else 255 for value in range(256)], '1')
+            
+            tiles, columns = split_tiles(image)
+            encoded = [_encode_png(tile) for tile in tiles]
+        except Exception as e:
+            logger.warning(f"⚠️ Image preprocessing skipped for {filename}: {e}")
+            return original
+    
+    before, after = len(file_bytes), sum(len(data) for data in encoded)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    OCR_IMAGE_BYTES.inc('original', amount=before)
+    
+    if len(encoded) == 1 and scale == 1.0 and not angle and after >= before:
+        OCR_IMAGE_BYTES.inc('sent', amount=before)
+        OCR_TILES.inc()
+        logger.info(f"🖼️ Preprocessing {filename} saved nothing ({after} >= {before} bytes, {elapsed_ms:.0f}ms): sending original")
+        return original
+    
+    OCR_IMAGE_BYTES.inc('sent', amount=after)
+    OCR_TILES.inc(amount=len(encoded))
+    logger.info(f"🖼️ Preprocessed {filename}: {width}x{height} → {image.width}x{image.height}"
+                f"{f', deskewed {angle:+.2f}°' if angle else ''}, {len(encoded)} tile(s), "
+                f"{before} → {after} bytes in {elapsed_ms:.0f}ms")
+    
+    stem = os.path.splitext(filename)[0]
+    if len(encoded) == 1:
+        return [(f"{stem}.png", encoded[0])], 1
+    return [(f"{stem}-tile{i + 1}.png", data) for i, data in enumerate(encoded)], columns
+
+def _line_runs(lines, size):
+    return {tuple(lines[i:i + size]) for i in range(len(lines) - size + 1)}
+
+def merge_tile_texts(texts, columns):
+    """Join tile texts in reading order, dropping runs of OCR_TILE_DEDUP_LINES or more lines already
+    read from the tile to the left or above (the shared overlap)"""
+    size = OCR_TILE_DEDUP_LINES
+    contents = [[line.strip() for line in text.splitlines() if line.strip()] for text in texts]
+    merged = []
+    
+    for index, text in enumerate(texts):
+        row, column = divmod(index, columns)
+        seen = set()
+        if column:
+            seen |= _line_runs(contents[index - 1], size)
+        if row:
+            seen |= _line_runs(contents[index - columns], size)
+        
+        lines = text.splitlines()
+        content = [(number, line.strip()) for number, line in enumerate(lines) if line.strip()]
+        dropped = set()
+        for i in range(len(content) - size + 1):
+            run = content[i:i + size]
+            if tuple(line for _, line in run) in seen:
+                dropped.update(number for number, _ in run)
+        
+        kept = '\n'.join(line for number, line in enumerate(lines) if number not in dropped).strip()
+        if kept:
+            merged.append(kept)
+    
+    return '\n\n'.join(merged)
+
+def ocr_image(backend, file_bytes, filename):
+    """OCR one image: preprocessed, its tiles read in parallel and merged"""
+    parts, columns = prepare_ocr_image(file_bytes, filename)
+    if len(parts) == 1:
+        name, data = parts[0]
+        return backend.image_to_text(data, name)
+    logger.info(f"🧩 OCR of {len(parts)} tiles of {filename} with {backend.name}")
+    return merge_tile_texts(ocr_pages(backend, parts), columns)
+
+def read_pdf_page_texts(pdf_bytes):
+    """Embedded text per PDF page, or None when the PDF cannot be read"""
+    if PdfReader is None:
+        return None
+    try:
+        reader = PdfReader(io.BytesIO(pdf_bytes))
+        return [page.extract_text() or '' for page in reader.pages]
+    except Exception as e:
+        logger.warning(f"⚠️ PDF text extraction failed: {e}")
+        return None
+
+def render_pdf_pages(pdf_bytes, page_numbers):
+    """Rasterize the given (0-based) PDF pages to PNG bytes"""
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    images = []
+    try:
+        for number in page_numbers:
+            bitmap = pdf[number].render(scale=OCR_PDF_DPI / 72.0)
+            buffer = io.BytesIO()
+            bitmap.to_pil().convert('L').save(buffer, format='PNG', optimize=True)
+            images.append(buffer.getvalue())
+    finally:
+        pdf.close()
+    return images
+
+def ocr_pages(backend, images):
+    """OCR (name, bytes) page images or tiles concurrently, returning texts in order"""
+    futures = [_ocr_thread_pool.submit(backend.image_to_text, image, name) for name, image in images]
+    return [future.result() for future in futures]
+
+def extract_pdf_text(pdf_bytes, filename, backend):
+    """Embedded PDF text where present, OCR of rasterized pages otherwise"""
+    page_texts = read_pdf_page_texts(pdf_bytes)
+    
+    if page_texts is None:
+        if backend.accepts_pdf:
+            return backend.image_to_text(pdf_bytes, filename)
+        raise Exception("PDF support requires pypdf")
+    
+    missing = [i for i, text in enumerate(page_texts) if len(text.strip()) < PDF_MIN_PAGE_CHARS]
+    logger.info(f"📄 PDF: {len(page_texts)} pages, {len(page_texts) - len(missing)} with embedded text")
+    
+    if missing:
+        if pdfium is None or PILImage is None:
+            if backend.accepts_pdf:
+                return backend.image_to_text(pdf_bytes, filename)
+            raise Exception("Scanned PDF pages need pypdfium2 and Pillow to rasterize")
+        
+        images = render_pdf_pages(pdf_bytes, missing)
+        logger.info(f"🖼️ OCR of {len(images)} rasterized pages with {backend.name}")
+        
+        # Pages are preprocessed like uploads; all pages' tiles share one parallel OCR pass
+        prepared = [prepare_ocr_image(image, f"{filename}-page{number + 1}.png")
+                    for number, image in zip(missing, images)]
+        texts = iter(ocr_pages(backend, [part for parts, _ in prepared for part in parts]))
+        for number, (parts, columns) in zip(missing, prepared):
+            page_texts[number] = merge_tile_texts([next(texts) for _ in parts], columns)
+    
+    return '\n\n'.join(text.strip() for text in page_texts if text.strip())
+
+def extract_text_ocr(filepath, backend=None):
+    """Extract text from an image or PDF file on disk"""
+    with open(filepath, 'rb') as f:
+        file_bytes = f.read()
+    return extract_text_bytes(file_bytes, os.path.basename(filepath), backend)
+
+@traced('ocr_call')
+def extract_text_bytes(file_bytes, filename, backend=None):
+    """Extract text from in-memory image or PDF bytes with the selected OCR backend"""
+    backend = get_ocr_backend(backend)
+    backend.check()
+    
+    try:
+        if sniff_file_type(file_bytes[:8]) == 'pdf':
+            text = extract_pdf_text(file_bytes, filename, backend)
+        else:
+            text = ocr_image(backend, file_bytes, filename)
+        
+        if not text or not text.strip():
+            raise Exception('Empty OCR text')
+        
+        logger.info(f"✅ OCR extracted {len(text)} chars")
+        return text
+    
+    except requests.exceptions.Timeout:
+        raise Exception("OCR timeout - try smaller image")
+    except Exception as e:
+        logger.error(f"❌ OCR error: {e}")
+        raise Exception(f"OCR error: {str(e)}")
+
+# Model validation: every node is checked in one pass, mechanical problems are fixed in place
+# and only what is left goes back to the LLM in one batched repair call
+NODE_PREFIXES = {'hub': 'Hub_', 'link': 'Link_', 'satellite': 'Sat_'}
+NODE_TYPE_ALIASES = {'sat': 'satellite', 'lnk': 'link', 'hubs': 'hub', 'links': 'link', 'satellites': 'satellite'}
+NODE_PREFIX_RE = re.compile(r'^(hub|link|lnk|satellite|sat)[_\s-]*', re.IGNORECASE)
+PLACEHOLDER_REASONING = 'No reasoning provided'
+
+def _ref_key(node_id):
+    key = NODE_PREFIX_RE.sub('', str(node_id)).lower()
+    return key[:-1] if key.endswith('s') else key
+
+def _infer_node_type(node):
+    match = NODE_PREFIX_RE.match(node['id'])
+    if match:
+        prefix = match.group(1).lower()
+        return NODE_TYPE_ALIASES.get(prefix, prefix)
+    if node.get('connects'):
+        return 'link'
+    if node.get('parent'):
+        return 'satellite'
+    return None
+
+def check_dv_model(model, partial=False):
+    """Every problem in a model as {'node', 'code', 'message'} dicts; partial models (one chunk of a
+    schema) may reference nodes converted elsewhere, so unknown references aren't reported for them"""
+    if not isinstance(model, dict):
+        raise ValueError("Model must be dict")
+    if 'nodes' not in model or not isinstance(model['nodes'], list):
+        raise ValueError("Model must have 'nodes' array")
+    if len(model['nodes']) == 0:
+        raise ValueError("Model must have nodes")
+    
+    issues = []
+    types = {}
+    for node in model['nodes']:
+        if not isinstance(node, dict) or not node.get('id'):
+            issues.append({'node': None, 'code': 'missing_id', 'message': "All nodes need 'id'"})
+            continue
+        node_id = node['id']
+        if node_id in types:
+            issues.append({'node': node_id, 'code': 'duplicate_id', 'message': f"Duplicate node id {node_id}"})
+        types[node_id] = node.get('type')
+    
+    def report(node_id, code, message):
+        issues.append({'node': node_id, 'code': code, 'message': message})
+    
+    for node in model['nodes']:
+        if not isinstance(node, dict) or not node.get('id'):
+            continue
+        node_id, node_type = node['id'], node.get('type')
+        
+        if node_type not in NODE_PREFIXES:
+            report(node_id, 'invalid_type', f"Node {node_id} needs 'type' hub, link or satellite")
+        elif not str(node_id).startswith(NODE_PREFIXES[node_type]):
+            report(node_id, 'bad_prefix', f"{node_type.capitalize()} must be named '{NODE_PREFIXES[node_type]}*', got: {node_id}")
+        
+        if not node.get('reasoning'):
+            report(node_id, 'missing_reasoning', f"Node {node_id} must have 'reasoning' field")
+        
+        if node_type == 'satellite':
+            parent = node.get('parent')
+            if not parent:
+                report(node_id, 'missing_parent', f"Satellite {node_id} has no parent")
+            elif parent not in types and not partial:
+                report(node_id, 'unknown_parent', f"Satellite {node_id} parent {parent} does not exist")
+            elif types.get(parent) == 'satellite':
+                report(node_id, 'bad_parent', f"Satellite {node_id} parent {parent} is a satellite")
+        
+        if node_type == 'link':
+            connects = node.get('connects') or []
+            bad = [h for h in connects if h in types and types[h] != 'hub' or h not in types and not partial]
+            if bad:
+                report(node_id, 'bad_connects', f"Link {node_id} connects non-hubs: {', '.join(map(str, bad))}")
+            if len(connects) < 2:
+                report(node_id, 'link_arity', f"Link {node_id} must connect at least 2 hubs")
+    
+    for edge in model.get('edges') or []:
+        if not isinstance(edge, dict):
+            report(None, 'bad_edge', f"Edge {edge!r} is not a {{from, to}} object")
+        elif not partial and (edge.get('from') not in types or edge.get('to') not in types):
+            report(None, 'unknown_edge', f"Edge {edge.get('from')} → {edge.get('to')} references an unknown node")
+    
+    return issues
+
+def validate_dv_model(model, partial=False):
+    """Validate model structure, naming and references, reporting every problem at once"""
+    issues = check_dv_model(model, partial)
+    if issues:
+        summary = '; '.join(issue['message'] for issue in issues[:5])
+        more = f" (+{len(issues) - 5} more)" if len(issues) > 5 else ''
+        raise ValueError(f"{len(issues)} model problems: {summary}{more}")
+    return True
+
+def fix_dv_model(model, partial=False):
+    """Fix mechanical problems in place (types, prefixes, duplicates, loose references, bad edges);
+    returns a description of each fix"""
+    fixes = []
+    renames = {}
+    nodes = OrderedDict()
+    
+    for node in model['nodes']:
+        if not isinstance(node, dict) or not node.get('id'):
+            fixes.append("dropped a node without id")
+            continue
+        node_id = str(node['id']).strip()
+        node['id'] = node_id
+        
+        node_type = str(node.get('type') or '').strip().lower()
+        node_type = NODE_TYPE_ALIASES.get(node_type, node_type)
+        if node_type not in NODE_PREFIXES:
+            node_type = _infer_node_type(node) or node.get('type')
+        if node_type != node.get('type') and node_type in NODE_PREFIXES:
+            fixes.append(f"{node_id}: type {node.get('type')!r} → {node_type!r}")
+        node['type'] = node_type
+        
+        if node_type in NODE_PREFIXES and not node_id.startswith(NODE_PREFIXES[node_type]):
+            rest = NODE_PREFIX_RE.sub('', node_id) or node_id
+            renamed = NODE_PREFIXES[node_type] + rest[:1].upper() + rest[1:]
+            renames[node_id] = renamed
+            fixes.append(f"{node_id} renamed {renamed}")
+            node['id'] = node_id = renamed
+        
+        for field in ('attributes', 'connects'):
+            if isinstance(node.get(field), str):
+                node[field] = [part.strip() for part in node[field].split(',') if part.strip()]
+        
+        if node_id in nodes:
+            _merge_list(nodes[node_id], node, 'attributes')
+            _merge_list(nodes[node_id], node, 'connects')
+            if not nodes[node_id].get('reasoning') and node.get('reasoning'):
+                nodes[node_id]['reasoning'] = node['reasoning']
+            fixes.append(f"{node_id}: merged duplicate")
+            continue
+        nodes[node_id] = node
+    
+    # Loose references: renamed ids, then prefix/plural-insensitive matches
+    lookup = {}
+    for node_id, node in nodes.items():
+        lookup.setdefault((_ref_key(node_id), node['type']), node_id)
+    
+    def resolve(ref, wanted):
+        ref = renames.get(ref, ref)
+        if ref in nodes:
+            return ref
+        for node_type in wanted:
+            match = lookup.get((_ref_key(ref), node_type))
+            if match:
+                return match
+        return ref
+    
+    for node_id, node in nodes.items():
+        if node['type'] == 'satellite' and node.get('parent'):
+            parent = resolve(node['parent'], ('hub', 'link'))
+            if parent != node['parent']:
+                fixes.append(f"{node_id}: parent {node['parent']} → {parent}")
+                node['parent'] = parent
+        if node['type'] == 'link' and node.get('connects'):
+            connects = []
+            for ref in node['connects']:
+                hub = resolve(ref, ('hub',))
+                if hub in nodes and nodes[hub]['type'] != 'hub':
+                    fixes.append(f"{node_id}: dropped non-hub {hub} from connects")
+                    continue
+                if hub not in connects:
+                    connects.append(hub)
+            if connects != node['connects']:
+                node['connects'] = connects
+    
+    edges = []
+    seen = set()
+    for edge in model.get('edges') or []:
+        if not isinstance(edge, dict):
+            continue
+        pair = (resolve(edge.get('from'), ('hub', 'link')), resolve(edge.get('to'), ('link', 'satellite', 'hub')))
+        known = pair[0] in nodes and pair[1] in nodes
+        if pair[0] == pair[1] or pair in seen or (not known and not partial):
+            fixes.append(f"dropped edge {edge.get('from')} → {edge.get('to')}")
+            continue
+        seen.add(pair)
+        edges.append({**edge, 'from': pair[0], 'to': pair[1]})
+    
+    model['nodes'] = list(nodes.values())
+    model['edges'] = edges
+    return fixes
+
+def repair_dv_model(model, partial=False, allow_llm=True):
+    """Check all nodes, auto-fix what is mechanical, send the rest to the LLM in one call and
+    drop whatever still fails; raises ValueError only if nothing usable is left"""
+    return run_steps(repair_dv_model_steps(model, partial, allow_llm))
+
+def repair_dv_model_steps(model, partial=False, allow_llm=True):
+    with span('validation'):
+        fixes, issues = autofix_dv_model(model, partial)
+        
+        if issues and allow_llm and GROQ_API_KEY:
+            try:
+                repaired = yield from request_node_repairs_steps(model, issues)
+                fixes.append(f"LLM repaired {repaired} nodes")
+                fixes += fix_dv_model(model, partial)
+                issues = check_dv_model(model, partial)
+            except Exception as e:
+                logger.warning(f"⚠️ Repair call failed: {e}")
+        
+        return drop_invalid_nodes(model, issues, fixes, partial)
+
+def autofix_dv_model(model, partial=False):
+    """Apply the mechanical fixes; returns (fixes, remaining issues)"""
+    check_dv_model(model, partial)
+    fixes = fix_dv_model(model, partial)
+    return fixes, check_dv_model(model, partial)
+
+def drop_invalid_nodes(model, issues, fixes, partial=False):
+    """Placeholder reasoning for nodes that only lack it, drop nodes that still fail validation"""
+    # Last resort: keep nodes that only lack reasoning, drop the rest (and what hangs off them)
+    dropped = []
+    while issues:
+        by_id = {n.get('id'): n for n in model['nodes']}
+        broken = set()
+        for issue in issues:
+            if issue['code'] == 'missing_reasoning' and issue['node'] in by_id:
+                by_id[issue['node']]['reasoning'] = PLACEHOLDER_REASONING
+            elif issue['node']:
+                broken.add(issue['node'])
+            elif issue['code'] != 'missing_reasoning':
+                raise ValueError(issue['message'])
+        if broken:
+            dropped += sorted(broken)
+            model['nodes'] = [n for n in model['nodes'] if n.get('id') not in broken]
+            if not model['nodes']:
+                raise ValueError(f"No valid nodes left after repair: {issues[0]['message']}")
+        fixes += fix_dv_model(model, partial)
+        issues = check_dv_model(model, partial)
+    
+    if fixes or dropped:
+        logger.info(f"🔧 Model repaired: {len(fixes)} fixes" + (f", dropped {', '.join(dropped)}" if dropped else ''))
+    return model
+
+def get_knowledge_snippet(grounded, knowledge_content):
+    """Knowledge text actually injected into the prompt"""
+    if not grounded or not knowledge_content:
+        return ''
+    return knowledge_content[:KNOWLEDGE_TOKEN_BUDGET * 4]
+
+def build_dv_prompts(schema_text, knowledge_snippet='', other_tables=None, part_label='', compact=False):
+    """Build the system and user prompts for one GROQ conversion call"""
+    system_prompt = "You are an expert Data Vault 2.1 modeler with deep understanding of hub, link, and satellite structures."
+    if knowledge_snippet:
+        system_prompt = f"""You are a Data Vault 2.1 expert. Use these guidelines:
+{knowledge_snippet}"""
+    
+    context_block = ''
+    if other_tables:
+        context_block = f"""
+OTHER TABLES IN THIS SCHEMA (converted separately - do NOT create nodes for them, but reference
+their hubs by name, e.g. Hub_<Table>, in link "connects" when this part relates to them):
+{', '.join(other_tables)}
+"""
+    
+    if compact:
+        user_prompt = f"""Convert this source schema to a Data Vault 2.1 model.
+
+SOURCE SCHEMA{part_label}:
+{schema_text}
+{context_block}
+RULES:
+- HUB: entity the business queries independently; holds only its business key. Id "Hub_<Entity>".
+- LINK: relationship/junction between 2+ hubs; "connects" lists the hub ids. Id "Link_<Entity1>_<Entity2>".
+- SATELLITE: descriptive non-key columns; "parent" is a hub or link id. Id "Sat_<Parent>_<Descriptor>".
+- Edges go hub → link and hub → satellite.
+- Every node needs a one-sentence "reasoning" naming the test it passed (HUB/LINK/SAT).
+
+Return ONLY valid JSON (no markdown) shaped like:
+{{"nodes": [{{"id": "Hub_Customer", "type": "hub", "businessKey": "customer_id", "attributes": ["customer_id"], "reasoning": "Passes HUB TEST: ..."}},
+{{"id": "Link_Customer_Order", "type": "link", "connects": ["Hub_Customer", "Hub_Order"], "reasoning": "Passes LINK TEST: ..."}},
+{{"id": "Sat_Customer_Details", "type": "satellite", "parent": "Hub_Customer", "attributes": ["name", "email"], "reasoning": "Passes SAT TEST: ..."}}],
+"edges": [{{"from": "Hub_Customer", "to": "Link_Customer_Order"}}, {{"from": "Hub_Customer", "to": "Sat_Customer_Details"}}]}}"""
+        return system_prompt, user_prompt
+    
+    user_prompt = f"""Analyze this source schema and convert it to Data Vault 2.1 model WITH REASONING.
+
+SOURCE SCHEMA{part_label}:
+{schema_text}
+{context_block}
+CLASSIFICATION DECISION TREE:
+
+STEP 1: "Is this a PRIMARY THING the business cares about independently?"
+   - YES → HUB (Customer, Product, Film, Store, Employee, Actor, Inventory, City, Country)
+   - NO → Go to STEP 2
+
+STEP 2: "Does it CONNECT multiple business things (many-to-many relationship)?"
+   - YES → LINK (Actor_Film, Customer_Order, Film_Category, Inventory_Store, City_Country)
+   - NO → Go to STEP 3
+
+STEP 3: "Does it DESCRIBE/ADD CONTEXT to another entity with non-key attributes?"
+   - YES → SATELLITE (Customer_Details, Order_Status, Film_Metadata)
+   - NO → Likely an error or derived table
+
+KEY TESTS FOR CLASSIFICATION:
+- HUB test: "Would we query/care about this entity independently?" If YES → HUB
+- LINK test: "Does this answer 'many X relate to many Y'?" If YES → LINK
+- SAT test: "Is this only useful as context for something else?" If YES → SATELLITE
+
+MANDATORY NAMING CONVENTION - STRICT ENFORCEMENT:
+- ALL Hubs MUST start with "Hub_" → Hub_Actor, Hub_Film, Hub_Customer, Hub_Store, Hub_City
+- ALL Links MUST start with "Link_" → Link_Actor_Film, Link_Customer_Order, Link_Film_Category
+- ALL Satellites MUST start with "Sat_" → Sat_Actor_Profile, Sat_Film_Details, Sat_Customer_Contact
+
+This prevents confusion and ensures clarity. FAILURE TO FOLLOW NAMING = INVALID MODEL.
+
+DATA VAULT 2.1 STRUCTURE:
+
+1. HUBS = Core business entities (main tables/nouns)
+   - Primary entities that exist independently
+   - Contain ONLY the business key column
+   - Examples: Hub_Customer, Hub_Actor, Hub_Film, Hub_Store, Hub_City, Hub_Country
+   - Name format: Hub_EntityName
+
+2. LINKS = Relationships BETWEEN Hubs (association/junction tables)
+   - Represent many-to-many relationships or business events
+   - Must have "connects" array listing Hub IDs it bridges
+   - Examples: Link_Actor_Film, Link_Customer_Order, Link_Inventory_Store
+   - Name format: Link_Entity1_Entity2
+   - CRITICAL: Links connect 2+ independent Hubs
+
+3. SATELLITES = Descriptive attributes (non-key columns)
+   - Contains all descriptive/contextual data
+   - Must have a parent Hub or Link
+   - Examples: Sat_Customer_Details, Sat_Film_Metadata, Sat_Actor_Profile
+   - Name format: Sat_ParentEntity_Descriptor
+   - Each satellite should have a clear, descriptive purpose
 
 EDGE RULES:
 - Hub → Satellite: FROM hub TO its satellite (one hub can have many satellites)
 - Hub → Link: FROM hub TO the link (for each hub the link connects)
 
-REASONING REQUIREMENT:
-Every node MUST have a "reasoning" field that explains:
-1. Which test it passed (HUB/LINK/SAT test)
-2. Why it's NOT something else
-3. How it's used in the business
+REASONING REQUIREMENT:
+Every node MUST have a "reasoning" field that explains:
+1. Which test it passed (HUB/LINK/SAT test)
+2. Why it's NOT something else
+3. How it's used in the business
+
+Example reasoning:
+- HUB: "Passes HUB TEST. Actors are independent business entities queried and analyzed standalone. Not a descriptor of something else."
+- LINK: "Passes LINK TEST. Many actors appear in many films (many-to-many). This junction table captures cast assignments."
+- SAT: "Passes SAT TEST. Actor birth date only meaningful in context of Hub_Actor. Cannot exist independently."
+
+OUTPUT FORMAT (VALID JSON ONLY - NO markdown, NO code blocks):
+{{
+  "nodes": [
+    {{
+      "id": "Hub_Actor",
+      "type": "hub",
+      "businessKey": "actor_id",
+      "attributes": ["actor_id"],
+      "reasoning": "Passes HUB TEST: Yes. Actors are independent business entities. We query actors by themselves, analyze careers, manage rosters. Not a descriptor of another entity."
+    }},
+    {{
+      "id": "Hub_Film",
+      "type": "hub",
+      "businessKey": "film_id",
+      "attributes": ["film_id"],
+      "reasoning": "Passes HUB TEST: Yes. Films are core business inventory. We query films independently for catalog analysis, revenue reporting, distribution planning. Independent entity."
+    }},
+    {{
+      "id": "Link_Actor_Film",
+      "type": "link",
+      "connects": ["Hub_Actor", "Hub_Film"],
+      "reasoning": "Passes LINK TEST: Yes. Many-to-many: one actor in many films, one film has many actors. This junction table captures the cast assignments. Not a Hub (no independent business key) and not a Satellite (connects entities)."
+    }},
+    {{
+      "id": "Sat_Actor_Profile",
+      "type": "satellite",
+      "parent": "Hub_Actor",
+      "attributes": ["first_name", "last_name", "birth_date"],
+      "reasoning": "Passes SAT TEST: Yes. Descriptive attributes of actors. Only meaningful in context of Hub_Actor. Cannot exist without knowing whose profile this is. Pure context/detail."
+    }},
+    {{
+      "id": "Sat_Film_Details",
+      "type": "satellite",
+      "parent": "Hub_Film",
+      "attributes": ["title", "description", "release_year", "length", "rating"],
+      "reasoning": "Passes SAT TEST: Yes. Content descriptors for films. Mutable attributes separated from business key per DV best practices. Only meaningful in context of specific film."
+    }}
+  ],
+  "edges": [
+    {{"from": "Hub_Actor", "to": "Link_Actor_Film"}},
+    {{"from": "Hub_Film", "to": "Link_Actor_Film"}},
+    {{"from": "Hub_Actor", "to": "Sat_Actor_Profile"}},
+    {{"from": "Hub_Film", "to": "Sat_Film_Details"}}
+  ]
+}}
+
+CRITICAL REMINDERS:
+- EVERY node ID must have correct prefix (Hub_/Link_/Sat_) - NO EXCEPTIONS
+- EVERY node must have "reasoning" field
+- Reasoning must reference which TEST it passed
+- Hubs connect TO Links (Hub → Link direction)
+- Hubs connect TO Satellites (Hub → Satellite direction)
+- Links must have "connects" array with Hub IDs
+- Do NOT create ambiguous names like "Actor" without prefix
+
+Now analyze the schema above and generate the Data Vault model as JSON."""
+    
+    return system_prompt, user_prompt
+
+def request_dv_model(schema_text, knowledge_snippet='', other_tables=None, part_label='',
+                     continuations=GROQ_CONTINUATIONS, kind='convert'):
+    """Run one GROQ conversion call and return the validated model, continuing truncated output"""
+    return run_steps(request_dv_model_steps(schema_text, knowledge_snippet, other_tables, part_label, continuations,
+                                            kind))
+
+def request_dv_model_steps(schema_text, knowledge_snippet='', other_tables=None, part_label='',
+                           continuations=GROQ_CONTINUATIONS, kind='convert'):
+    plan = plan_dv_request(schema_text, knowledge_snippet, other_tables, part_label)
+    
+    logger.info(f"🤖 Calling GROQ{part_label} ({plan['variant']} prompt, ~{plan['estimated_prompt_tokens']} tokens, "
+                f"max_tokens {plan['max_tokens']})...")
+    
+    start = time.perf_counter()
+    usage, finish_reason = {}, None
+    try:
+        response = yield Post(groq_client, GROQ_API_URL, {
+            'headers': groq_headers(),
+            'json': groq_payload(plan['system_prompt'], plan['user_prompt'], max_tokens=plan['max_tokens']),
+            'timeout': 60
+        })
+        result = read_groq_result(response, part_label)
+        
+        usage = result.get('usage') or {}
+        finish_reason = result['choices'][0].get('finish_reason')
+        model, complete = yield from salvage_model_content_steps(result['choices'][0]['message']['content'],
+                                                                 partial=bool(other_tables))
+    
+    except Exception as e:
+        yield Blocking('db', record_llm_usage, (kind, plan, usage, finish_reason, time.perf_counter() - start, e))
+        raise
+    
+    yield Blocking('db', record_llm_usage, (kind, plan, usage, finish_reason, time.perf_counter() - start))
+    if complete and finish_reason != 'length':
+        return model
+    return (yield from continue_dv_model_steps(model, schema_text, knowledge_snippet, other_tables, part_label,
+                                               continuations))
+
+def read_groq_result(response, part_label=''):
+    """Checked chat completion body of a GROQ response"""
+    logger.info(f"📥 GROQ status{part_label}: {response.status_code}")
+    response.raise_for_status()
+    result = response.json()
+    
+    if 'error' in result:
+        raise Exception(f"GROQ error: {result['error'].get('message')}")
+    
+    if not result.get('choices'):
+        raise Exception('No GROQ response')
+    
+    return result
+
+def request_node_repairs_steps(model, issues):
+    """One GROQ call that fixes every node still failing validation; returns how many were replaced"""
+    repair = plan_node_repairs(model, issues)
+    if repair is None:
+        return 0
+    
+    start = time.perf_counter()
+    usage, finish_reason = {}, None
+    try:
+        response = yield Post(groq_client, GROQ_API_URL, {
+            'headers': groq_headers(),
+            'json': groq_payload(repair['system_prompt'], repair['user_prompt'], max_tokens=repair['plan']['max_tokens']),
+            'timeout': 30
+        })
+        result = read_groq_result(response, ' (repair)')
+        usage = result.get('usage') or {}
+        finish_reason = result['choices'][0].get('finish_reason')
+        fixed = parse_node_repairs(result['choices'][0]['message']['content'])
+    
+    except Exception as e:
+        yield Blocking('db', record_llm_usage, ('repair', repair['plan'], usage, finish_reason,
+                                                time.perf_counter() - start, e))
+        raise
+    
+    yield Blocking('db', record_llm_usage, ('repair', repair['plan'], usage, finish_reason,
+                                            time.perf_counter() - start))
+    return apply_node_repairs(model, repair['bad_ids'], fixed)
+
+def plan_node_repairs(model, issues):
+    """Prompts and budget for the batched repair call, or None if no node needs one"""
+    problems = OrderedDict()
+    for issue in issues:
+        if issue['node']:
+            problems.setdefault(issue['node'], []).append(issue['message'])
+    index = {n['id']: i for i, n in enumerate(model['nodes'])}
+    bad_ids = [node_id for node_id in problems if node_id in index]
+    if not bad_ids:
+        return None
+    
+    valid_hubs = [n['id'] for n in model['nodes'] if n['type'] == 'hub' and n['id'] not in problems]
+    valid_links = [n['id'] for n in model['nodes'] if n['type'] == 'link' and n['id'] not in problems]
+    system_prompt = "You are an expert Data Vault 2.1 modeler. You fix invalid nodes of an existing model."
+    user_prompt = f"""These nodes of a Data Vault 2.1 model failed validation.
+
+PROBLEMS:
+{chr(10).join(f"- {message}" for node_id in bad_ids for message in problems[node_id])}
+
+NODES:
+{json.dumps([model['nodes'][index[node_id]] for node_id in bad_ids], indent=1)}
+
+EXISTING HUBS: {', '.join(valid_hubs[:300]) or 'none'}
+EXISTING LINKS: {', '.join(valid_links[:300]) or 'none'}
+
+RULES:
+- "type" is hub, link or satellite and the id starts with Hub_, Link_ or Sat_ to match.
+- A satellite's "parent" is an existing hub or link; a link "connects" 2+ existing hubs.
+- Every node has a one-sentence "reasoning" naming the HUB/LINK/SAT test it passed.
+
+Return ONLY valid JSON (no markdown): {{"nodes": [...]}} with one corrected node per input node, in the same order."""
+    
+    estimated = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+    plan = {'variant': 'repair', 'tables': 0, 'estimated_prompt_tokens': estimated,
+            'max_tokens': max(GROQ_MIN_TOKENS, min(GROQ_MAX_TOKENS, 200 + 150 * len(bad_ids)))}
+    logger.info(f"🩺 Repair call for {len(bad_ids)} nodes (~{estimated} tokens)")
+    return {'bad_ids': bad_ids, 'system_prompt': system_prompt, 'user_prompt': user_prompt, 'plan': plan}
+
+def parse_node_repairs(content):
+    """Corrected nodes from the repair call's output"""
+    text = extract_json_text(content)
+    try:
+        return json.loads(text).get('nodes') or []
+    except ValueError:
+        return json.loads(repair_json(text)[0]).get('nodes') or []
+
+def apply_node_repairs(model, bad_ids, fixed):
+    """Swap corrected nodes in place of the failing ones; returns how many were replaced"""
+    index = {n['id']: i for i, n in enumerate(model['nodes'])}
+    replaced = 0
+    for node_id, node in zip(bad_ids, fixed):
+        if isinstance(node, dict) and node.get('id') and node_id in index:
+            model['nodes'][index[node_id]] = node
+            replaced += 1
+    return replaced
+
+def groq_headers():
+    return {
+        'Authorization': f'Bearer {GROQ_API_KEY}',
+        'Content-Type': 'application/json'
+    }
+
+def groq_payload(system_prompt, user_prompt, stream=False, max_tokens=GROQ_MAX_TOKENS):
+    """Chat completion request body for a DV conversion"""
+    payload = {
+        'model': GROQ_MODEL,
+        'messages': [
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': user_prompt}
+        ],
+        'temperature': GROQ_TEMPERATURE,
+        'max_tokens': max_tokens
+    }
+    if stream:
+        payload['stream'] = True
+    return payload
+
+# Token accounting
+TOKEN_PIECE_RE = re.compile(r"[A-Za-z]+|\d{1,3}|[^\sA-Za-z\d]")
+
+def estimate_tokens(text):
+    """Local BPE-style estimate: ~1 token per short word, number group or symbol, long words split every 6 letters"""
+    return sum(1 + (len(piece) - 1) // 6 if piece[0].isalpha() else 1 for piece in TOKEN_PIECE_RE.findall(text or ''))
+
+def completion_budget(tables, columns, variant):
+    """max_tokens for a conversion of this many tables and columns"""
+    if not tables:
+        return GROQ_MAX_TOKENS
+    budget = COMPLETION_BASE_TOKENS + tables * COMPLETION_TOKENS_PER_TABLE[variant] + columns * COMPLETION_TOKENS_PER_COLUMN
+    return max(GROQ_MIN_TOKENS, min(GROQ_MAX_TOKENS, budget))
+
+@traced('prompt_build')
+def plan_dv_request(schema_text, knowledge_snippet='', other_tables=None, part_label=''):
+    """Prompts, prompt size estimate and completion budget for one conversion call"""
+    tables = parse_schema(schema_text)
+    columns = sum(len(t['columns']) for t in tables)
+    variant = 'compact' if 0 < len(tables) <= COMPACT_PROMPT_MAX_TABLES else 'full'
+    system_prompt, user_prompt = build_dv_prompts(schema_text, knowledge_snippet, other_tables, part_label,
+                                                  compact=variant == 'compact')
+    
+    estimated = estimate_tokens(system_prompt) + estimate_tokens(user_prompt)
+    if estimated > GROQ_MAX_PROMPT_TOKENS:
+        raise ValueError(f"Prompt too large: ~{estimated} tokens (limit {GROQ_MAX_PROMPT_TOKENS}); "
+                         f"lower SCHEMA_CHUNK_CHARS or split the schema")
+    
+    return {
+        'system_prompt': system_prompt,
+        'user_prompt': user_prompt,
+        'variant': variant,
+        'tables': len(tables),
+        'estimated_prompt_tokens': estimated,
+        'max_tokens': completion_budget(len(tables), columns, variant)
+    }
+
+def record_llm_usage(kind, plan, usage, finish_reason, seconds, error=None):
+    """Queue one LLM call's token usage and latency for a batched write; never fails the call itself"""
+    try:
+        db.defer("""
+            INSERT INTO llm_usage (created_at, kind, model, prompt_variant, tables, estimated_prompt_tokens,
+                                   prompt_tokens, completion_tokens, max_tokens, finish_reason, latency_ms, error)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """, (time.time(), kind, GROQ_MODEL, plan['variant'], plan['tables'], plan['estimated_prompt_tokens'],
+              usage.get('prompt_tokens'), usage.get('completion_tokens'), plan['max_tokens'], finish_reason,
+              round(seconds * 1000, 1), str(error)[:500] if error else None))
+    except Exception as db_error:
+        logger.warning(f"⚠️ Usage not recorded: {db_error}")
+
+# Tolerant parsing: LLM output may be wrapped in prose or cut off at max_tokens
+JSON_START_RE = re.compile(r'\{\s*"')
+
+def extract_json_text(content):
+    """The outermost JSON object in LLM output without fences or surrounding prose (unterminated if cut off)"""
+    match = JSON_START_RE.search(content)
+    if not match:
+        raise ValueError('No JSON object in model output')
+    
+    depth = 0
+    in_string = escape = False
+    for i in range(match.start(), len(content)):
+        ch = content[i]
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in '{[':
+            depth += 1
+        elif ch in '}]':
+            depth -= 1
+            if depth == 0:
+                return content[match.start():i + 1]
+    return content[match.start():]
+
+def repair_json(text):
+    """Fix trailing commas and mismatched closers; cut truncated JSON back to its last complete
+    array element and close what is still open. Returns (repaired, complete)."""
+    out = []
+    stack = []
+    in_string = escape = False
+    safe = None
+    
+    for ch in text:
+        if in_string:
+            out.append(ch)
+            if escape:
+                escape = False
+            elif ch == '\\':
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+            out.append(ch)
+        elif ch in '{[':
+            stack.append('}' if ch == '{' else ']')
+            out.append(ch)
+        elif ch in '}]':
+            if not stack:
+                break
+            end = len(out)
+            while end and out[end - 1].isspace():
+                end -= 1
+            if end and out[end - 1] == ',':
+                del out[end - 1:]
+            out.append(stack.pop())
+            if not stack:
+                return ''.join(out), True
+            # A finished element of an array (e.g. one node) is a safe place to cut
+            if stack[-1] == ']':
+                safe = (len(out), list(stack))
+        else:
+            out.append(ch)
+    
+    if safe is None:
+        raise ValueError('Model output was cut off before any complete node')
+    cut, still_open = safe
+    return ''.join(out[:cut]) + ''.join(reversed(still_open)), False
+
+def salvage_model_content(content, partial=False):
+    """Parse LLM output into a validated model, repairing it if needed; returns (model, complete)"""
+    return run_steps(salvage_model_content_steps(content, partial))
+
+def salvage_model_content_steps(content, partial=False):
+    model, complete = parse_model_content(content)
+    
+    # A cut-off model may still reference nodes that never arrived
+    yield from repair_dv_model_steps(model, partial=partial or not complete)
+    return model, complete
+
+@traced('json_parse')
+def parse_model_content(content):
+    """Parse LLM output into a model dict, closing truncated JSON; returns (model, complete)"""
+    text = extract_json_text(content)
+    try:
+        model = json.loads(text)
+        complete = True
+    except ValueError as e:
+        repaired, complete = repair_json(text)
+        model = json.loads(repaired)
+        logger.info(f"🩹 Repaired model JSON ({e}); {'complete' if complete else 'truncated'}, "
+                    f"{len(model.get('nodes') or [])} nodes kept")
+    
+    if not isinstance(model, dict):
+        raise ValueError("Model must be dict")
+    if 'edges' not in model:
+        model['edges'] = []
+    return model, complete
+
+def incomplete_tables(model, tables):
+    """Tables without a hub or link, or whose descriptive columns have no satellite yet"""
+    node_tables = attribute_nodes(model, tables)
+    types = {}
+    for node in model['nodes']:
+        if node['id'] in node_tables:
+            types.setdefault(node_tables[node['id']], set()).add(node.get('type'))
+    
+    missing = []
+    for table in tables:
+        found = types.get(table['name'], set())
+        keys = set(table['pk']) | set(table['fks'])
+        descriptive = [c for c in table['columns'] if c not in keys]
+        if not found & {'hub', 'link'} or (descriptive and 'satellite' not in found):
+            missing.append(table)
+    return missing
+
+def continue_dv_model(model, schema_text, knowledge_snippet='', other_tables=None, part_label='',
+                      continuations=GROQ_CONTINUATIONS):
+    """Complete a truncated model by converting only the tables it doesn't cover yet"""
+    return run_steps(continue_dv_model_steps(model, schema_text, knowledge_snippet, other_tables, part_label,
+                                             continuations))
+
+def continue_dv_model_steps(model, schema_text, knowledge_snippet='', other_tables=None, part_label='',
+                            continuations=GROQ_CONTINUATIONS):
+    continuation = plan_continuation(model, schema_text, other_tables, part_label, continuations)
+    if continuation is None:
+        return model
+    
+    missing_text, continuation_others, continuation_label = continuation
+    rest = yield from request_dv_model_steps(missing_text, knowledge_snippet, continuation_others, continuation_label,
+                                             continuations - 1, kind='continuation')
+    return (yield from repair_dv_model_steps(merge_dv_models([model, rest]), partial=bool(other_tables)))
+
+def plan_continuation(model, schema_text, other_tables=None, part_label='', continuations=GROQ_CONTINUATIONS):
+    """(schema text, other tables, label) of the follow-up call for a truncated model, or None if it is complete"""
+    tables = parse_schema(schema_text)
+    if not tables:
+        logger.warning(f"⚠️ Truncated output{part_label} kept as is: {len(model['nodes'])} nodes")
+        return None
+    
+    missing = incomplete_tables(model, tables)
+    if not missing:
+        return None
+    if continuations <= 0:
+        raise Exception(f"GROQ output still truncated{part_label}; {len(missing)} of {len(tables)} tables unconverted")
+    
+    logger.info(f"➕ Continuing{part_label}: {len(model['nodes'])} nodes salvaged, {len(missing)} of {len(tables)} "
+                f"tables left")
+    missing_names = {t['name'] for t in missing}
+    done = [t['name'] for t in tables if t['name'] not in missing_names]
+    return ('\n\n'.join(t['block'] for t in missing), ((other_tables or []) + done)[:300],
+            f"{part_label} (continuation)")
+
+class NodeStreamParser:
+    """Incrementally pull completed objects out of the "nodes" array of streamed JSON"""
+    
+    NODES_START_RE = re.compile(r'"nodes"\s*:\s*\[')
+    
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.state = 'seek'
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.obj_start = None
+    
+    def feed(self, text):
+        """Add streamed text and return the nodes completed by it"""
+        self.buffer += text
+        completed = []
+        
+        if self.state == 'seek':
+            match = self.NODES_START_RE.search(self.buffer)
+            if not match:
+                return completed
+            self.state = 'array'
+            self.pos = match.end()
+        
+        while self.state == 'array' and self.pos < len(self.buffer):
+            ch = self.buffer[self.pos]
+            
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == '\\':
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in '{[':
+                if self.depth == 0 and ch == '{':
+                    self.obj_start = self.pos
+                self.depth += 1
+            elif ch in '}]':
+                if self.depth == 0 and ch == ']':
+                    self.state = 'done'
+                else:
+                    self.depth -= 1
+                    if self.depth == 0 and ch == '}' and self.obj_start is not None:
+                        try:
+                            completed.append(json.loads(self.buffer[self.obj_start:self.pos + 1]))
+                        except ValueError:
+                            pass
+                        self.obj_start = None
+            
+            self.pos += 1
+        
+        return completed
+
+def stream_dv_model(schema_text, knowledge_snippet=''):
+    """Stream one GROQ conversion, yielding ('node', node) as nodes complete and finally ('model', model)"""
+    plan = plan_dv_request(schema_text, knowledge_snippet)
+    
+    logger.info(f"🤖 Streaming from GROQ ({plan['variant']} prompt, ~{plan['estimated_prompt_tokens']} tokens, "
+                f"max_tokens {plan['max_tokens']})...")
+    
+    start = time.perf_counter()
+    usage, finish_reason = {}, None
+    try:
+        response = groq_client.post(
+            GROQ_API_URL,
+            headers=groq_headers(),
+            json=groq_payload(plan['system_prompt'], plan['user_prompt'], stream=True, max_tokens=plan['max_tokens']),
+            timeout=60,
+            stream=True
+        )
+    except Exception as e:
+        record_llm_usage('stream', plan, usage, finish_reason, time.perf_counter() - start, error=e)
+        raise
+    
+    try:
+        logger.info(f"📥 GROQ status: {response.status_code}")
+        response.raise_for_status()
+        
+        parser = NodeStreamParser()
+        parts = []
+        
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith('data:'):
+                continue
+            data = line[5:].strip()
+            if data == '[DONE]':
+                break
+            
+            chunk = json.loads(data)
+            if 'error' in chunk:
+                raise Exception(f"GROQ error: {chunk['error'].get('message')}")
+            
+            # GROQ reports usage on the last chunk under x_groq
+            usage = (chunk.get('x_groq') or {}).get('usage') or chunk.get('usage') or usage
+            choices = chunk.get('choices') or [{}]
+            finish_reason = choices[0].get('finish_reason') or finish_reason
+            delta = (choices[0].get('delta') or {}).get('content') or ''
+            if not delta:
+                continue
+            
+            parts.append(delta)
+            for node in parser.feed(delta):
+                yield 'node', node
+        
+        if not parts:
+            raise Exception('No GROQ response')
+        
+        model, complete = salvage_model_content(''.join(parts))
+    
+    except Exception as e:
+        record_llm_usage('stream', plan, usage, finish_reason, time.perf_counter() - start, error=e)
+        raise
+    
+    finally:
+        response.close()
+    
+    record_llm_usage('stream', plan, usage, finish_reason, time.perf_counter() - start)
+    
+    if not complete or finish_reason == 'length':
+        streamed = {node['id'] for node in model['nodes']}
+        model = continue_dv_model(model, schema_text, knowledge_snippet)
+        for node in model['nodes']:
+            if node['id'] not in streamed:
+                yield 'node', node
+    
+    yield 'model', model
+
+@traced('edge_autogen')
+def add_missing_edges(model):
+    """Auto-generate hub → satellite and hub → link edges, returning how many were added"""
+    existing = {(e.get('from'), e.get('to')) for e in model['edges']}
+    
+    auto_count = 0
+    for node in model['nodes']:
+        if node['type'] == 'satellite' and node.get('parent'):
+            pid = node['parent']
+            if (pid, node['id']) not in existing:
+                model['edges'].append({'from': pid, 'to': node['id']})
+                existing.add((pid, node['id']))
+                auto_count += 1
+        
+        elif node['type'] == 'link' and node.get('connects'):
+            for hid in node['connects']:
+                if (hid, node['id']) not in existing:
+                    model['edges'].append({'from': hid, 'to': node['id']})
+                    existing.add((hid, node['id']))
+                    auto_count += 1
+    
+    return auto_count
 
-Example reasoning:
-- HUB: "Passes HUB TEST. Actors are independent business entities queried and analyzed standalone. Not a descriptor of something else."
-- LINK: "Passes LINK TEST. Many actors appear in many films (many-to-many). This junction table captures cast assignments."
-- SAT: "Passes SAT TEST. Actor birth date only meaningful in context of Hub_Actor. Cannot exist independently."
+# Schema chunking for large source models
+TABLE_START_RE = re.compile(
+    r'^\s*(?:create\s+(?:or\s+replace\s+)?(?:temp(?:orary)?\s+)?table\b|table(?:\s+name)?\s*[:\-])',
+    re.IGNORECASE
+)
+TABLE_NAME_RE = re.compile(
+    r'^\s*(?:create\s+(?:or\s+replace\s+)?(?:temp(?:orary)?\s+)?table\s+(?:if\s+not\s+exists\s+)?'
+    r'|table(?:\s+name)?\s*[:\-]\s*)[`"\[]?([\w.]+)',
+    re.IGNORECASE
+)
+GENERIC_BUSINESS_KEYS = {'id', 'key', 'code', 'name', 'uuid', 'guid'}
 
-OUTPUT FORMAT (VALID JSON ONLY - NO markdown, NO code blocks):
-{{
-  "nodes": [
-    {{
-      "id": "Hub_Actor",
-      "type": "hub",
-      "businessKey": "actor_id",
-      "attributes": ["actor_id"],
-      "reasoning": "Passes HUB TEST: Yes. Actors are independent business entities. We query actors by themselves, analyze careers, manage rosters. Not a descriptor of another entity."
-    }},
-    {{
-      "id": "Hub_Film",
-      "type": "hub",
-      "businessKey": "film_id",
-      "attributes": ["film_id"],
-      "reasoning": "Passes HUB TEST: Yes. Films are core business inventory. We query films independently for catalog analysis, revenue reporting, distribution planning. Independent entity."
-    }},
-    {{
-      "id": "Link_Actor_Film",
-      "type": "link",
-      "connects": ["Hub_Actor", "Hub_Film"],
-      "reasoning": "Passes LINK TEST: Yes. Many-to-many: one actor in many films, one film has many actors. This junction table captures the cast assignments. Not a Hub (no independent business key) and not a Satellite (connects entities)."
-    }},
-    {{
-      "id": "Sat_Actor_Profile",
-      "type": "satellite",
-      "parent": "Hub_Actor",
-      "attributes": ["first_name", "last_name", "birth_date"],
-      "reasoning": "Passes SAT TEST: Yes. Descriptive attributes of actors. Only meaningful in context of Hub_Actor. Cannot exist without knowing whose profile this is. Pure context/detail."
-    }},
-    {{
-      "id": "Sat_Film_Details",
-      "type": "satellite",
-      "parent": "Hub_Film",
-      "attributes": ["title", "description", "release_year", "length", "rating"],
-      "reasoning": "Passes SAT TEST: Yes. Content descriptors for films. Mutable attributes separated from business key per DV best practices. Only meaningful in context of specific film."
-    }}
-  ],
-  "edges": [
-    {{"from": "Hub_Actor", "to": "Link_Actor_Film"}},
-    {{"from": "Hub_Film", "to": "Link_Actor_Film"}},
-    {{"from": "Hub_Actor", "to": "Sat_Actor_Profile"}},
-    {{"from": "Hub_Film", "to": "Sat_Film_Details"}}
-  ]
-}}
+_chunk_executor = ThreadPoolExecutor(max_workers=GENERATION_CONCURRENCY, thread_name_prefix='chunk')
 
-CRITICAL REMINDERS:
-- EVERY node ID must have correct prefix (Hub_/Link_/Sat_) - NO EXCEPTIONS
-- EVERY node must have "reasoning" field
-- Reasoning must reference which TEST it passed
-- Hubs connect TO Links (Hub → Link direction)
-- Hubs connect TO Satellites (Hub → Satellite direction)
-- Links must have "connects" array with Hub IDs
-- Do NOT create ambiguous names like "Actor" without prefix
+def split_schema_tables(text):
+    """Split schema text into one block per table (blank-line paragraphs as fallback)"""
+    lines = text.replace('\r\n', '\n').split('\n')
+    
+    if not any(TABLE_START_RE.match(line) for line in lines):
+        return [block.strip() for block in re.split(r'\n\s*\n', text) if block.strip()]
+    
+    blocks = []
+    current = []
+    for line in lines:
+        if TABLE_START_RE.match(line) and any(TABLE_START_RE.match(l) for l in current):
+            blocks.append('\n'.join(current).strip())
+            current = []
+        current.append(line)
+    if current:
+        blocks.append('\n'.join(current).strip())
+    
+    return [block for block in blocks if block]
 
-Now analyze the schema above and generate the Data Vault model as JSON."""
+def schema_table_names(text):
+    """Table names declared in a schema text"""
+    names = []
+    for line in text.split('\n'):
+        match = TABLE_NAME_RE.match(line)
+        if match and match.group(1) not in names:
+            names.append(match.group(1))
+    return names
+
+def chunk_schema(text, max_chars=None):
+    """Group table blocks into chunks of at most max_chars (a single oversized table stays whole)"""
+    max_chars = max_chars or SCHEMA_CHUNK_CHARS
+    if len(text) <= max_chars:
+        return [text]
+    
+    chunks = []
+    current = ''
+    for block in split_schema_tables(text):
+        if current and len(current) + len(block) + 2 > max_chars:
+            chunks.append(current)
+            current = ''
+        current = f"{current}\n\n{block}" if current else block
+    if current:
+        chunks.append(current)
+    
+    return chunks
+
+def _hub_ref_key(node_id):
+    key = node_id.lower()
+    if key.startswith('hub_'):
+        key = key[4:]
+    return key[:-1] if key.endswith('s') else key
+
+def _merge_list(target, source, field):
+    merged = list(target.get(field) or [])
+    for item in source.get(field) or []:
+        if item not in merged:
+            merged.append(item)
+    if merged:
+        target[field] = merged
+
+def merge_dv_models(models):
+    """Merge partial models from schema chunks into one model"""
+    nodes = OrderedDict()
+    aliases = {}
+    hub_by_key = {}
+    edges = []
+    
+    for model in models:
+        for source_node in model['nodes']:
+            node = dict(source_node)
+            node_id = node['id']
+            
+            # Dedupe hubs by (non-generic) business key
+            if node['type'] == 'hub':
+                key = str(node.get('businessKey') or '').strip().lower()
+                if key and key not in GENERIC_BUSINESS_KEYS:
+                    canonical = hub_by_key.setdefault(key, node_id)
+                    if canonical != node_id:
+                        aliases[node_id] = canonical
+                        _merge_list(nodes[canonical], node, 'attributes')
+                        continue
+            
+            if node_id in nodes:
+                _merge_list(nodes[node_id], node, 'attributes')
+                _merge_list(nodes[node_id], node, 'connects')
+                continue
+            
+            nodes[node_id] = node
+        
+        edges.extend(model.get('edges') or [])
+    
+    # Resolve hub references across chunks (aliases, then loose name match)
+    hub_ids = [nid for nid, n in nodes.items() if n['type'] == 'hub']
+    hub_lookup = {_hub_ref_key(hid): hid for hid in hub_ids}
+    
+    def resolve(ref):
+        ref = aliases.get(ref, ref)
+        if ref in nodes:
+            return ref
+        return hub_lookup.get(_hub_ref_key(str(ref)), ref)
+    
+    for node in nodes.values():
+        if node['type'] == 'satellite' and node.get('parent'):
+            node['parent'] = resolve(node['parent'])
+    
+    merged_edges = []
+    seen = set()
+    for edge in edges:
+        pair = (resolve(edge.get('from')), resolve(edge.get('to')))
+        if pair[0] in nodes and pair[1] in nodes and pair[0] != pair[1] and pair not in seen:
+            seen.add(pair)
+            merged_edges.append({'from': pair[0], 'to': pair[1]})
+    
+    # Re-derive link connects from both the declared list and hub → link edges
+    for node in nodes.values():
+        if node['type'] != 'link':
+            continue
+        connects = []
+        declared = [resolve(h) for h in node.get('connects') or []]
+        from_edges = [f for f, t in seen if t == node['id'] and nodes[f]['type'] == 'hub']
+        for hid in declared + sorted(from_edges):
+            if hid in nodes and nodes[hid]['type'] == 'hub' and hid not in connects:
+                connects.append(hid)
+        node['connects'] = connects
+    
+    return {'nodes': list(nodes.values()), 'edges': merged_edges}
+
+def chunk_requests(chunks):
+    """(chunk, other tables, label) for each chunk's conversion call"""
+    chunk_tables = [schema_table_names(chunk) for chunk in chunks]
+    return [
+        (chunk, [name for j, names in enumerate(chunk_tables) if j != i for name in names][:300],
+         f" (part {i + 1} of {len(chunks)})")
+        for i, chunk in enumerate(chunks)
+    ]
+
+def generate_dv_model_chunked(chunks, knowledge_snippet=''):
+    """Convert schema chunks concurrently and merge the partial models"""
+    return run_steps(generate_dv_model_chunked_steps(chunks, knowledge_snippet))
+
+def generate_dv_model_chunked_steps(chunks, knowledge_snippet=''):
+    total = len(chunks)
+    logger.info(f"🧩 Large schema: {total} chunks, concurrency {GENERATION_CONCURRENCY}")
+    
+    def convert(i, chunk, other_tables, part_label):
+        try:
+            return (yield from request_dv_model_steps(chunk, knowledge_snippet, other_tables, part_label))
+        except Exception as e:
+            raise Exception(f"Chunk {i + 1}/{total} failed: {e}")
+    
+    models = yield Gather([convert(i, *request) for i, request in enumerate(chunk_requests(chunks))])
+    
+    model = yield from repair_dv_model_steps(merge_dv_models(models))
+    logger.info(f"✅ Merged {total} chunks")
+    return model
+
+# Rule-based classifier: parse DDL / OCR column lists and classify tables without the LLM
+GENERATION_MODES = ('llm', 'rules', 'hybrid')
+
+DDL_HEADER_RE = re.compile(
+    r'create\s+(?:or\s+replace\s+)?(?:temp(?:orary)?\s+)?table\s+(?:if\s+not\s+exists\s+)?([`"\[]?[\w.]+[`"\]]?)\s*\(',
+    re.IGNORECASE
+)
+PK_CONSTRAINT_RE = re.compile(r'^primary\s+key\s*\(([^)]*)\)', re.IGNORECASE)
+FK_CONSTRAINT_RE = re.compile(
+    r'^foreign\s+key\s*\(([^)]*)\)\s*references\s+([`"\[]?[\w.]+[`"\]]?)\s*(?:\(([^)]*)\))?',
+    re.IGNORECASE
+)
+INLINE_FK_RE = re.compile(
+    r'(?:\bFK\b|\breferences\b)\s*(?:->|→|:|to)?\s*[`"\[]?([\w]+)[`"\]]?(?:\s*[.(]\s*[`"\[]?(\w+))?',
+    re.IGNORECASE
+)
+INLINE_PK_RE = re.compile(r'\bPK\b|primary\s+key', re.IGNORECASE)
+COLUMN_NAME_RE = re.compile(r'^[`"\[]?([A-Za-z_][\w]*)')
+COLUMN_LABELS = {'columns', 'column', 'fields', 'field', 'attributes'}
+SKIPPED_ITEMS = ('unique', 'index', 'key ', 'check', 'constraint')
+
+def _strip_identifier(name):
+    name = name.strip().strip('`"[]')
+    return name.split('.')[-1]
+
+def _split_top_level(text, separators=','):
+    """Split on separators outside parentheses"""
+    items = []
+    depth = 0
+    current = []
+    for ch in text:
+        if ch == '(':
+            depth += 1
+        elif ch == ')':
+            depth = max(0, depth - 1)
+        if ch in separators and depth == 0:
+            items.append(''.join(current).strip())
+            current = []
+        else:
+            current.append(ch)
+    items.append(''.join(current).strip())
+    return [item for item in items if item]
+
+def _ddl_tables(text):
+    """CREATE TABLE statements as (name, body, statement) tuples"""
+    tables = []
+    for match in DDL_HEADER_RE.finditer(text):
+        depth = 1
+        pos = match.end()
+        while pos < len(text) and depth:
+            if text[pos] == '(':
+                depth += 1
+            elif text[pos] == ')':
+                depth -= 1
+            pos += 1
+        tables.append((_strip_identifier(match.group(1)), text[match.end():pos - 1], text[match.start():pos]))
+    return tables
+
+def _parse_ddl_body(body):
+    columns = []
+    pk = []
+    fks = {}
+    
+    for item in _split_top_level(body):
+        clause = re.sub(r'^constraint\s+\S+\s+', '', item, flags=re.IGNORECASE)
+        pk_match = PK_CONSTRAINT_RE.match(clause)
+        fk_match = FK_CONSTRAINT_RE.match(clause)
+        
+        if pk_match:
+            pk.extend(_strip_identifier(c) for c in pk_match.group(1).split(','))
+        elif fk_match:
+            target = _strip_identifier(fk_match.group(2))
+            target_cols = [_strip_identifier(c) for c in (fk_match.group(3) or '').split(',') if c.strip()]
+            for i, col in enumerate(_strip_identifier(c) for c in fk_match.group(1).split(',')):
+                fks[col] = (target, target_cols[i] if i < len(target_cols) else None)
+        elif clause.lower().startswith(SKIPPED_ITEMS):
+            continue
+        else:
+            name_match = COLUMN_NAME_RE.match(clause)
+            if not name_match:
+                continue
+            name = name_match.group(1)
+            columns.append(name)
+            if INLINE_PK_RE.search(clause):
+                pk.append(name)
+            ref = re.search(r'\breferences\s+([`"\[]?[\w.]+[`"\]]?)\s*(?:\(([^)]*)\))?', clause, re.IGNORECASE)
+            if ref:
+                fks[name] = (_strip_identifier(ref.group(1)), _strip_identifier(ref.group(2)) if ref.group(2) else None)
+    
+    return columns, pk, fks
+
+def _parse_column_list(block):
+    """Tolerant parser for 'Table: x / Columns: a (PK), b (FK -> y.id)' style OCR text"""
+    lines = block.split('\n')
+    header = TABLE_NAME_RE.match(lines[0])
+    name = header.group(1) if header else None
+    body = '\n'.join(lines[1:]) if header else block
+    
+    columns = []
+    pk = []
+    fks = {}
+    for item in _split_top_level(body, ',\n;'):
+        item = re.sub(r'^(?:columns?|fields?|attributes)\s*[:\-]\s*', '', item, flags=re.IGNORECASE).strip(' -*•\t')
+        name_match = COLUMN_NAME_RE.match(item)
+        if not name_match or name_match.group(1).lower() in COLUMN_LABELS:
+            continue
+        column = name_match.group(1)
+        if column in columns:
+            continue
+        columns.append(column)
+        if INLINE_PK_RE.search(item):
+            pk.append(column)
+        fk = INLINE_FK_RE.search(item)
+        if fk:
+            fks[column] = (fk.group(1), fk.group(2))
+    
+    return name, columns, pk, fks
+
+def _singular(word):
+    lower = word.lower()
+    if lower.endswith('ies') and len(lower) > 4:
+        return word[:-3] + 'y'
+    if lower.endswith(('ses', 'xes', 'ches', 'shes')):
+        return word[:-2]
+    if lower.endswith('s') and not lower.endswith('ss') and len(lower) > 3:
+        return word[:-1]
+    return word
+
+def entity_name(table_name):
+    """Table name → DV entity name (customers → Customer, film_actor → Film_Actor)"""
+    return '_'.join(part[:1].upper() + part[1:] for part in _singular(table_name).split('_') if part)
+
+def parse_schema(text):
+    """Parse schema text into tables with columns, primary keys and foreign keys"""
+    tables = []
+    ddl = _ddl_tables(text)
+    
+    if ddl:
+        for name, body, statement in ddl:
+            columns, pk, fks = _parse_ddl_body(body)
+            tables.append({'name': name, 'columns': columns, 'pk': pk, 'fks': fks,
+                           'block': statement, 'inferred_pk': False})
+    else:
+        for block in split_schema_tables(text):
+            name, columns, pk, fks = _parse_column_list(block)
+            if name and columns:
+                tables.append({'name': name, 'columns': columns, 'pk': pk, 'fks': fks,
+                               'block': block, 'inferred_pk': False})
+    
+    by_singular = {_singular(t['name']).lower(): t['name'] for t in tables}
+    known = {t['name'].lower(): t['name'] for t in tables}
+    
+    for table in tables:
+        # Resolve FK targets to declared table names
+        for column, (target, target_col) in list(table['fks'].items()):
+            resolved = known.get(target.lower()) or by_singular.get(_singular(target).lower())
+            table['fks'][column] = (resolved or target, target_col)
+        
+        # Infer PK from id / <table>_id when OCR lost the markers
+        if not table['pk']:
+            own_id = f"{_singular(table['name']).lower()}_id"
+            for column in table['columns']:
+                if column.lower() in ('id', own_id):
+                    table['pk'] = [column]
+                    table['inferred_pk'] = True
+                    break
+        
+        # Infer FKs from <other_table>_id columns
+        for column in table['columns']:
+            if column in table['fks'] or not column.lower().endswith('_id'):
+                continue
+            target = by_singular.get(_singular(column[:-3]).lower())
+            if target and target != table['name'] and not (column in table['pk'] and len(table['pk']) == 1):
+                table['fks'][column] = (target, None)
+    
+    return tables
+
+def classify_table(table, table_names):
+    """'hub', 'link' or None (ambiguous) for a parsed table"""
+    fk_columns = [c for c, (target, _) in table['fks'].items() if target in table_names and target != table['name']]
+    pk = set(table['pk'])
+    
+    if len(fk_columns) >= 2 and (not pk or pk <= set(fk_columns)):
+        return 'link'
+    if pk and not (len(fk_columns) >= 2 and table['inferred_pk']):
+        return 'hub'
+    return None
+
+def build_rules_model(tables, include_ambiguous=True):
+    """Build a DV model from parsed tables, returning (model, ambiguous tables)"""
+    table_names = {t['name'] for t in tables}
+    kinds = {t['name']: classify_table(t, table_names) for t in tables}
+    hub_ids = {name: f"Hub_{entity_name(name)}" for name, kind in kinds.items() if kind == 'hub'}
+    
+    ambiguous = [t for t in tables if kinds[t['name']] is None]
+    if include_ambiguous:
+        for table in ambiguous:
+            kinds[table['name']] = 'hub'
+            hub_ids[table['name']] = f"Hub_{entity_name(table['name'])}"
+        ambiguous = []
+    
+    nodes = []
+    ids = set()
+    
+    def add(node):
+        if node['id'] in ids:
+            return False
+        ids.add(node['id'])
+        node['source'] = 'rules'
+        nodes.append(node)
+        return True
+    
+    for table in tables:
+        kind = kinds[table['name']]
+        if kind is None:
+            continue
+        name = table['name']
+        entity = entity_name(name)
+        fk_targets = {c: t for c, (t, _) in table['fks'].items() if t in hub_ids and t != name}
+        # Without a declared PK a hub takes its first column as the business key; either way
+        # the key lives on the hub, not in the satellite
+        business_key = table['pk'] or (table['columns'][:1] if kind == 'hub' else [])
+        attributes = [c for c in table['columns'] if c not in business_key and c not in fk_targets]
+        
+        if kind == 'hub':
+            hub_id = hub_ids[name]
+            add({
+                'id': hub_id,
+                'type': 'hub',
+                'businessKey': ', '.join(business_key),
+                'attributes': list(business_key),
+                'reasoning': (f"Passes HUB TEST (rules): table {name} has its own key "
+                              f"({', '.join(business_key)}) and is a business entity in its own right. "
+                              f"Not a link (no composite foreign key) and not a satellite (holds the key).")
+            })
+            parent = hub_id
+            
+            # Each foreign key is a relationship between two hubs
+            for column, target in fk_targets.items():
+                link_id = f"Link_{entity}_{entity_name(target)}"
+                add({
+                    'id': link_id,
+                    'type': 'link',
+                    'connects': [hub_id, hub_ids[target]],
+                    'reasoning': (f"Passes LINK TEST (rules): {name}.{column} references {target}, "
+                                  f"relating {hub_id} to {hub_ids[target]}. Relationships are modeled as links.")
+                })
+        else:
+            connects = []
+            for target in fk_targets.values():
+                if hub_ids[target] not in connects:
+                    connects.append(hub_ids[target])
+            link_id = 'Link_' + '_'.join(h[len('Hub_'):] for h in connects)
+            if link_id in ids:
+                link_id = f"Link_{entity}"
+            add({
+                'id': link_id,
+                'type': 'link',
+                'connects': connects,
+                'reasoning': (f"Passes LINK TEST (rules): {name} is a junction table whose key is made of "
+                              f"foreign keys to {', '.join(sorted(set(fk_targets.values())))} (many-to-many). "
+                              f"Not a hub (no independent business key).")
+            })
+            parent = link_id
+        
+        if attributes:
+            add({
+                'id': f"Sat_{entity}_Details",
+                'type': 'satellite',
+                'parent': parent,
+                'attributes': attributes,
+                'reasoning': (f"Passes SAT TEST (rules): descriptive columns of {name} "
+                              f"({', '.join(attributes[:6])}{'...' if len(attributes) > 6 else ''}) "
+                              f"only have meaning in the context of {parent}.")
+            })
+    
+    return {'nodes': nodes, 'edges': []}, ambiguous
+
+def generate_rules_model(ocr_text, mode, knowledge_snippet=''):
+    """Rules / hybrid generation: classify tables locally, LLM only for ambiguous ones in hybrid"""
+    tables = parse_schema(ocr_text)
+    if not tables:
+        if mode == 'rules':
+            raise ValueError("No tables could be parsed from the schema text")
+        logger.warning("⚠️ Rules parser found no tables, using LLM")
+        return None
+    
+    model, ambiguous = build_rules_model(tables, include_ambiguous=(mode == 'rules'))
+    logger.info(f"📐 Rules: {len(tables)} tables, {len(model['nodes'])} nodes, {len(ambiguous)} ambiguous")
+    
+    if ambiguous:
+        if not GROQ_API_KEY:
+            raise ValueError("GROQ_API_KEY not configured")
+        
+        ambiguous_text = '\n\n'.join(t['block'] for t in ambiguous)
+        ambiguous_names = {t['name'] for t in ambiguous}
+        other_tables = [t['name'] for t in tables if t['name'] not in ambiguous_names]
+        chunks = chunk_schema(ambiguous_text)
+        
+        if len(chunks) > 1:
+            llm_model = generate_dv_model_chunked(chunks, knowledge_snippet)
+        else:
+            llm_model = request_dv_model(ambiguous_text, knowledge_snippet, other_tables)
+        
+        for node in llm_model['nodes']:
+            node['source'] = 'llm'
+        model = merge_dv_models([model, llm_model])
+    
+    repair_dv_model(model)
+    return model
+
+def summarize_sources(model):
+    """Count nodes by the path that produced them"""
+    counts = {}
+    for node in model.get('nodes', []):
+        source = node.get('source', 'llm')
+        counts[source] = counts.get(source, 0) + 1
+    return counts
+
+def generate_dv_model(ocr_text, grounded=False, knowledge_content='', mode='llm'):
+    """Generate Data Vault model using GROQ with reasoning and strict naming"""
+    return run_steps(generate_dv_model_steps(ocr_text, grounded, knowledge_content, mode))
+
+def generate_dv_model_steps(ocr_text, grounded=False, knowledge_content='', mode='llm'):
+    if mode not in GENERATION_MODES:
+        raise ValueError(f"Unknown mode '{mode}' (choose from {', '.join(GENERATION_MODES)})")
+    if mode == 'llm' and not GROQ_API_KEY:
+        raise ValueError("GROQ_API_KEY not configured")
+    
+    knowledge_snippet = get_knowledge_snippet(grounded, knowledge_content)
     
     try:
-        print(f"🤖 Calling GROQ...", flush=True)
+        # Rules and hybrid classification is local work (hybrid converts its ambiguous tables with blocking calls)
+        model = None
+        if mode != 'llm':
+            model = yield Blocking('cpu', generate_rules_model, (ocr_text, mode, knowledge_snippet))
         
-        response = requests.post(
-            'https://api.groq.com/openai/v1/chat/completions',
-            headers={
-                'Authorization': f'Bearer {GROQ_API_KEY}',
-                'Content-Type': 'application/json'
-            },
-            json={
-                'model': 'llama-3.3-70b-versatile',
-                'messages': [
-                    {'role': 'system', 'content': system_prompt},
-                    {'role': 'user', 'content': user_prompt}
-                ],
-                'temperature': 0.1,
-                'max_tokens': 4000
-            },
-            timeout=60
+        if model is None:
+            if not GROQ_API_KEY:
+                raise ValueError("GROQ_API_KEY not configured")
+            
+            chunks = chunk_schema(ocr_text)
+            
+            if len(chunks) > 1:
+                model = yield from generate_dv_model_chunked_steps(chunks, knowledge_snippet)
+            else:
+                model = yield from request_dv_model_steps(ocr_text, knowledge_snippet)
+        
+        return finish_dv_model(model)
+    
+    except Exception as e:
+        logger.error(f"❌ Generation error: {e}")
+        raise
+
+def finish_dv_model(model):
+    """Tag node sources and add the edges implied by parents and links"""
+    for node in model['nodes']:
+        node.setdefault('source', 'llm')
+    
+    auto_count = add_missing_edges(model)
+    if auto_count > 0:
+        logger.info(f"✅ Auto-created {auto_count} edges")
+    
+    logger.info(f"✅ Model: {len(model['nodes'])} nodes, {len(model['edges'])} edges")
+    return model
+
+# Knowledge retrieval: chunked docs, FTS5/BM25 ranked against schema identifiers
+QUERY_STOPWORDS = {
+    'table', 'tables', 'create', 'column', 'columns', 'primary', 'foreign', 'key', 'keys', 'references',
+    'not', 'null', 'int', 'integer', 'bigint', 'smallint', 'varchar', 'char', 'text', 'date', 'datetime',
+    'timestamp', 'decimal', 'numeric', 'float', 'double', 'boolean', 'bool', 'default', 'unique', 'index',
+    'constraint', 'and', 'the', 'for', 'with', 'exists', 'auto_increment', 'autoincrement', 'serial'
+}
+DV_QUERY_TERMS = ['hub', 'link', 'satellite', 'business']
+WORD_RE = re.compile(r'[a-z][a-z0-9]{2,}')
+
+def chunk_knowledge_text(text, max_chars=None):
+    """Split a document into paragraph-aligned chunks of roughly max_chars"""
+    max_chars = max_chars or KNOWLEDGE_CHUNK_CHARS
+    chunks = []
+    current = ''
+    for paragraph in re.split(r'\n\s*\n', text.replace('\r\n', '\n')):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        while len(paragraph) > max_chars:
+            if current:
+                chunks.append(current)
+                current = ''
+            cut = paragraph.rfind(' ', 0, max_chars)
+            cut = cut if cut > max_chars // 2 else max_chars
+            chunks.append(paragraph[:cut].strip())
+            paragraph = paragraph[cut:].strip()
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            chunks.append(current)
+            current = ''
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        chunks.append(current)
+    return chunks
+
+def index_knowledge_doc(cursor, doc_id, content):
+    """Chunk a knowledge doc and add it to the retrieval index, returning the chunk count"""
+    chunks = chunk_knowledge_text(content)
+    for i, chunk in enumerate(chunks):
+        cursor.execute(
+            "INSERT INTO knowledge_chunks (doc_id, chunk_index, content) VALUES (?, ?, ?)",
+            (doc_id, i, chunk)
         )
+        if _fts_available:
+            cursor.execute("INSERT INTO knowledge_fts (rowid, content) VALUES (?, ?)", (cursor.lastrowid, chunk))
+    return len(chunks)
+
+def schema_query_terms(schema_text, limit=64):
+    """Table and column name terms from a schema, plus core DV vocabulary"""
+    terms = []
+    for word in WORD_RE.findall(schema_text.lower().replace('_', ' ')):
+        if word not in QUERY_STOPWORDS and word not in terms:
+            terms.append(word)
+    for term in DV_QUERY_TERMS:
+        if term not in terms:
+            terms.append(term)
+    return terms[:limit]
+
+def _bm25_rank(terms, chunks, k1=1.5, b=0.75):
+    """Rank (id, content) chunks by BM25 against terms, best first"""
+    docs = [(chunk_id, WORD_RE.findall(content.lower())) for chunk_id, content in chunks]
+    if not docs:
+        return []
+    
+    avg_len = sum(len(words) for _, words in docs) / len(docs) or 1.0
+    doc_freq = {term: sum(1 for _, words in docs if term in words) for term in terms}
+    
+    scored = []
+    for chunk_id, words in docs:
+        counts = {}
+        for word in words:
+            counts[word] = counts.get(word, 0) + 1
+        score = 0.0
+        for term in terms:
+            tf = counts.get(term, 0)
+            if not tf:
+                continue
+            idf = math.log(1 + (len(docs) - doc_freq[term] + 0.5) / (doc_freq[term] + 0.5))
+            score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(words) / avg_len))
+        if score > 0:
+            scored.append((score, chunk_id))
+    
+    scored.sort(key=lambda item: -item[0])
+    return [chunk_id for _, chunk_id in scored]
+
+def retrieve_knowledge(schema_text, top_k=None, token_budget=None):
+    """Most relevant knowledge chunks for a schema, within a token budget"""
+    top_k = top_k or KNOWLEDGE_TOP_K
+    budget_chars = (token_budget or KNOWLEDGE_TOKEN_BUDGET) * 4
+    terms = schema_query_terms(schema_text)
+    
+    with db.read() as cursor:
+        if _fts_available:
+            query = ' OR '.join(f'"{term}"' for term in terms)
+            cursor.execute("""
+                SELECT c.id, c.content FROM knowledge_fts f
+                JOIN knowledge_chunks c ON c.id = f.rowid
+                WHERE knowledge_fts MATCH ?
+                ORDER BY bm25(knowledge_fts)
+                LIMIT ?
+            """, (query, top_k))
+            ranked = [(row['id'], row['content']) for row in cursor.fetchall()]
+        else:
+            cursor.execute("SELECT id, content FROM knowledge_chunks")
+            chunks = {row['id']: row['content'] for row in cursor.fetchall()}
+            ranked = [(chunk_id, chunks[chunk_id]) for chunk_id in _bm25_rank(terms, chunks.items())[:top_k]]
         
-        print(f"📥 GROQ status: {response.status_code}", flush=True)
-        response.raise_for_status()
-        result = response.json()
+        # Nothing matched: fall back to the start of the most recent doc
+        if not ranked:
+            cursor.execute("""
+                SELECT c.id, c.content FROM knowledge_chunks c
+                WHERE c.doc_id = (SELECT MAX(id) FROM knowledge_docs)
+                ORDER BY c.chunk_index
+                LIMIT ?
+            """, (top_k,))
+            ranked = [(row['id'], row['content']) for row in cursor.fetchall()]
+    
+    selected = []
+    used = 0
+    for _, content in ranked:
+        if used + len(content) > budget_chars:
+            if not selected:
+                selected.append(content[:budget_chars])
+            break
+        selected.append(content)
+        used += len(content) + 2
+    
+    logger.info(f"📚 Retrieved {len(selected)} knowledge chunks ({used} chars)")
+    return '\n\n'.join(selected)
+
+# Model cache: in-process hot tier in front of the SQLite model_cache table
+_hot_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_cache_stats = {'hot_hits': 0, 'db_hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+
+def normalize_schema_text(text):
+    """Normalize OCR text so whitespace-only differences share a cache entry"""
+    lines = [' '.join(line.split()) for line in text.replace('\r\n', '\n').replace('\r', '\n').split('\n')]
+    return '\n'.join(line for line in lines if line)
+
+def model_cache_key(ocr_text, grounded=False, knowledge_content='', mode='llm'):
+    """Content-addressed key for a generation request"""
+    parts = [
+        normalize_schema_text(ocr_text),
+        get_knowledge_snippet(grounded, knowledge_content),
+        GROQ_MODEL,
+        str(GROQ_TEMPERATURE),
+        PROMPT_VERSION,
+        mode
+    ]
+    digest = hashlib.sha256()
+    for part in parts:
+        encoded = part.encode('utf-8')
+        digest.update(str(len(encoded)).encode('ascii') + b':' + encoded)
+    return digest.hexdigest()
+
+def _bump_cache_stat(name, amount=1):
+    with _cache_lock:
+        _cache_stats[name] += amount
+
+def _hot_cache_put(key, model_json, created_at):
+    with _cache_lock:
+        _hot_cache[key] = (model_json, created_at)
+        _hot_cache.move_to_end(key)
+        while len(_hot_cache) > MODEL_CACHE_HOT_SIZE:
+            _hot_cache.popitem(last=False)
+
+def model_cache_get(key):
+    """Look up a cached model, hot tier first, then SQLite"""
+    now = time.time()
+    
+    with _cache_lock:
+        entry = _hot_cache.get(key)
+        if entry and now - entry[1] <= MODEL_CACHE_TTL:
+            _hot_cache.move_to_end(key)
+            _cache_stats['hot_hits'] += 1
+            return json.loads(entry[0])
+        if entry:
+            del _hot_cache[key]
+    
+    row = db.query_one("SELECT model_json, created_at FROM model_cache WHERE cache_key = ?", (key,))
+    
+    if not row:
+        _bump_cache_stat('misses')
+        return None
+    
+    if now - row['created_at'] > MODEL_CACHE_TTL:
+        db.execute("DELETE FROM model_cache WHERE cache_key = ?", (key,))
+        _bump_cache_stat('misses')
+        _bump_cache_stat('evictions')
+        return None
+    
+    # Recency bookkeeping only feeds LRU eviction, so it rides the deferred write batch
+    db.defer(
+        "UPDATE model_cache SET last_accessed = ?, hit_count = hit_count + 1 WHERE cache_key = ?",
+        (now, key)
+    )
+    
+    _hot_cache_put(key, row['model_json'], row['created_at'])
+    _bump_cache_stat('db_hits')
+    return json.loads(row['model_json'])
+
+def model_cache_put(key, model):
+    """Store a generated model and evict expired / least recently used rows"""
+    now = time.time()
+    model_json = json.dumps(model)
+    
+    with db.write() as cursor:
+        cursor.execute(
+            """INSERT OR REPLACE INTO model_cache (cache_key, model_json, created_at, last_accessed, hit_count)
+               VALUES (?, ?, ?, ?, 0)""",
+            (key, model_json, now, now)
+        )
+        
+        cursor.execute("DELETE FROM model_cache WHERE created_at < ?", (now - MODEL_CACHE_TTL,))
+        evicted = cursor.rowcount
+        cursor.execute("""
+            DELETE FROM model_cache WHERE cache_key IN (
+                SELECT cache_key FROM model_cache
+                ORDER BY last_accessed DESC
+                LIMIT -1 OFFSET ?
+            )
+        """, (MODEL_CACHE_MAX_ENTRIES,))
+        evicted += cursor.rowcount
+    
+    _hot_cache_put(key, model_json, now)
+    _bump_cache_stat('stores')
+    if evicted > 0:
+        _bump_cache_stat('evictions', evicted)
+
+def get_cache_stats():
+    """Snapshot of model cache counters"""
+    with _cache_lock:
+        stats = dict(_cache_stats)
+        stats['hot_entries'] = len(_hot_cache)
+    lookups = stats['hot_hits'] + stats['db_hits'] + stats['misses']
+    stats['hit_rate'] = round((stats['hot_hits'] + stats['db_hits']) / lookups, 3) if lookups else 0.0
+    return stats
+
+def _cache_lookup(key):
+    try:
+        cached = model_cache_get(key)
+    except Exception as e:
+        logger.warning(f"⚠️ Model cache read failed: {e}")
+        return None
+    if cached is not None:
+        logger.info(f"⚡ Model cache hit: {key[:12]}")
+    return cached
+
+def _cache_store(key, model):
+    try:
+        model_cache_put(key, model)
+    except Exception as e:
+        logger.warning(f"⚠️ Model cache write failed: {e}")
+
+def generate_dv_model_cached(ocr_text, grounded=False, knowledge_content='', force_refresh=False, mode='llm'):
+    """Generate a model, reusing a cached result for identical inputs"""
+    return run_steps(generate_dv_model_cached_steps(ocr_text, grounded, knowledge_content, force_refresh, mode))
+
+def generate_dv_model_cached_steps(ocr_text, grounded=False, knowledge_content='', force_refresh=False, mode='llm'):
+    # Rules-only generation is local and fast, nothing to cache
+    if mode == 'rules':
+        return (yield from generate_dv_model_steps(ocr_text, grounded, knowledge_content, mode)), False
+    
+    key = model_cache_key(ocr_text, grounded, knowledge_content, mode)
+    
+    if not force_refresh:
+        cached = yield Blocking('db', _cache_lookup, (key,))
+        if cached is not None:
+            return cached, True
+    
+    model = yield from generate_dv_model_steps(ocr_text, grounded, knowledge_content, mode)
+    yield Blocking('db', _cache_store, (key, model))
+    
+    return model, False
+
+def generate_dv_model_stream(ocr_text, grounded=False, knowledge_content='', force_refresh=False, mode='llm'):
+    """Streaming variant of generate_dv_model_cached: yields ('node', node) then ('model', (model, cached))"""
+    # Rules and hybrid models are assembled locally and delivered once complete
+    if mode != 'llm':
+        model, cached = generate_dv_model_cached(ocr_text, grounded, knowledge_content, force_refresh, mode)
+        for node in model['nodes']:
+            yield 'node', node
+        yield 'model', (model, cached)
+        return
+    
+    key = model_cache_key(ocr_text, grounded, knowledge_content, mode)
+    
+    if not force_refresh:
+        cached = _cache_lookup(key)
+        if cached is not None:
+            for node in cached['nodes']:
+                yield 'node', node
+            yield 'model', (cached, True)
+            return
+    
+    if not GROQ_API_KEY:
+        raise ValueError("GROQ_API_KEY not configured")
+    
+    # Chunked conversions run in parallel and are delivered once merged
+    if len(chunk_schema(ocr_text)) > 1:
+        model = generate_dv_model(ocr_text, grounded, knowledge_content)
+        for node in model['nodes']:
+            yield 'node', node
+    else:
+        model = None
+        for kind, payload in stream_dv_model(ocr_text, get_knowledge_snippet(grounded, knowledge_content)):
+            if kind == 'node':
+                payload['source'] = 'llm'
+                yield kind, payload
+            else:
+                model = payload
         
-        if 'error' in result:
-            raise Exception(f"GROQ error: {result['error'].get('message')}")
+        model = finish_dv_model(model)
+    
+    _cache_store(key, model)
+    yield 'model', (model, False)
+
+# Model versions: table-level schema diff and incremental regeneration
+def table_digests(tables):
+    """{table key: (name, digest)} fingerprinting each parsed table's definition"""
+    digests = {}
+    for table in tables:
+        block = re.sub(r'\s+', ' ', table['block']).strip()
+        digests[table['name'].lower()] = (table['name'], hashlib.sha256(block.encode('utf-8')).hexdigest()[:16])
+    return digests
+
+def schema_context_digest(ocr_text, tables):
+    """Fingerprint of the schema text outside the parsed table blocks (ALTER TABLE, notes...)"""
+    rest = normalize_schema_text(ocr_text)
+    for table in tables:
+        rest = rest.replace(normalize_schema_text(table['block']), '', 1)
+    return hashlib.sha256(normalize_schema_text(rest).encode('utf-8')).hexdigest()[:16]
+
+def knowledge_digest(grounded, knowledge_content):
+    """Fingerprint of the knowledge snippet a generation was grounded on"""
+    return hashlib.sha256(get_knowledge_snippet(grounded, knowledge_content).encode('utf-8')).hexdigest()[:16]
+
+def diff_schema_tables(old, new):
+    """Table-level diff between two table_digests() maps"""
+    shared = old.keys() & new.keys()
+    return {
+        'added': sorted(new[k][0] for k in new.keys() - old.keys()),
+        'removed': sorted(old[k][0] for k in old.keys() - new.keys()),
+        'changed': sorted(new[k][0] for k in shared if new[k][1] != old[k][1]),
+        'unchanged': sorted(new[k][0] for k in shared if new[k][1] == old[k][1])
+    }
+
+def _node_table_score(node, entity, columns, fk_entities):
+    rest = node['id'].split('_', 1)[1].lower() if '_' in node['id'] else node['id'].lower()
+    score = 0.0
+    # Links are named after the hubs they join, so only an exact name says "link table"
+    prefix_match = rest.startswith(entity + '_') and node.get('type') != 'link'
+    if rest == entity or _singular(rest) == entity or prefix_match:
+        score += 3 + len(entity) / 100
+    elif entity in rest:
+        score += 1
+    
+    fields = node.get('attributes') if isinstance(node.get('attributes'), list) else []
+    fields = fields + [node.get('businessKey')]
+    score += sum(1 for f in fields if isinstance(f, str) and f.lower() in columns)
+    
+    if node.get('type') == 'link':
+        score += 2 * sum(1 for e in fk_entities if e in rest)
+    return score
+
+def attribute_nodes(model, tables):
+    """Best-effort node id → source table, by naming and column overlap"""
+    profiles = [
+        (t['name'], entity_name(t['name']).lower(), {c.lower() for c in t['columns']},
+         {entity_name(target).lower() for target, _ in t['fks'].values()})
+        for t in tables
+    ]
+    node_tables = {}
+    
+    # Satellites last so they can follow their parent
+    for node in sorted(model['nodes'], key=lambda n: n.get('type') == 'satellite'):
+        best, best_score = None, 0
+        for name, entity, columns, fk_entities in profiles:
+            score = _node_table_score(node, entity, columns, fk_entities)
+            if node.get('type') == 'satellite' and node_tables.get(node.get('parent')) == name:
+                score += 2
+            if score > best_score:
+                best, best_score = name, score
+        if best:
+            node_tables[node['id']] = best
+    
+    return node_tables
+
+def patch_dv_model(parent_model, node_tables, diff, tables, knowledge_snippet=''):
+    """Re-convert changed/added tables and merge them over the parent's untouched nodes"""
+    stale = {name.lower() for name in diff['changed'] + diff['removed']}
+    kept = {
+        'nodes': [n for n in parent_model['nodes'] if (node_tables.get(n['id']) or '').lower() not in stale],
+        'edges': parent_model['edges']
+    }
+    models = [kept]
+    
+    regenerate = {name.lower() for name in diff['changed'] + diff['added']}
+    blocks = [t['block'] for t in tables if t['name'].lower() in regenerate]
+    if blocks:
+        text = '\n\n'.join(blocks)
+        chunks = chunk_schema(text)
+        if len(chunks) > 1:
+            partial = generate_dv_model_chunked(chunks, knowledge_snippet)
+        else:
+            other_tables = [t['name'] for t in tables if t['name'].lower() not in regenerate][:300]
+            partial = request_dv_model(text, knowledge_snippet, other_tables, ' (incremental)')
+        for node in partial['nodes']:
+            node.setdefault('source', 'llm')
+        models.append(partial)
+    
+    model = merge_dv_models(models)
+    
+    # Drop links and satellites left hanging by removed tables
+    while True:
+        ids = {n['id'] for n in model['nodes']}
+        nodes = [
+            n for n in model['nodes']
+            if not (n['type'] == 'satellite' and n.get('parent') not in ids)
+            and not (n['type'] == 'link' and len(n.get('connects') or []) < 2)
+        ]
+        if len(nodes) == len(model['nodes']):
+            break
+        ids = {n['id'] for n in nodes}
+        model = {'nodes': nodes, 'edges': [e for e in model['edges'] if e['from'] in ids and e['to'] in ids]}
+    
+    add_missing_edges(model)
+    repair_dv_model(model)
+    logger.info(f"✅ Patched model: {len(kept['nodes'])} reused, {len(model['nodes'])} nodes")
+    return model
+
+def diff_dv_models(old, new):
+    """Node and edge level diff between two models (reasoning ignored)"""
+    def strip(node):
+        return {k: v for k, v in node.items() if k != 'reasoning'}
+    
+    old_nodes = {n['id']: strip(n) for n in old['nodes']}
+    new_nodes = {n['id']: strip(n) for n in new['nodes']}
+    old_edges = {(e.get('from'), e.get('to')) for e in old['edges']}
+    new_edges = {(e.get('from'), e.get('to')) for e in new['edges']}
+    
+    return {
+        'nodes': {
+            'added': [nid for nid in new_nodes if nid not in old_nodes],
+            'removed': [nid for nid in old_nodes if nid not in new_nodes],
+            'changed': [nid for nid in new_nodes if nid in old_nodes and new_nodes[nid] != old_nodes[nid]]
+        },
+        'edges': {
+            'added': [list(e) for e in sorted(new_edges - old_edges, key=str)],
+            'removed': [list(e) for e in sorted(old_edges - new_edges, key=str)]
+        }
+    }
+
+# Server-side layout: hubs on top, links below them, satellites stacked under their parent
+LAYOUT_VERSION = '1'
+HUB_SPACING = 280
+LINK_SPACING = 280
+SAT_SPACING = 220
+SAT_ROW_HEIGHT = 140
+SAT_STACK = 4
+TIER_GAP = 300
+
+def _order_hubs(hub_ids, neighbors, sweeps=4):
+    """Order hubs so linked hubs sit close together (BFS seed + barycenter sweeps)"""
+    index = {h: i for i, h in enumerate(hub_ids)}
+    by_degree = sorted(hub_ids, key=lambda h: (-len(neighbors[h]), index[h]))
+    
+    order = []
+    seen = set()
+    for start in by_degree:
+        if start in seen:
+            continue
+        seen.add(start)
+        queue = deque([start])
+        while queue:
+            hub = queue.popleft()
+            order.append(hub)
+            for other in sorted(neighbors[hub], key=lambda h: (-len(neighbors[h]), index[h])):
+                if other not in seen:
+                    seen.add(other)
+                    queue.append(other)
+    
+    for _ in range(sweeps):
+        position = {h: i for i, h in enumerate(order)}
+        order.sort(key=lambda h: (position[h] + sum(position[n] for n in neighbors[h])) / (len(neighbors[h]) + 1))
+    return order
+
+def _spread(items):
+    """[(key, desired_x, width)] → {key: x}, keeping order by desired x without overlaps"""
+    placed = {}
+    previous = None
+    shift = 0.0
+    for key, desired, width in sorted(items, key=lambda item: item[1]):
+        x = desired if previous is None else max(desired, previous[0] + (previous[1] + width) / 2)
+        placed[key] = x
+        shift += x - desired
+        previous = (x, width)
+    # Re-center the row on its desired positions
+    shift = shift / len(items) if items else 0.0
+    return {key: x - shift for key, x in placed.items()}
+
+def _sat_group_width(count):
+    return max(1, math.ceil(count / SAT_STACK)) * SAT_SPACING
+
+def compute_layout(model):
+    """Layered coordinates for a model, O(n log n) in nodes and edges"""
+    nodes = OrderedDict((str(n['id']), n) for n in model['nodes'] if n.get('id'))
+    hubs = [nid for nid, n in nodes.items() if n.get('type') not in ('link', 'satellite')]
+    links = [nid for nid, n in nodes.items() if n.get('type') == 'link']
+    hub_set = set(hubs)
+    
+    # Hubs joined by each link, from connects and hub → link edges
+    link_hubs = {lid: [h for h in nodes[lid].get('connects') or [] if h in hub_set] for lid in links}
+    for edge in model.get('edges') or []:
+        source, target = edge.get('from'), edge.get('to')
+        if target in link_hubs and source in hub_set and source not in link_hubs[target]:
+            link_hubs[target].append(source)
+    
+    neighbors = {h: set() for h in hubs}
+    for connected in link_hubs.values():
+        for a in connected:
+            neighbors[a].update(h for h in connected if h != a)
+    
+    satellites = {}
+    orphans = []
+    for nid, node in nodes.items():
+        if node.get('type') == 'satellite':
+            parent = node.get('parent')
+            if parent in nodes and parent != nid:
+                satellites.setdefault(parent, []).append(nid)
+            else:
+                orphans.append(nid)
+    
+    order = _order_hubs(hubs, neighbors)
+    bands = [order[i:i + LAYOUT_BAND_HUBS] for i in range(0, len(order), LAYOUT_BAND_HUBS)] or [[]]
+    band_of = {h: i for i, band in enumerate(bands) for h in band}
+    
+    band_links = [[] for _ in bands]
+    for lid in links:
+        homes = [band_of[h] for h in link_hubs[lid]]
+        band_links[min(homes) if homes else 0].append(lid)
+    
+    positions = {}
+    y = 100.0
+    for i, band in enumerate(bands):
+        # Hub tier: slots wide enough for each hub's satellite stack
+        x = 0.0
+        previous_width = None
+        for hub in band:
+            width = max(HUB_SPACING, _sat_group_width(len(satellites.get(hub, []))))
+            x = 0.0 if previous_width is None else x + (previous_width + width) / 2
+            positions[hub] = {'x': x, 'y': y}
+            previous_width = width
         
-        if not result.get('choices'):
-            raise Exception('No GROQ response')
+        # Link tier: centered under the hubs each link joins
+        link_y = y + TIER_GAP
+        if band_links[i]:
+            items = []
+            for lid in band_links[i]:
+                xs = [positions[h]['x'] for h in link_hubs[lid] if h in positions]
+                desired = sum(xs) / len(xs) if xs else 0.0
+                items.append((lid, desired, max(LINK_SPACING, _sat_group_width(len(satellites.get(lid, []))))))
+            for lid, lx in _spread(items).items():
+                positions[lid] = {'x': lx, 'y': link_y}
+            sat_y = link_y + TIER_GAP
+        else:
+            sat_y = link_y
         
-        content = result['choices'][0]['message']['content'].strip()
-        content = content.replace('```json', '').replace('```', '').strip()
+        # Satellite tier: a small grid under each parent
+        groups = [(parent, positions[parent]['x'], _sat_group_width(len(satellites[parent])))
+                  for parent in band + band_links[i] if satellites.get(parent)]
+        if i == 0 and orphans:
+            right = max((p['x'] for p in positions.values()), default=0.0)
+            groups.append(('', right + HUB_SPACING, _sat_group_width(len(orphans))))
         
-        model = json.loads(content)
-        validate_dv_model(model)
+        deepest = 0
+        for parent, gx in _spread(groups).items():
+            members = satellites.get(parent, []) if parent else orphans
+            columns = max(1, math.ceil(len(members) / SAT_STACK))
+            left = gx - (columns - 1) * SAT_SPACING / 2
+            for j, sid in enumerate(members):
+                positions[sid] = {'x': left + (j // SAT_STACK) * SAT_SPACING, 'y': sat_y + (j % SAT_STACK) * SAT_ROW_HEIGHT}
+            deepest = max(deepest, min(len(members), SAT_STACK))
         
-        if 'edges' not in model:
-            model['edges'] = []
+        y = sat_y + max(deepest - 1, 0) * SAT_ROW_HEIGHT + TIER_GAP
+    
+    # Shift into positive space
+    min_x = min((p['x'] for p in positions.values()), default=0.0)
+    for p in positions.values():
+        p['x'] = round(p['x'] - min_x + 100, 1)
+        p['y'] = round(p['y'], 1)
+    
+    return {
+        'algorithm': 'layered',
+        'version': LAYOUT_VERSION,
+        'positions': positions,
+        'width': max((p['x'] for p in positions.values()), default=0.0) + 100,
+        'height': max((p['y'] for p in positions.values()), default=0.0) + 100
+    }
+
+# Background jobs: bounded executor, state persisted in the jobs table
+JOB_TERMINAL = ('succeeded', 'failed')
+
+_job_executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix='job')
+_job_pending = 0
+_job_pending_lock = threading.Lock()
+_job_updates = threading.Condition()
+
+_job_heartbeat = None
+
+# Owner of the jobs this process runs; renewed in forked workers
+INSTANCE_ID = uuid.uuid4().hex[:12]
+
+def _renew_instance_id():
+    global INSTANCE_ID, _job_heartbeat
+    INSTANCE_ID = uuid.uuid4().hex[:12]
+    _job_heartbeat = None
+
+os.register_at_fork(after_in_child=_renew_instance_id)
+
+class JobQueueFull(Exception):
+    pass
+
+def _job_heartbeat_loop():
+    while True:
+        time.sleep(JOB_HEARTBEAT_SECONDS)
+        with _job_pending_lock:
+            pending = _job_pending
+        if not pending:
+            continue
+        try:
+            renew_job_leases(INSTANCE_ID)
+        except Exception as e:
+            logger.warning(f"⚠️ Job heartbeat failed: {e}")
+
+def _ensure_job_heartbeat():
+    global _job_heartbeat
+    with _job_pending_lock:
+        if _job_heartbeat is None:
+            _job_heartbeat = threading.Thread(target=_job_heartbeat_loop, name='job-heartbeat', daemon=True)
+            _job_heartbeat.start()
+
+def update_job(job_id, status=None, progress=None, result=None, error=None):
+    """Persist a job state change and wake up any status streams"""
+    fields = {}
+    if status is not None:
+        fields['status'] = status
+    if progress is not None:
+        fields['progress'] = progress
+    if result is not None:
+        fields['result_json'] = json.dumps(result)
+    if error is not None:
+        fields['error'] = error
+    
+    update_job_row(job_id, **fields)
+    
+    with _job_updates:
+        _job_updates.notify_all()
+
+def get_job(job_id):
+    """Load a job as a dict, or None"""
+    row = find_job(job_id)
+    if not row:
+        return None
+    
+    # The owning instance died without failing it; any reader may settle the lease
+    if row['status'] not in JOB_TERMINAL and (row['heartbeat_at'] or row['updated_at']) < time.time() - JOB_LEASE_SECONDS:
+        if recover_stale_jobs(job_id):
+            return get_job(job_id)
+    
+    return {
+        'id': row['id'],
+        'kind': row['kind'],
+        'status': row['status'],
+        'progress': row['progress'],
+        'params': json.loads(row['params_json']) if row['params_json'] else {},
+        'result': json.loads(row['result_json']) if row['result_json'] else None,
+        'error': row['error'],
+        'created_at': row['created_at'],
+        'updated_at': row['updated_at']
+    }
+
+def _run_job(job_id, func, args):
+    global _job_pending
+    
+    try:
+        update_job(job_id, status='running', progress='Started')
+        logger.info(f"⚙️ Job {job_id} running")
         
-        # Auto-generate missing edges
-        node_lookup = {n['id']: n for n in model['nodes']}
-        existing = {(e.get('from'), e.get('to')) for e in model['edges']}
+        result = func(*args, progress=lambda message: update_job(job_id, progress=message))
         
-        auto_count = 0
-        for node in model['nodes']:
-            if node['type'] == 'satellite' and node.get('parent'):
-                pid = node['parent']
-                if (pid, node['id']) not in existing:
-                    model['edges'].append({'from': pid, 'to': node['id']})
-                    auto_count += 1
-            
-            elif node['type'] == 'link' and node.get('connects'):
-                for hid in node['connects']:
-                    if (hid, node['id']) not in existing:
-                        model['edges'].append({'from': hid, 'to': node['id']})
-                        auto_count += 1
+        update_job(job_id, status='succeeded', progress='Done', result=result)
+        logger.info(f"✅ Job {job_id} succeeded")
+    
+    except Exception as e:
+        logger.exception(f"❌ Job {job_id} failed: {e}")
+        try:
+            update_job(job_id, status='failed', progress='Failed', error=str(e))
+        except Exception as db_error:
+            logger.error(f"❌ Job {job_id} state not saved: {db_error}")
+    
+    finally:
+        with _job_pending_lock:
+            _job_pending -= 1
+
+def submit_job(kind, params, func, *args):
+    """Queue func(*args, progress=...) on the job executor and return the job id"""
+    global _job_pending
+    
+    with _job_pending_lock:
+        if _job_pending >= JOB_MAX_PENDING:
+            raise JobQueueFull(f"Too many jobs in flight ({JOB_MAX_PENDING}), try again shortly")
+        _job_pending += 1
+    
+    try:
+        job_id = uuid.uuid4().hex
         
-        if auto_count > 0:
-            print(f"✅ Auto-created {auto_count} edges", flush=True)
+        _ensure_job_heartbeat()
+        insert_job(job_id, kind, params, INSTANCE_ID)
         
-        print(f"✅ Model: {len(model['nodes'])} nodes, {len(model['edges'])} edges", flush=True)
-        return model
+        _job_executor.submit(_run_job, job_id, func, args)
+        return job_id
     
-    except Exception as e:
-        print(f"❌ Generation error: {e}", flush=True)
+    except Exception:
+        with _job_pending_lock:
+            _job_pending -= 1
         raise
 
+def get_job_stats():
+    """Snapshot of background job capacity"""
+    with _job_pending_lock:
+        pending = _job_pending
+    return {'in_flight': pending, 'workers': JOB_WORKERS, 'max_pending': JOB_MAX_PENDING}
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -421,10 +4215,20 @@ def check_config():
             init_db()
         
         return jsonify({
-            'ocr_configured': bool(OCR_API_KEY),
+            'ocr_configured': ocr_configured(),
+            'ocr_backend': OCR_BACKEND,
+            'ocr_backends': {name: backend.available() for name, backend in OCR_BACKENDS.items()},
             'groq_configured': bool(GROQ_API_KEY),
-            'database': 'SQLite',
-            'database_ready': _db_initialized
+            'database': 'libSQL' if db.backend.name == 'libsql' else 'SQLite',
+            'database_ready': _db_initialized,
+            'database_pool': db.stats(),
+            'model_cache': get_cache_stats(),
+            'jobs': get_job_stats(),
+            'generations': generation_flights.snapshot(),
+            'providers': {
+                'ocr': ocr_client.snapshot(),
+                'groq': groq_client.snapshot()
+            }
         }), 200
     except Exception as e:
         return jsonify({
@@ -434,270 +4238,1188 @@ def check_config():
             'error': str(e)
         }), 500
 
+@register_collector
+def collect_runtime_metrics():
+    """Pool, job, cache and provider state sampled at scrape time"""
+    pool = db.stats()
+    jobs = get_job_stats()
+    cache = get_cache_stats()
+    providers = {client.name: client.snapshot() for client in (ocr_client, groq_client)}
+    return [
+        ('dv_db_connections', 'gauge', 'Pooled database connections by state',
+         {('in_use',): pool['in_use'], ('idle',): pool['idle']}, ('state',)),
+        ('dv_db_pending_writes', 'gauge', 'Deferred writes waiting for a flush', {(): pool['pending_writes']}, ()),
+        ('dv_db_transactions_total', 'counter', 'Committed write transactions', {(): pool['transactions']}, ()),
+        ('dv_jobs_in_flight', 'gauge', 'Background jobs queued or running', {(): jobs['in_flight']}, ()),
+        ('dv_model_cache_lookups_total', 'counter', 'Model cache lookups by result',
+         {(name,): cache[name] for name in ('hot_hits', 'db_hits', 'misses')}, ('result',)),
+        ('dv_provider_retries_total', 'counter', 'Provider request retries',
+         {(name,): stats['retries'] for name, stats in providers.items()}, ('provider',)),
+        ('dv_provider_circuit_open', 'gauge', 'Provider circuit breaker open (1) or closed (0)',
+         {(name,): int(stats['circuit'] == 'open') for name, stats in providers.items()}, ('provider',)),
+    ]
+
+@app.before_request
+def start_request_trace():
+    g.request_started = time.perf_counter()
+    g.trace_token = _trace.set({})
+    g.route = request.url_rule.rule if request.url_rule else 'unmatched'
+    HTTP_IN_FLIGHT.inc(g.route)
+
+@app.after_request
+def record_request_trace(response):
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    elapsed = time.perf_counter() - started
+    HTTP_IN_FLIGHT.dec(g.route)
+    HTTP_SECONDS.observe(elapsed, request.method, g.route, response.status_code)
+    
+    trace = _trace.get() or {}
+    _trace.reset(g.pop('trace_token'))
+    fields = {'method': request.method, 'route': g.route, 'status': response.status_code,
+              'duration_ms': round(elapsed * 1000, 1)}
+    fields.update({f"{name}_ms": round(total * 1000, 1) for name, (total, _) in trace.items()})
+    level = logging.INFO if elapsed * 1000 >= LOG_SLOW_REQUEST_MS else logging.DEBUG
+    logger.log(level, f"⏱️ {request.method} {request.path}", extra={'fields': fields})
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+def summarize_usage(rows):
+    """Totals, latency percentiles and estimate accuracy for a set of llm_usage rows"""
+    latencies = sorted(row['latency_ms'] for row in rows if row['latency_ms'] is not None)
+    prompt = sum(row['prompt_tokens'] or 0 for row in rows)
+    completion = sum(row['completion_tokens'] or 0 for row in rows)
+    reported = [row for row in rows if row['prompt_tokens']]
+    tables = sum(row['tables'] or 0 for row in rows if row['completion_tokens'])
+    
+    def percentile(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+    
+    return {
+        'calls': len(rows),
+        'errors': sum(1 for row in rows if row['error']),
+        'truncated': sum(1 for row in rows if row['finish_reason'] == 'length'),
+        'prompt_tokens': prompt,
+        'completion_tokens': completion,
+        'latency_ms': {'avg': round(sum(latencies) / len(latencies), 1) if latencies else None,
+                       'p50': percentile(0.5), 'p95': percentile(0.95)},
+        'completion_tokens_per_table': round(completion / tables, 1) if tables else None,
+        # Actual / locally estimated prompt tokens, to keep the estimator honest
+        'estimate_ratio': round(sum(r['prompt_tokens'] for r in reported) /
+                                sum(r['estimated_prompt_tokens'] for r in reported), 3) if reported else None
+    }
+
+@app.route('/api/usage', methods=['GET'])
+def get_usage():
+    """LLM token usage and latency summary (?days=7)"""
+    try:
+        if not _db_initialized:
+            init_db()
+        
+        try:
+            days = min(max(int(request.args.get('days', 7)), 1), 365)
+        except ValueError:
+            return jsonify({'error': 'days must be an integer'}), 400
+        
+        rows = llm_usage_since(time.time() - days * 86400)
+        
+        by_variant = {}
+        by_day = OrderedDict()
+        for row in rows:
+            by_variant.setdefault(row['prompt_variant'] or 'unknown', []).append(row)
+            by_day.setdefault(datetime.fromtimestamp(row['created_at']).date().isoformat(), []).append(row)
+        
+        return jsonify({
+            'days': days,
+            'total': summarize_usage(rows),
+            'by_variant': {variant: summarize_usage(group) for variant, group in by_variant.items()},
+            'by_day': {day: summarize_usage(group) for day, group in by_day.items()},
+            'limits': {'max_tokens': GROQ_MAX_TOKENS, 'max_prompt_tokens': GROQ_MAX_PROMPT_TOKENS,
+                       'compact_prompt_max_tables': COMPACT_PROMPT_MAX_TABLES}
+        }), 200
+    
+    except Exception as e:
+        logger.error(f"❌ Usage error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def process_upload(filename, file_bytes, file_digest, ocr_backend=None, progress=None):
+    """Run OCR for an uploaded file and store the result"""
+    # Identical file already processed - skip OCR
+    existing = find_ocr_by_digest(file_digest)
+    if existing:
+        logger.info(f"⚡ Duplicate upload: reusing OCR ID {existing['id']}")
+        return upload_result(existing['id'], existing['extracted_text'], duplicate=True)
+    
+    # OCR straight from memory - nothing is written to disk
+    if progress:
+        progress('Extracting text via OCR')
+    extracted_text = extract_text_bytes(file_bytes, filename, ocr_backend)
+    logger.info(f"✅ Text extracted: {len(extracted_text)} chars")
+    
+    # Store in database
+    if progress:
+        progress('Storing OCR result')
+    ocr_id = store_ocr_result(filename, extracted_text, file_digest)
+    return upload_result(ocr_id, extracted_text, duplicate=False)
+
+def store_ocr_result(filename, extracted_text, file_digest):
+    """Insert an OCR result and return its id"""
+    logger.info(f"💾 Storing in database...")
+    
+    try:
+        ocr_id = insert_ocr_result(filename, extracted_text, file_digest)
+        
+        logger.info(f"✅ Stored: OCR ID {ocr_id}")
+        
+    except Exception as db_error:
+        logger.exception(f"❌ Database error: {db_error}")
+        raise Exception(f"Database error: {str(db_error)}")
+    
+    return ocr_id
+
+def upload_result(ocr_id, extracted_text, duplicate=False):
+    """Response body of a finished upload"""
+    preview = extracted_text[:500] + '...' if len(extracted_text) > 500 else extracted_text
+    
+    return {
+        'success': True,
+        'ocr_id': ocr_id,
+        'extracted_text': preview,
+        'full_text': extracted_text,
+        'duplicate': duplicate
+    }
+
+def wants_async(data):
+    """Whether the client asked for a background job instead of a blocking call"""
+    value = data.get('async') if data else None
+    if value is None:
+        value = request.args.get('async')
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def read_upload_request():
+    """Validated upload of the current request as (filename, bytes, digest, ocr_backend), or an error response"""
+    if 'file' not in request.files:
+        return None, (jsonify({'error': 'No file'}), 400)
+    
+    file = request.files['file']
+    logger.info(f"📄 File: {file.filename}")
+    
+    if not file.filename or not allowed_file(file.filename):
+        return None, (jsonify({'error': 'Invalid file'}), 400)
+    
+    ocr_backend = request.form.get('ocr_backend') or None
+    if ocr_backend and ocr_backend.lower() not in OCR_BACKENDS:
+        return None, (jsonify({'error': f"Unknown OCR backend '{ocr_backend}'"}), 400)
+    
+    try:
+        file_bytes, file_digest = read_upload(file)
+    except ValueError as e:
+        return None, (jsonify({'error': str(e)}), 400)
+    
+    filename = secure_filename(file.filename)
+    logger.info(f"🔐 Digest: {file_digest[:12]} ({len(file_bytes)} bytes)")
+    return (filename, file_bytes, file_digest, ocr_backend), None
+
 @app.route('/api/upload', methods=['POST'])
 def upload_file():
     """Handle file upload and OCR"""
-    print("=" * 60, flush=True)
-    print("📤 Upload request received", flush=True)
+    logger.info("📤 Upload request received")
+    
+    try:
+        if not _db_initialized:
+            init_db()
+        
+        upload, error = read_upload_request()
+        if error:
+            return error
+        filename, file_bytes, file_digest, ocr_backend = upload
+        
+        try:
+            if wants_async(request.form):
+                job_id = submit_job('ocr', {'filename': filename, 'file_digest': file_digest, 'ocr_backend': ocr_backend},
+                                    process_upload, filename, file_bytes, file_digest, ocr_backend)
+                logger.info(f"📨 Queued OCR job {job_id}")
+                return jsonify({'success': True, 'job_id': job_id, 'status': 'queued'}), 202
+            
+            result = process_upload(filename, file_bytes, file_digest, ocr_backend)
+            
+            logger.info("✅ Upload complete")
+            
+            return jsonify(result), 200
+        
+        except JobQueueFull as e:
+            return jsonify({'error': str(e)}), 503
+        
+        except Exception as e:
+            logger.exception(f"❌ Processing error: {e}")
+            return jsonify({'error': str(e)}), 500
+    
+    except Exception as e:
+        logger.exception(f"❌ Request error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/manual-schema', methods=['POST'])
+def manual_schema():
+    """Handle manual schema text input"""
+    logger.info("📝 Manual schema request")
+    
+    try:
+        if not _db_initialized:
+            init_db()
+        
+        data = request.get_json()
+        if not data or not data.get('schema_text'):
+            return jsonify({'error': 'Missing schema text'}), 400
+        
+        schema_text = data['schema_text'].strip()
+        
+        if not schema_text:
+            return jsonify({'error': 'Empty schema text'}), 400
+        
+        logger.info(f"📄 Schema text: {len(schema_text)} chars")
+        
+        try:
+            ocr_id = insert_ocr_result('manual_input.txt', schema_text)
+            
+            logger.info(f"✅ Stored: OCR ID {ocr_id}")
+            
+            return jsonify({
+                'success': True,
+                'ocr_id': ocr_id,
+                'extracted_text': schema_text[:500] + '...' if len(schema_text) > 500 else schema_text
+            }), 200
+        
+        except Exception as db_error:
+            logger.exception(f"❌ Database error: {db_error}")
+            return jsonify({'error': f"Database error: {str(db_error)}"}), 500
+    
+    except Exception as e:
+        logger.exception(f"❌ Request error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/update-ocr', methods=['POST'])
+def update_ocr():
+    """Update OCR text after user edits"""
+    logger.info("✏️ Update OCR request")
+    
+    try:
+        if not _db_initialized:
+            init_db()
+        
+        data = request.get_json()
+        if not data or not data.get('ocr_id') or not data.get('updated_text'):
+            return jsonify({'error': 'Missing ocr_id or updated_text'}), 400
+        
+        ocr_id = data['ocr_id']
+        updated_text = data['updated_text'].strip()
+        
+        if not updated_text:
+            return jsonify({'error': 'Empty text'}), 400
+        
+        logger.info(f"📝 Updating OCR ID {ocr_id}: {len(updated_text)} chars")
+        
+        try:
+            previous = replace_ocr_text(ocr_id, updated_text)
+            if previous is None:
+                return jsonify({'error': 'OCR result not found'}), 404
+            
+            diff = diff_schema_tables(table_digests(parse_schema(previous)),
+                                      table_digests(parse_schema(updated_text)))
+            
+            logger.info(f"✅ Updated OCR ID {ocr_id}: {len(diff['changed'])} changed, {len(diff['added'])} added, "
+                        f"{len(diff['removed'])} removed tables")
+            
+            return jsonify({
+                'success': True,
+                'message': 'Text updated successfully',
+                'diff': diff
+            }), 200
+        
+        except Exception as db_error:
+            logger.exception(f"❌ Database error: {db_error}")
+            return jsonify({'error': f"Database error: {str(db_error)}"}), 500
+    
+    except Exception as e:
+        logger.exception(f"❌ Request error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+def load_generation_inputs(ocr_id, grounded=False):
+    """Load the schema text and (when grounded) knowledge for a generation"""
+    # Get OCR text
+    ocr_text = get_ocr_text(ocr_id)
+    
+    if ocr_text is None:
+        raise LookupError('OCR result not found')
+    
+    logger.info(f"✅ OCR loaded: {len(ocr_text)} chars")
+    
+    # Retrieve relevant knowledge if grounded
+    knowledge = retrieve_knowledge(ocr_text) if grounded else ''
+    
+    return ocr_text, knowledge
+
+# Normalized model storage
+NODE_TEXT_COLUMNS = {'id': 'node_id', 'type': 'type', 'parent': 'parent', 'businessKey': 'business_key'}
+NODE_JSON_COLUMNS = {'attributes': 'attributes', 'connects': 'connects'}
+REASONING_CODEC = 'zlib'
+
+def compact_json(value):
+    return json.dumps(value, separators=(',', ':'))
+
+def compress_reasoning(texts):
+    return zlib.compress(compact_json(texts).encode('utf-8'), 9)
+
+def decompress_reasoning(codec, data):
+    if codec != 'zlib':
+        raise ValueError(f"Unknown reasoning codec '{codec}'")
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+def save_model_rows(cursor, model_id, model, node_tables=None):
+    """Write a model's nodes, edges and compressed reasoning into the normalized tables"""
+    node_tables = node_tables or {}
+    node_rows = []
+    reasoning = []
+    
+    for position, node in enumerate(model.get('nodes', [])):
+        columns = {column: None for column in list(NODE_TEXT_COLUMNS.values()) + list(NODE_JSON_COLUMNS.values())}
+        extra = {}
+        for key, value in node.items():
+            if key == 'reasoning':
+                continue
+            if key in NODE_TEXT_COLUMNS and isinstance(value, str):
+                columns[NODE_TEXT_COLUMNS[key]] = value
+            elif key in NODE_JSON_COLUMNS:
+                columns[NODE_JSON_COLUMNS[key]] = compact_json(value)
+            else:
+                extra[key] = value
+        node_rows.append((model_id, position, columns['node_id'] or '', columns['type'], columns['parent'],
+                          columns['business_key'], columns['attributes'], columns['connects'],
+                          compact_json(extra) if extra else None, node_tables.get(columns['node_id'])))
+        reasoning.append(node.get('reasoning'))
+    
+    edge_rows = []
+    for position, edge in enumerate(model.get('edges', [])):
+        extra = {k: v for k, v in edge.items() if k not in ('from', 'to')}
+        edge_rows.append((model_id, position, edge.get('from'), edge.get('to'),
+                          compact_json(extra) if extra else None))
+    
+    cursor.executemany("""
+        INSERT INTO dv_model_nodes (model_id, position, node_id, type, parent, business_key, attributes, connects,
+                                    extra, source_table)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    """, node_rows)
+    cursor.executemany(
+        "INSERT INTO dv_model_edges (model_id, position, from_node, to_node, extra) VALUES (?, ?, ?, ?, ?)",
+        edge_rows
+    )
+    if any(reasoning):
+        cursor.execute(
+            "INSERT OR REPLACE INTO dv_model_reasoning (model_id, codec, data) VALUES (?, ?, ?)",
+            (model_id, REASONING_CODEC, compress_reasoning(reasoning))
+        )
+
+def node_from_row(row, reasoning=None):
+    """Model node dict from a dv_model_nodes row"""
+    node = {'id': row['node_id']}
+    for key, column in NODE_TEXT_COLUMNS.items():
+        if key != 'id' and row[column] is not None:
+            node[key] = row[column]
+    for key, column in NODE_JSON_COLUMNS.items():
+        if row[column] is not None:
+            node[key] = json.loads(row[column])
+    if row['extra']:
+        node.update(json.loads(row['extra']))
+    if reasoning is not None:
+        node['reasoning'] = reasoning
+    return node
+
+def load_stored_model(cursor, model_id, types=None, include_reasoning=True):
+    """Rebuild a model from the normalized tables, optionally only some node types / without reasoning"""
+    query = "SELECT * FROM dv_model_nodes WHERE model_id = ?"
+    params = [model_id]
+    if types:
+        query += f" AND type IN ({', '.join('?' * len(types))})"
+        params.extend(types)
+    cursor.execute(query + " ORDER BY position", params)
+    rows = cursor.fetchall()
+    
+    reasoning = []
+    if include_reasoning:
+        cursor.execute("SELECT codec, data FROM dv_model_reasoning WHERE model_id = ?", (model_id,))
+        stored = cursor.fetchone()
+        if stored:
+            reasoning = decompress_reasoning(stored['codec'], stored['data'])
+    
+    nodes = [node_from_row(row, reasoning[row['position']] if row['position'] < len(reasoning) else None)
+             for row in rows]
+    
+    cursor.execute("SELECT from_node, to_node, extra FROM dv_model_edges WHERE model_id = ? ORDER BY position", (model_id,))
+    node_ids = {n['id'] for n in nodes}
+    edges = []
+    for row in cursor.fetchall():
+        if types and not (row['from_node'] in node_ids and row['to_node'] in node_ids):
+            continue
+        edge = {'from': row['from_node'], 'to': row['to_node']}
+        if row['extra']:
+            edge.update(json.loads(row['extra']))
+        edges.append(edge)
+    
+    return {'nodes': nodes, 'edges': edges}
+
+def load_node_tables(cursor, model_id):
+    """node id → source table recorded when the model was stored"""
+    cursor.execute("SELECT node_id, source_table FROM dv_model_nodes WHERE model_id = ? AND source_table IS NOT NULL",
+                   (model_id,))
+    return {row['node_id']: row['source_table'] for row in cursor.fetchall()}
+
+def get_model_layout(model_id, model=None):
+    """Cached layout for a stored model, computed and saved on first use"""
+    row = db.query_one("SELECT version, data FROM dv_model_layouts WHERE model_id = ?", (model_id,))
+    if row and row['version'] == LAYOUT_VERSION:
+        return json.loads(zlib.decompress(row['data']).decode('utf-8'))
+    
+    start = time.perf_counter()
+    if model is None:
+        model = load_model_any(model_id)[0]
+    layout = compute_layout(model)
+    db.execute(
+        "INSERT OR REPLACE INTO dv_model_layouts (model_id, version, data) VALUES (?, ?, ?)",
+        (model_id, LAYOUT_VERSION, zlib.compress(compact_json(layout).encode('utf-8'), 6))
+    )
+    logger.info(f"📐 Layout for model {model_id}: {len(layout['positions'])} nodes in "
+                f"{(time.perf_counter() - start) * 1000:.0f}ms")
+    return layout
+
+def migrate_model_storage(cursor):
+    """Normalize dv_models rows still holding a JSON blob; returns the number migrated"""
+    cursor.execute("SELECT id FROM dv_models WHERE storage IS NULL OR storage = 'json'")
+    model_ids = [row['id'] for row in cursor.fetchall()]
+    
+    migrated = 0
+    for model_id in model_ids:
+        cursor.execute("SELECT model_json FROM dv_models WHERE id = ?", (model_id,))
+        try:
+            model = json.loads(cursor.fetchone()['model_json'])
+        except (TypeError, ValueError) as e:
+            logger.warning(f"⚠️ Model {model_id} left as JSON: {e}")
+            continue
+        cursor.execute("DELETE FROM dv_model_nodes WHERE model_id = ?", (model_id,))
+        cursor.execute("DELETE FROM dv_model_edges WHERE model_id = ?", (model_id,))
+        save_model_rows(cursor, model_id, model)
+        cursor.execute("UPDATE dv_models SET model_json = '', storage = 'normalized' WHERE id = ?", (model_id,))
+        migrated += 1
+    
+    if migrated:
+        logger.info(f"📦 Migrated {migrated} models to normalized storage")
+    return migrated
+
+def find_parent_model(ocr_id, parent_id=None):
+    """Latest stored model for an OCR result (or an explicit parent), with its table fingerprints"""
+    with db.read() as cursor:
+        if parent_id:
+            cursor.execute("""
+                SELECT id, ocr_id, grounded, version, parent_id, mode, storage, context_digest, knowledge_digest
+                FROM dv_models WHERE id = ?
+            """, (parent_id,))
+        else:
+            cursor.execute("""
+                SELECT id, ocr_id, grounded, version, parent_id, mode, storage, context_digest, knowledge_digest
+                FROM dv_models WHERE ocr_id = ? ORDER BY id DESC LIMIT 1
+            """, (ocr_id,))
+        row = cursor.fetchone()
+        if not row:
+            if parent_id:
+                raise LookupError('Parent model not found')
+            return None
+        
+        parent = dict(row)
+        parent['version'] = parent['version'] or 1
+        cursor.execute("SELECT table_key, table_name, digest FROM dv_model_tables WHERE model_id = ?", (parent['id'],))
+        parent['digests'] = {r['table_key']: (r['table_name'], r['digest']) for r in cursor.fetchall()}
+    return parent
+
+def store_dv_model(ocr_id, model, grounded=False, schema_text=None, mode=None, parent=None, knowledge_content=''):
+    """Insert a generated model (as a new version of parent) and return its id"""
+    tables = parse_schema(schema_text) if schema_text else []
+    context = schema_context_digest(schema_text, tables) if schema_text else None
+    
+    with db.write() as cursor:
+        cursor.execute("""
+            INSERT INTO dv_models (ocr_id, model_json, grounded, created_at, storage, parent_id, version, mode,
+                                   context_digest, knowledge_digest)
+            VALUES (?, '', ?, ?, 'normalized', ?, ?, ?, ?, ?)
+        """, (ocr_id, 1 if grounded else 0, datetime.now().isoformat(),
+              parent['id'] if parent else None, parent['version'] + 1 if parent else 1, mode,
+              context, knowledge_digest(grounded, knowledge_content)))
+        
+        model_id = cursor.lastrowid
+        save_model_rows(cursor, model_id, model, attribute_nodes(model, tables))
+        cursor.executemany(
+            "INSERT OR REPLACE INTO dv_model_tables (model_id, table_key, table_name, digest) VALUES (?, ?, ?, ?)",
+            [(model_id, key, name, digest) for key, (name, digest) in table_digests(tables).items()]
+        )
+    
+    logger.info(f"✅ Model stored: ID {model_id}")
+    return model_id
+
+def incremental_parent(parent, grounded, mode, force_refresh=False, incremental=True):
+    """Whether the new version can be patched from parent instead of regenerated"""
+    return bool(
+        incremental and parent and not force_refresh and mode == 'llm'
+        and parent['mode'] == mode and bool(parent['grounded']) == bool(grounded)
+        and parent['storage'] == 'normalized' and parent['digests']
+    )
+
+def generate_dv_model_incremental(parent, ocr_text, grounded=False, knowledge_content=''):
+    """Patch the parent model for edited tables; returns (model, cached, diff), with diff None
+    when the edit can't be expressed per table and the model was regenerated in full"""
+    tables = parse_schema(ocr_text)
+    digests = table_digests(tables)
+    diff = diff_schema_tables(parent['digests'], digests)
+    
+    # Table digests only cover the blocks parse_schema recognises
+    reason = None
+    if not digests.keys() & parent['digests'].keys():
+        reason = 'none of its tables are left'
+    elif parent['context_digest'] != schema_context_digest(ocr_text, tables):
+        reason = 'text outside the table definitions changed'
+    elif parent['knowledge_digest'] != knowledge_digest(grounded, knowledge_content):
+        reason = 'knowledge changed'
+    if reason:
+        logger.info(f"🔄 Full regeneration instead of patching model {parent['id']}: {reason}")
+        model, cached = generate_dv_model_cached(ocr_text, grounded, knowledge_content)
+        return model, cached, None
+    
+    if not (diff['added'] or diff['changed'] or diff['removed']):
+        logger.info(f"♻️ Schema unchanged since model {parent['id']}")
+        return load_model_version(parent['id'])['model'], True, diff
+    
+    key = model_cache_key(ocr_text, grounded, knowledge_content, 'llm')
+    cached = _cache_lookup(key)
+    if cached is not None:
+        return cached, True, diff
+    
+    if not GROQ_API_KEY:
+        raise ValueError("GROQ_API_KEY not configured")
+    
+    logger.info(f"🩹 Incremental from model {parent['id']}: {len(diff['changed'])} changed, "
+                f"{len(diff['added'])} added, {len(diff['removed'])} removed")
+    # Load the parent first so no pooled connection is held across the LLM call
+    parent_model, node_tables = load_patch_parent(parent['id'])
+    model = patch_dv_model(parent_model, node_tables, diff, tables, get_knowledge_snippet(grounded, knowledge_content))
+    _cache_store(key, model)
+    return model, False, diff
+
+# Request coalescing: identical generations already running are joined instead of repeated
+class SingleFlight:
+    """At most one call per key at a time; concurrent callers with the same key share its result"""
+    
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'coalesced': 0}
+    
+    def begin(self, key):
+        """Start the call for key or join the one in flight; returns (call, leader)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None, 'callbacks': []}
+                self.stats['calls'] += 1
+            else:
+                self.stats['coalesced'] += 1
+        return call, leader
+    
+    def wait(self, call):
+        """Result of a call another caller leads; raises its error"""
+        call['done'].wait()
+        if call['error'] is not None:
+            raise call['error']
+        return call['result']
+    
+    def finish(self, key, call, result=None, error=None):
+        """Hand the leader's result or error to everyone waiting on key"""
+        call['result'], call['error'] = result, error
+        with self._lock:
+            del self._calls[key]
+            call['done'].set()
+            callbacks, call['callbacks'] = call['callbacks'], []
+        for callback in callbacks:
+            callback()
+    
+    def on_done(self, call, callback):
+        """Run callback() once the call finishes (right away if it has); lets coroutines wait without a thread"""
+        with self._lock:
+            if not call['done'].is_set():
+                call['callbacks'].append(callback)
+                return
+        callback()
+    
+    def do(self, key, func, *args, on_wait=None, **kwargs):
+        """Run func or wait for the identical call in flight; returns (result, shared)"""
+        call, leader = self.begin(key)
+        if not leader:
+            if on_wait:
+                on_wait()
+            return self.wait(call), True
+        
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result)
+        return result, False
+    
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, in_flight=len(self._calls))
+
+generation_flights = SingleFlight()
+
+def generation_flight_key(ocr_id, ocr_text, grounded, knowledge, mode, force_refresh, incremental, parent_id):
+    """Everything that makes two generate requests interchangeable, including the schema and knowledge content"""
+    digest = hashlib.sha256()
+    for part in (ocr_text, knowledge if grounded else ''):
+        encoded = part.encode('utf-8')
+        digest.update(str(len(encoded)).encode('ascii') + b':' + encoded)
+    return (ocr_id, digest.hexdigest(), bool(grounded), mode, bool(force_refresh), bool(incremental), parent_id)
+
+def process_generate(ocr_id, grounded=False, force_refresh=False, mode='llm', incremental=True, parent_id=None,
+                     progress=None):
+    """Generate and store a Data Vault model for an OCR result, joining an identical generation in flight"""
+    ocr_text, knowledge = load_generation_inputs(ocr_id, grounded)
+    key = generation_flight_key(ocr_id, ocr_text, grounded, knowledge, mode, force_refresh, incremental, parent_id)
+    
+    def waiting():
+        logger.info(f"🔗 Joining generation in flight for OCR ID {ocr_id}")
+        if progress:
+            progress('Waiting for an identical generation')
+    
+    steps = generate_and_store_steps(ocr_id, ocr_text, knowledge, grounded, force_refresh, mode, incremental,
+                                     parent_id, progress)
+    result, shared = generation_flights.do(key, run_steps, steps, on_wait=waiting)
+    return dict(result, coalesced=shared)
+
+def generate_and_store_steps(ocr_id, ocr_text, knowledge, grounded, force_refresh, mode, incremental, parent_id,
+                             progress=None):
+    """Steps of one generation, from the parent lookup to the stored model's result"""
+    parent = yield Blocking('db', find_parent_model, (ocr_id, parent_id))
+    diff = None
+    
+    # Generate model
+    if progress:
+        progress('Generating model')
+    if incremental_parent(parent, grounded, mode, force_refresh, incremental):
+        # A patch converts only the edited tables, with blocking calls
+        model, cached, diff = yield Blocking('cpu', generate_dv_model_incremental, (parent, ocr_text, grounded,
+                                                                                  knowledge))
+    else:
+        model, cached = yield from generate_dv_model_cached_steps(ocr_text, grounded, knowledge, force_refresh, mode)
+    
+    # Store model
+    if progress:
+        progress('Storing model')
+    model_id = yield Blocking('db', store_dv_model, (ocr_id, model, grounded, ocr_text, mode, parent, knowledge))
+    return generation_result(model_id, model, cached, mode, parent, diff)
+
+def generation_result(model_id, model, cached, mode, parent=None, diff=None):
+    """Response body of a finished generation"""
+    return {
+        'success': True,
+        'model_id': model_id,
+        'model': model,
+        'cached': cached,
+        'mode': mode,
+        'sources': summarize_sources(model),
+        'version': parent['version'] + 1 if parent else 1,
+        'parent_id': parent['id'] if parent else None,
+        'incremental': diff is not None,
+        'diff': diff
+    }
+
+# Idempotency-Key: the first response to a key is stored and replayed to retries within IDEMPOTENCY_TTL
+def request_fingerprint():
+    """Method, path and canonical JSON body of the current request"""
+    body = request.get_json(silent=True)
+    payload = json.dumps(body, sort_keys=True, separators=(',', ':')) if body is not None else request.get_data(as_text=True)
+    return hashlib.sha256(f"{request.method} {request.path}\n{payload}".encode('utf-8')).hexdigest()
+
+def claim_idempotency_key(key, fingerprint):
+    """Reserve a key for this request; returns the stored row if it was already claimed"""
+    now = time.time()
+    with db.write():
+        purge_idempotency_keys(now - IDEMPOTENCY_TTL)
+        if insert_idempotency_key(key, fingerprint, now):
+            return None
+        
+        # The request holding the claim was killed mid-flight (timeout, OOM, deploy): this retry takes over
+        if take_over_idempotency_key(key, fingerprint, now, now - IDEMPOTENCY_CLAIM_TIMEOUT):
+            logger.warning(f"⚠️ Taking over stale claim of Idempotency-Key {key}")
+            return None
+        return get_idempotency_key(key)
+
+def begin_idempotent_request():
+    """Claim the request's Idempotency-Key; returns (key, None) to run the view or (None, response) to answer
+    without it. (None, None) when the request has no key"""
+    key = request.headers.get('Idempotency-Key', '').strip()
+    if not key:
+        return None, None
+    if len(key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+        return None, (jsonify({'error': f'Idempotency-Key longer than {IDEMPOTENCY_MAX_KEY_LENGTH} characters'}), 400)
+    
+    if not _db_initialized:
+        init_db()
+    fingerprint = request_fingerprint()
+    stored = claim_idempotency_key(key, fingerprint)
+    if stored is None:
+        return key, None
+    if stored['fingerprint'] != fingerprint:
+        return None, (jsonify({'error': 'Idempotency-Key was already used for a different request'}), 422)
+    if stored['status'] is None:
+        return None, (jsonify({'error': 'A request with this Idempotency-Key is still in progress'}), 409)
+    
+    logger.info(f"♻️ Replaying response for Idempotency-Key {key}")
+    replay = Response(stored['body'], status=stored['status'], mimetype=stored['mimetype'])
+    replay.headers['Idempotent-Replayed'] = 'true'
+    return None, replay
+
+def finish_idempotent_request(key, response=None):
+    """Store the response for replay, or release the key (no response, server error) so a retry runs again"""
+    if response is None or response.status_code >= 500:
+        delete_idempotency_key(key)
+    else:
+        save_idempotent_response(key, response.status_code, response.mimetype, response.get_data())
+
+def idempotent(view):
+    """Replay the stored response for a repeated Idempotency-Key instead of running the view again"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key, early = begin_idempotent_request()
+        if early is not None:
+            return early
+        if key is None:
+            return view(*args, **kwargs)
+        
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            finish_idempotent_request(key)
+            raise
+        finish_idempotent_request(key, response)
+        return response
+    return wrapper
+
+def read_generate_options(data):
+    """(ocr_id, grounded, force_refresh, mode, incremental, parent_id) of a generate request, or an error response"""
+    if not data or not data.get('ocr_id'):
+        return None, (jsonify({'error': 'Missing ocr_id'}), 400)
+    
+    mode = str(data.get('mode') or DEFAULT_GENERATION_MODE).lower()
+    if mode not in GENERATION_MODES:
+        return None, (jsonify({'error': f"Invalid mode '{mode}' (choose from {', '.join(GENERATION_MODES)})"}), 400)
+    
+    force_refresh = str(data.get('force_refresh', False)).lower() in ('1', 'true', 'yes')
+    incremental = str(data.get('incremental', True)).lower() in ('1', 'true', 'yes')
+    return (data['ocr_id'], data.get('grounded', False), force_refresh, mode, incremental, data.get('parent_id')), None
+
+@app.route('/api/generate', methods=['POST'])
+@idempotent
+def generate_model():
+    """Generate Data Vault model"""
+    logger.info("🧠 Generate request")
     
     try:
         if not _db_initialized:
             init_db()
         
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file'}), 400
-        
-        file = request.files['file']
-        print(f"📄 File: {file.filename}", flush=True)
-        
-        if not file.filename or not allowed_file(file.filename):
-            return jsonify({'error': 'Invalid file'}), 400
-        
-        filepath = None
+        data = request.get_json()
+        options, error = read_generate_options(data)
+        if error:
+            return error
+        ocr_id, grounded, force_refresh, mode, incremental, parent_id = options
         
         try:
-            filename = secure_filename(file.filename)
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(filepath)
-            print(f"✅ File saved", flush=True)
-            
-            # OCR extraction
-            extracted_text = extract_text_ocr(filepath)
-            print(f"✅ Text extracted: {len(extracted_text)} chars", flush=True)
-            
-            # Store in database
-            print(f"💾 Storing in database...", flush=True)
-            
-            try:
-                conn = get_sqlite_connection()
-                cursor = conn.cursor()
-                
-                cursor.execute(
-                    "INSERT INTO ocr_results (filename, extracted_text, created_at) VALUES (?, ?, ?)",
-                    (filename, extracted_text, datetime.now().isoformat())
-                )
-                
-                ocr_id = cursor.lastrowid
-                conn.commit()
+            if wants_async(data):
+                if not ocr_result_exists(ocr_id):
+                    return jsonify({'error': 'OCR result not found'}), 404
                 
-                print(f"✅ Stored: OCR ID {ocr_id}", flush=True)
-                
-            except Exception as db_error:
-                print(f"❌ Database error: {db_error}", flush=True)
-                import traceback
-                traceback.print_exc()
-                raise Exception(f"Database error: {str(db_error)}")
-            
-            preview = extracted_text[:500] + '...' if len(extracted_text) > 500 else extracted_text
+                job_id = submit_job('generate', {'ocr_id': ocr_id, 'grounded': bool(grounded), 'mode': mode},
+                                    process_generate, ocr_id, grounded, force_refresh, mode, incremental, parent_id)
+                logger.info(f"📨 Queued generate job {job_id}")
+                return jsonify({'success': True, 'job_id': job_id, 'status': 'queued'}), 202
             
-            print("✅ Upload complete", flush=True)
-            print("=" * 60, flush=True)
+            result = process_generate(ocr_id, grounded, force_refresh, mode, incremental, parent_id)
             
-            return jsonify({
-                'success': True,
-                'ocr_id': ocr_id,
-                'extracted_text': preview,
-                'full_text': extracted_text
-            }), 200
+            return jsonify(result), 200
+        
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        
+        except JobQueueFull as e:
+            return jsonify({'error': str(e)}), 503
         
         except Exception as e:
-            print(f"❌ Processing error: {e}", flush=True)
-            import traceback
-            traceback.print_exc()
+            logger.exception(f"❌ Generation error: {e}")
             return jsonify({'error': str(e)}), 500
-        
-        finally:
-            if filepath and os.path.exists(filepath):
-                try:
-                    os.remove(filepath)
-                    print(f"✅ Temp file deleted", flush=True)
-                except:
-                    pass
     
     except Exception as e:
-        print(f"❌ Request error: {e}", flush=True)
-        import traceback
-        traceback.print_exc()
+        logger.error(f"❌ Request error: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/manual-schema', methods=['POST'])
-def manual_schema():
-    """Handle manual schema text input"""
-    print("=" * 60, flush=True)
-    print("📝 Manual schema request", flush=True)
+def sse_event(event, payload):
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+@app.route('/api/generate/stream', methods=['GET'])
+def generate_model_stream():
+    """Generate Data Vault model, streaming nodes as server-sent events"""
+    logger.info("🧠 Streaming generate request")
+    
+    if not _db_initialized:
+        init_db()
+    
+    ocr_id = request.args.get('ocr_id', type=int)
+    if not ocr_id:
+        return jsonify({'error': 'Missing ocr_id'}), 400
     
+    truthy = ('1', 'true', 'yes')
+    grounded = request.args.get('grounded', '').lower() in truthy
+    force_refresh = request.args.get('force_refresh', '').lower() in truthy
+    mode = request.args.get('mode', DEFAULT_GENERATION_MODE).lower()
+    if mode not in GENERATION_MODES:
+        return jsonify({'error': f"Invalid mode '{mode}' (choose from {', '.join(GENERATION_MODES)})"}), 400
+    incremental = request.args.get('incremental', 'true').lower() in truthy
+    
+    parent_id = request.args.get('parent_id', type=int)
     try:
-        if not _db_initialized:
-            init_db()
-        
-        data = request.get_json()
-        if not data or not data.get('schema_text'):
-            return jsonify({'error': 'Missing schema text'}), 400
+        ocr_text, knowledge = load_generation_inputs(ocr_id, grounded)
+        parent = find_parent_model(ocr_id, parent_id)
+    except LookupError as e:
+        return jsonify({'error': str(e)}), 404
+    key = generation_flight_key(ocr_id, ocr_text, grounded, knowledge, mode, force_refresh, incremental, parent_id)
+    
+    def generate_and_store():
+        """Stream node events while generating; returns the stored generation's result"""
+        model, cached, diff = None, False, None
+        if incremental_parent(parent, grounded, mode, force_refresh, incremental):
+            # Patched models are small deltas, delivered once merged
+            model, cached, diff = generate_dv_model_incremental(parent, ocr_text, grounded, knowledge)
+            for node in model['nodes']:
+                yield sse_event('node', node)
+        else:
+            for kind, payload in generate_dv_model_stream(ocr_text, grounded, knowledge, force_refresh, mode):
+                if kind == 'node':
+                    yield sse_event('node', payload)
+                else:
+                    model, cached = payload
         
-        schema_text = data['schema_text'].strip()
+        model_id = store_dv_model(ocr_id, model, grounded, ocr_text, mode, parent, knowledge)
+        return generation_result(model_id, model, cached, mode, parent, diff)
+    
+    def events():
+        try:
+            # Shares generation_flights with /api/generate so a double submit makes one provider call
+            call, leader = generation_flights.begin(key)
+            if leader:
+                try:
+                    result = yield from generate_and_store()
+                except GeneratorExit:
+                    # The client went away mid-stream; anyone waiting on this generation must not hang
+                    cancelled = RuntimeError('Identical generation was cancelled by its client')
+                    generation_flights.finish(key, call, error=cancelled)
+                    raise
+                except BaseException as e:
+                    generation_flights.finish(key, call, error=e)
+                    raise
+                generation_flights.finish(key, call, result)
+            else:
+                logger.info(f"🔗 Joining generation in flight for OCR ID {ocr_id}")
+                result = generation_flights.wait(call)
+                for node in result['model']['nodes']:
+                    yield sse_event('node', node)
+            
+            yield sse_event('model', dict(result, coalesced=not leader))
         
-        if not schema_text:
-            return jsonify({'error': 'Empty schema text'}), 400
+        except Exception as e:
+            logger.exception(f"❌ Streaming generation error: {e}")
+            yield sse_event('failed', {'error': str(e)})
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Batch conversion: many schema documents per run, state in batches/batch_items so runs can resume
+BATCH_TEXT_EXTENSIONS = {'sql', 'ddl', 'txt'}
+BATCH_TERMINAL = ('succeeded', 'failed', 'duplicate')
+
+_active_batches = set()
+_active_batches_lock = threading.Lock()
+
+def batch_file_kind(filename):
+    """'text' for DDL/schema text, 'document' for OCR input, None for anything else"""
+    extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+    if extension in BATCH_TEXT_EXTENSIONS:
+        return 'text'
+    if extension in app.config['ALLOWED_EXTENSIONS']:
+        return 'document'
+    return None
+
+def create_batch(source, items, options):
+    """Register a batch; items are dicts with item_key, filename, file_digest and source_path or content.
+    Later items with the same digest as an earlier one are marked duplicate and not processed."""
+    batch_id = uuid.uuid4().hex
+    first_by_digest = {}
+    rows = []
+    for item in items:
+        original = first_by_digest.setdefault(item['file_digest'], item['item_key'])
+        duplicate = original != item['item_key']
+        rows.append((batch_id, item['item_key'], item['filename'], item['file_digest'],
+                     'duplicate' if duplicate else 'pending', original if duplicate else None,
+                     item.get('source_path'), None if duplicate else item.get('content')))
+    
+    insert_batch(batch_id, source, options, rows)
+    logger.info(f"📦 Batch {batch_id}: {len(rows)} files, {len(first_by_digest)} unique")
+    return batch_id
+
+def store_schema_text(filename, text, file_digest):
+    """OCR row for a text schema, reusing an identical earlier one; returns (ocr_id, reused)"""
+    existing = find_ocr_by_digest(file_digest)
+    if existing:
+        return existing['id'], True
+    return insert_ocr_result(filename, text, file_digest), False
+
+def process_batch_item(batch_id, item, options):
+    """OCR (or read) and convert one batch file, recording timings on its row"""
+    key = item['item_key']
+    update_batch_item(batch_id, key, status='running', error=None)
+    start = time.perf_counter()
+    
+    try:
+        if item['content'] is not None:
+            file_bytes = item['content']
+        else:
+            with open(item['source_path'], 'rb') as f:
+                file_bytes = f.read()
+        if hashlib.sha256(file_bytes).hexdigest() != item['file_digest']:
+            raise ValueError('File changed since the batch was created')
         
-        print(f"📄 Schema text: {len(schema_text)} chars", flush=True)
+        if batch_file_kind(item['filename']) == 'text':
+            ocr_id, reused = store_schema_text(item['filename'], file_bytes.decode('utf-8', errors='replace'),
+                                               item['file_digest'])
+        else:
+            kind = sniff_file_type(file_bytes[:8])
+            expected = EXTENSION_TYPES.get(item['filename'].rsplit('.', 1)[-1].lower())
+            if kind != expected:
+                raise ValueError(f"File content is {(kind or 'unknown').upper()} but the name says {expected}")
+            result = process_upload(item['filename'], file_bytes, item['file_digest'], options.get('ocr_backend'))
+            ocr_id, reused = result['ocr_id'], result['duplicate']
+        ocr_seconds = time.perf_counter() - start
+        update_batch_item(batch_id, key, ocr_id=ocr_id, ocr_seconds=round(ocr_seconds, 3))
         
-        try:
-            conn = get_sqlite_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                "INSERT INTO ocr_results (filename, extracted_text, created_at) VALUES (?, ?, ?)",
-                ('manual_input.txt', schema_text, datetime.now().isoformat())
-            )
-            
-            ocr_id = cursor.lastrowid
-            conn.commit()
-            
-            print(f"✅ Stored: OCR ID {ocr_id}", flush=True)
-            print("=" * 60, flush=True)
-            
-            return jsonify({
-                'success': True,
-                'ocr_id': ocr_id,
-                'extracted_text': schema_text[:500] + '...' if len(schema_text) > 500 else schema_text
-            }), 200
+        # Input seen before and already converted with the same options: reuse its latest model
+        mode = options.get('mode') or DEFAULT_GENERATION_MODE
+        grounded = bool(options.get('grounded', False))
+        latest = find_parent_model(ocr_id) if reused and not options.get('force_refresh') else None
+        if latest and latest['mode'] == mode and bool(latest['grounded']) == grounded:
+            model_id, reused_model = latest['id'], 1
+        else:
+            generated = process_generate(ocr_id, grounded, options.get('force_refresh', False), mode)
+            model_id, reused_model = generated['model_id'], 0
         
-        except Exception as db_error:
-            print(f"❌ Database error: {db_error}", flush=True)
-            import traceback
-            traceback.print_exc()
-            return jsonify({'error': f"Database error: {str(db_error)}"}), 500
+        total = time.perf_counter() - start
+        update_batch_item(batch_id, key, status='succeeded', model_id=model_id, reused=reused_model, content=None,
+                          generate_seconds=round(total - ocr_seconds, 3), total_seconds=round(total, 3))
+        logger.info(f"✅ Batch {batch_id[:8]} {key}: model {model_id} in {total:.1f}s")
     
     except Exception as e:
-        print(f"❌ Request error: {e}", flush=True)
-        import traceback
-        traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        logger.error(f"❌ Batch {batch_id[:8]} {key}: {e}")
+        update_batch_item(batch_id, key, status='failed', error=str(e),
+                          total_seconds=round(time.perf_counter() - start, 3))
 
-@app.route('/api/update-ocr', methods=['POST'])
-def update_ocr():
-    """Update OCR text after user edits"""
-    print("=" * 60, flush=True)
-    print("✏️ Update OCR request", flush=True)
+def run_batch(batch_id, concurrency=None, retry_failed=False, progress=None):
+    """Process a batch's unfinished files with bounded concurrency and return its report"""
+    with _active_batches_lock:
+        if batch_id in _active_batches:
+            raise RuntimeError(f"Batch {batch_id} is already running")
+        _active_batches.add(batch_id)
     
     try:
-        if not _db_initialized:
-            init_db()
+        batch, items = start_batch_run(batch_id, retry_failed)
+        if not batch:
+            raise LookupError(f"Batch {batch_id} not found")
+        options = json.loads(batch['options_json'] or '{}')
+        total = len(items)
+        logger.info(f"📦 Batch {batch_id}: {total} files to process")
         
-        data = request.get_json()
-        if not data or not data.get('ocr_id') or not data.get('updated_text'):
-            return jsonify({'error': 'Missing ocr_id or updated_text'}), 400
+        done = 0
+        with ThreadPoolExecutor(max_workers=concurrency or BATCH_CONCURRENCY, thread_name_prefix='batch') as pool:
+            futures = [pool.submit(process_batch_item, batch_id, dict(item), options) for item in items]
+            for future in as_completed(futures):
+                future.result()
+                done += 1
+                if progress:
+                    progress(f"{done}/{total} files")
         
-        ocr_id = data['ocr_id']
-        updated_text = data['updated_text'].strip()
+        report = batch_report(batch_id)
+        status = 'completed' if not report['counts'].get('failed') else 'failed'
+        set_batch_status(batch_id, status)
+        report['status'] = status
+        return report
+    
+    finally:
+        with _active_batches_lock:
+            _active_batches.discard(batch_id)
+
+def batch_report(batch_id):
+    """Batch summary with per-file status, ids and timings; None if unknown"""
+    batch, rows = load_batch(batch_id)
+    if not batch:
+        return None
+    
+    by_key = {row['item_key']: row for row in rows}
+    files = []
+    counts = {}
+    for row in rows:
+        entry = dict(row)
+        entry['reused'] = bool(entry['reused'])
+        if row['duplicate_of'] in by_key:
+            original = by_key[row['duplicate_of']]
+            entry['ocr_id'], entry['model_id'] = original['ocr_id'], original['model_id']
+        counts[row['status']] = counts.get(row['status'], 0) + 1
+        files.append(entry)
+    
+    seconds = [row['total_seconds'] for row in rows if row['total_seconds'] is not None]
+    return {
+        'batch_id': batch_id,
+        'source': batch['source'],
+        'status': batch['status'],
+        'options': json.loads(batch['options_json'] or '{}'),
+        'counts': counts,
+        'files': files,
+        'total_seconds': round(sum(seconds), 3),
+        'slowest': sorted(files, key=lambda f: f['total_seconds'] or 0, reverse=True)[0]['item_key'] if seconds else None,
+        'created_at': batch['created_at'],
+        'updated_at': batch['updated_at']
+    }
+
+def parse_batch_options(data):
+    """Generation options for a batch from a JSON body or form"""
+    mode = str(data.get('mode') or DEFAULT_GENERATION_MODE).lower()
+    if mode not in GENERATION_MODES:
+        raise ValueError(f"Invalid mode '{mode}' (choose from {', '.join(GENERATION_MODES)})")
+    ocr_backend = data.get('ocr_backend') or None
+    if ocr_backend and ocr_backend.lower() not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend '{ocr_backend}'")
+    return {
+        'grounded': str(data.get('grounded', False)).lower() in ('1', 'true', 'yes'),
+        'force_refresh': str(data.get('force_refresh', False)).lower() in ('1', 'true', 'yes'),
+        'mode': mode,
+        'ocr_backend': ocr_backend
+    }
+
+@app.route('/api/batches', methods=['POST'])
+def create_batch_route():
+    """Convert many files at once: multipart 'files' or a JSON manifest of schema texts"""
+    logger.info("📦 Batch request")
+    
+    try:
+        if not _db_initialized:
+            init_db()
         
-        if not updated_text:
-            return jsonify({'error': 'Empty text'}), 400
+        items = []
+        if request.files:
+            data = request.form
+            for position, file in enumerate(request.files.getlist('files')):
+                filename = secure_filename(file.filename or '')
+                if not filename or not batch_file_kind(filename):
+                    return jsonify({'error': f"Unsupported file '{file.filename}'"}), 400
+                content = file.read()
+                items.append({'item_key': f"{position:04d}-{filename}", 'filename': filename, 'content': content,
+                              'file_digest': hashlib.sha256(content).hexdigest()})
+        else:
+            data = request.get_json(silent=True) or {}
+            for position, entry in enumerate(data.get('items') or []):
+                text = str((entry or {}).get('schema_text') or '').strip()
+                if not text:
+                    return jsonify({'error': f"Manifest item {position} has no schema_text"}), 400
+                filename = secure_filename(str(entry.get('name') or '')) or f"schema_{position}.txt"
+                if batch_file_kind(filename) != 'text':
+                    filename += '.txt'
+                content = text.encode('utf-8')
+                items.append({'item_key': f"{position:04d}-{filename}", 'filename': filename, 'content': content,
+                              'file_digest': hashlib.sha256(content).hexdigest()})
         
-        print(f"📝 Updating OCR ID {ocr_id}: {len(updated_text)} chars", flush=True)
+        if not items:
+            return jsonify({'error': "No files (multipart 'files') or manifest 'items' given"}), 400
+        if len(items) > BATCH_MAX_FILES:
+            return jsonify({'error': f'At most {BATCH_MAX_FILES} files per batch'}), 400
         
         try:
-            conn = get_sqlite_connection()
-            cursor = conn.cursor()
-            
-            cursor.execute(
-                "UPDATE ocr_results SET extracted_text = ? WHERE id = ?",
-                (updated_text, ocr_id)
-            )
-            
-            conn.commit()
-            
-            if cursor.rowcount == 0:
-                return jsonify({'error': 'OCR result not found'}), 404
-            
-            print(f"✅ Updated OCR ID {ocr_id}", flush=True)
-            print("=" * 60, flush=True)
-            
-            return jsonify({
-                'success': True,
-                'message': 'Text updated successfully'
-            }), 200
+            options = parse_batch_options(data)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        except Exception as db_error:
-            print(f"❌ Database error: {db_error}", flush=True)
-            import traceback
-            traceback.print_exc()
-            return jsonify({'error': f"Database error: {str(db_error)}"}), 500
+        batch_id = create_batch('api', items, options)
+        job_id = submit_job('batch', {'batch_id': batch_id}, run_batch, batch_id)
+        return jsonify({'success': True, 'batch_id': batch_id, 'job_id': job_id, 'files': len(items),
+                        'status': 'queued'}), 202
+    
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
     
     except Exception as e:
-        print(f"❌ Request error: {e}", flush=True)
-        import traceback
-        traceback.print_exc()
+        logger.error(f"❌ Batch error: {e}")
         return jsonify({'error': str(e)}), 500
 
-@app.route('/api/generate', methods=['POST'])
-def generate_model():
-    """Generate Data Vault model"""
-    print("=" * 60, flush=True)
-    print("🧠 Generate request", flush=True)
-    
+@app.route('/api/batches/<batch_id>', methods=['GET'])
+def get_batch(batch_id):
+    """Batch summary report"""
     try:
         if not _db_initialized:
             init_db()
         
-        data = request.get_json()
-        if not data or not data.get('ocr_id'):
-            return jsonify({'error': 'Missing ocr_id'}), 400
-        
-        ocr_id = data['ocr_id']
-        grounded = data.get('grounded', False)
+        report = batch_report(batch_id)
+        if not report:
+            return jsonify({'error': 'Batch not found'}), 404
+        return jsonify(report), 200
+    
+    except Exception as e:
+        logger.exception(f"❌ Batch error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/batches/<batch_id>/resume', methods=['POST'])
+def resume_batch(batch_id):
+    """Continue an interrupted batch (and retry failed files with retry_failed=true)"""
+    try:
+        if not _db_initialized:
+            init_db()
         
-        try:
-            conn = get_sqlite_connection()
-            cursor = conn.cursor()
-            
-            # Get OCR text
-            cursor.execute("SELECT extracted_text FROM ocr_results WHERE id = ?", (ocr_id,))
-            result = cursor.fetchone()
-            
-            if not result:
-                return jsonify({'error': 'OCR result not found'}), 404
-            
-            ocr_text = result['extracted_text']
-            print(f"✅ OCR loaded: {len(ocr_text)} chars", flush=True)
-            
-            # Get knowledge if grounded
-            knowledge = ''
-            if grounded:
-                cursor.execute("SELECT content FROM knowledge_docs ORDER BY uploaded_at DESC LIMIT 1")
-                k = cursor.fetchone()
-                if k:
-                    knowledge = k['content']
-            
-            # Generate model
-            model = generate_dv_model(ocr_text, grounded, knowledge)
-            
-            # Store model
-            cursor.execute(
-                "INSERT INTO dv_models (ocr_id, model_json, grounded, created_at) VALUES (?, ?, ?, ?)",
-                (ocr_id, json.dumps(model), 1 if grounded else 0, datetime.now().isoformat())
-            )
-            
-            model_id = cursor.lastrowid
-            conn.commit()
-            
-            print(f"✅ Model stored: ID {model_id}", flush=True)
-            print("=" * 60, flush=True)
-            
-            return jsonify({
-                'success': True,
-                'model_id': model_id,
-                'model': model
-            }), 200
+        report = batch_report(batch_id)
+        if not report:
+            return jsonify({'error': 'Batch not found'}), 404
+        with _active_batches_lock:
+            if batch_id in _active_batches:
+                return jsonify({'error': 'Batch is already running'}), 409
         
-        except Exception as e:
-            print(f"❌ Generation error: {e}", flush=True)
-            import traceback
-            traceback.print_exc()
-            return jsonify({'error': str(e)}), 500
+        data = request.get_json(silent=True) or {}
+        retry_failed = str(data.get('retry_failed', False)).lower() in ('1', 'true', 'yes')
+        job_id = submit_job('batch', {'batch_id': batch_id, 'resume': True}, run_batch, batch_id, None, retry_failed)
+        return jsonify({'success': True, 'batch_id': batch_id, 'job_id': job_id, 'status': 'queued'}), 202
+    
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
     
     except Exception as e:
-        print(f"❌ Request error: {e}", flush=True)
+        logger.error(f"❌ Batch error: {e}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/knowledge/upload', methods=['POST'])
@@ -712,41 +5434,90 @@ def upload_knowledge():
         
         file = request.files['file']
         filename = secure_filename(file.filename)
-        content = file.read().decode('utf-8', errors='replace')
+        raw = file.read()
         
-        conn = get_sqlite_connection()
-        cursor = conn.cursor()
+        page_texts = read_pdf_page_texts(raw) if filename.lower().endswith('.pdf') else None
+        if page_texts is not None:
+            content = '\n\n'.join(page_texts)
+        else:
+            content = raw.decode('utf-8', errors='replace')
         
-        cursor.execute(
-            "INSERT INTO knowledge_docs (name, content, uploaded_at) VALUES (?, ?, ?)",
-            (filename, content, datetime.now().isoformat())
-        )
+        chunk_count = insert_knowledge_doc(filename, content)
         
-        conn.commit()
+        logger.info(f"📚 Indexed {filename}: {chunk_count} chunks")
         
-        return jsonify({'success': True, 'message': 'Uploaded'}), 200
+        return jsonify({'success': True, 'message': 'Uploaded', 'chunks': chunk_count}), 200
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def encode_models_cursor(created_at, model_id):
+    raw = json.dumps([created_at, model_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_models_cursor(token):
+    """Opaque cursor → (created_at, id) of the last row on the previous page"""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        created_at, model_id = json.loads(raw)
+        return str(created_at), int(model_id)
+    except (ValueError, TypeError):
+        raise ValueError('Invalid cursor')
+
+def parse_date_param(value, name, end=False):
+    """ISO date/datetime query param → comparable created_at string"""
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"Invalid '{name}' date: {value}")
+    if end and len(value) == 10:
+        # A bare end date includes the whole day
+        parsed += timedelta(days=1)
+    return parsed.isoformat()
+
+def like_pattern(value):
+    """Substring LIKE pattern with wildcards escaped (use with ESCAPE '\\')"""
+    escaped = value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+def parse_bool_param(value, name):
+    lowered = value.lower()
+    if lowered in ('1', 'true', 'yes'):
+        return True
+    if lowered in ('0', 'false', 'no'):
+        return False
+    raise ValueError(f"Invalid '{name}' flag: {value}")
+
 @app.route('/api/models', methods=['GET'])
 def get_models():
-    """Get all models"""
+    """List models newest first, keyset-paginated and filterable"""
     try:
         if not _db_initialized:
             init_db()
         
-        conn = get_sqlite_connection()
-        cursor = conn.cursor()
+        etag = models_etag()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+            response.set_etag(etag)
+            return response
         
-        cursor.execute("""
-            SELECT m.id, m.ocr_id, o.filename, m.grounded, m.created_at
-            FROM dv_models m
-            JOIN ocr_results o ON m.ocr_id = o.id
-            ORDER BY m.created_at DESC
-        """)
+        args = request.args
+        try:
+            limit = max(1, min(int(args.get('limit', MODELS_PAGE_SIZE)), MODELS_MAX_PAGE_SIZE))
+            filters = {
+                'filename': like_pattern(args['filename']) if args.get('filename') else None,
+                'node': like_pattern(args['node']) if args.get('node') else None,
+                'grounded': parse_bool_param(args['grounded'], 'grounded') if args.get('grounded') else None,
+                'created_from': parse_date_param(args['from'], 'from') if args.get('from') else None,
+                'created_to': parse_date_param(args['to'], 'to', end=True) if args.get('to') else None,
+                'before': decode_models_cursor(args['cursor']) if args.get('cursor') else None
+            }
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        results = cursor.fetchall()
+        results = list_models(limit + 1, **filters)
+        has_more = len(results) > limit
+        results = results[:limit]
         
         models = [{
             'id': r['id'],
@@ -756,51 +5527,533 @@ def get_models():
             'created_at': str(r['created_at'])
         } for r in results]
         
-        return jsonify({'models': models}), 200
+        next_cursor = encode_models_cursor(results[-1]['created_at'], results[-1]['id']) if has_more else None
+        
+        response = jsonify({'models': models, 'next_cursor': next_cursor, 'has_more': has_more})
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response, 200
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/models/<int:model_id>', methods=['GET'])
 def get_model(model_id):
-    """Get specific model"""
+    """Get specific model, optionally only some node types or without reasoning"""
     try:
         if not _db_initialized:
             init_db()
         
-        conn = get_sqlite_connection()
-        cursor = conn.cursor()
+        try:
+            types = [t.strip().lower() for t in request.args.get('types', '').split(',') if t.strip()]
+            include_reasoning = parse_bool_param(request.args.get('reasoning', 'true'), 'reasoning')
+            include = {part.strip().lower() for part in request.args.get('include', '').split(',') if part.strip()}
+            if include - {'layout'}:
+                raise ValueError(f"Unknown include '{', '.join(sorted(include - {'layout'}))}'")
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        cursor.execute("SELECT model_json FROM dv_models WHERE id = ?", (model_id,))
-        result = cursor.fetchone()
+        with db.read():
+            stored = load_model_version(model_id, types, include_reasoning)
+            
+            if not stored:
+                return jsonify({'error': 'Not found'}), 404
+            
+            model = stored['model']
+            payload = {'success': True, **stored}
+            
+            if 'layout' in include:
+                # Layout always covers the whole model, trimmed to the nodes returned
+                full = model if not types else load_model_any(model_id)[0]
+                layout = dict(get_model_layout(model_id, full))
+                if types:
+                    ids = {n['id'] for n in model['nodes']}
+                    layout['positions'] = {k: v for k, v in layout['positions'].items() if k in ids}
+                payload['layout'] = layout
         
-        if not result:
-            return jsonify({'error': 'Not found'}), 404
+        return jsonify(payload), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/models/<int:model_id>/diff', methods=['GET'])
+def get_model_diff(model_id):
+    """Diff a model against its parent version (or ?against=<id>)"""
+    try:
+        if not _db_initialized:
+            init_db()
+        
+        with db.read():
+            model, parent_id = load_model_any(model_id)
+            if model is None:
+                return jsonify({'error': 'Not found'}), 404
+            
+            against = request.args.get('against', type=int) or parent_id
+            if not against:
+                return jsonify({'error': 'Model has no parent version'}), 404
+            
+            base, _ = load_model_any(against)
+            if base is None:
+                return jsonify({'error': f"Model {against} not found"}), 404
         
         return jsonify({
             'success': True,
-            'model': json.loads(result['model_json'])
+            'model_id': model_id,
+            'against': against,
+            'diff': diff_dv_models(base, model)
         }), 200
     
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+# Streaming exporters: models are read in pages of rows and written out in chunks
+EXPORT_FORMATS = {
+    'json': ('application/json', 'json'),
+    'csv': ('text/csv', 'csv'),
+    'drawio': ('application/xml', 'drawio'),
+    'ddl': ('application/sql', 'sql')
+}
+EXPORT_CHUNK_BYTES = 64 * 1024
+EXPORT_MAX_MODELS = 500
+EXPORT_PAGE_ROWS = 500
+DRAWIO_STYLES = {
+    'hub': 'fillColor=#dae8fc;strokeColor=#2c5aa0;',
+    'link': 'fillColor=#d5e8d4;strokeColor=#43a047;',
+    'satellite': 'fillColor=#ffe6cc;strokeColor=#f57c00;'
+}
+
+def iter_reasoning(codec, data, chunk_size=EXPORT_CHUNK_BYTES):
+    """Reasoning texts in node order, decompressing and parsing the stored JSON array incrementally"""
+    if codec != 'zlib':
+        raise ValueError(f"Unknown reasoning codec '{codec}'")
+    decompressor = zlib.decompressobj()
+    text = codecs.getincrementaldecoder('utf-8')()
+    decoder = json.JSONDecoder()
+    buffer = ''
+    
+    for start in range(0, len(data) + 1, chunk_size):
+        final = start + chunk_size > len(data)
+        raw = decompressor.decompress(data[start:start + chunk_size])
+        buffer += text.decode(raw + decompressor.flush() if final else raw, final=final)
+        
+        index = 0
+        while True:
+            while index < len(buffer) and buffer[index] in ' \t\r\n,[':
+                index += 1
+            if index >= len(buffer) or buffer[index] == ']':
+                break
+            try:
+                value, index = decoder.raw_decode(buffer, index)
+            except ValueError:
+                if final:
+                    raise
+                break
+            yield value
+        buffer = buffer[index:]
+
+def _iter_pages(sql, model_id):
+    """Rows of a per-model table in position order, EXPORT_PAGE_ROWS per short-lived checkout"""
+    position = -1
+    while True:
+        rows = db.query(sql, (model_id, position, EXPORT_PAGE_ROWS))
+        yield from rows
+        if len(rows) < EXPORT_PAGE_ROWS:
+            return
+        position = rows[-1]['position']
+
+def iter_model_parts(model_id):
+    """(nodes, edges) iterators over a stored model, or None if it doesn't exist; rows are read in
+    pages so no pooled connection is held while a slow client downloads"""
+    row = db.query_one("SELECT storage, model_json FROM dv_models WHERE id = ?", (model_id,))
+    if not row:
+        return None
+    if row['storage'] != 'normalized':
+        model = json.loads(row['model_json'])
+        return iter(model.get('nodes', [])), iter(model.get('edges', []))
+    
+    def nodes():
+        stored = db.query_one("SELECT codec, data FROM dv_model_reasoning WHERE model_id = ?", (model_id,))
+        reasoning = iter_reasoning(stored['codec'], stored['data']) if stored else iter(())
+        index = 0
+        for node_row in _iter_pages(
+            "SELECT * FROM dv_model_nodes WHERE model_id = ? AND position > ? ORDER BY position LIMIT ?", model_id
+        ):
+            text = None
+            while index <= node_row['position']:
+                text = next(reasoning, None)
+                index += 1
+            yield node_from_row(node_row, text)
+    
+    def edges():
+        for edge_row in _iter_pages(
+            "SELECT position, from_node, to_node, extra FROM dv_model_edges "
+            "WHERE model_id = ? AND position > ? ORDER BY position LIMIT ?", model_id
+        ):
+            edge = {'from': edge_row['from_node'], 'to': edge_row['to_node']}
+            if edge_row['extra']:
+                edge.update(json.loads(edge_row['extra']))
+            yield edge
+    
+    return nodes(), edges()
+
+def _join_values(values):
+    return '; '.join(str(v.get('name', v)) if isinstance(v, dict) else str(v) for v in values or [])
+
+def export_json(model_id, nodes, edges):
+    yield '{"nodes":['
+    for i, node in enumerate(nodes):
+        yield (',' if i else '') + compact_json(node)
+    yield '],"edges":['
+    for i, edge in enumerate(edges):
+        yield (',' if i else '') + compact_json(edge)
+    yield ']}\n'
+
+def export_csv(model_id, nodes, edges):
+    line = io.StringIO()
+    writer = csv.writer(line)
+    writer.writerow(['Entity', 'Type', 'Parent', 'BusinessKey', 'Connects', 'Attributes', 'Reasoning'])
+    for node in nodes:
+        writer.writerow([node.get('id'), node.get('type'), node.get('parent') or '', node.get('businessKey') or '',
+                         _join_values(node.get('connects')), _join_values(node.get('attributes')),
+                         node.get('reasoning') or ''])
+        yield line.getvalue()
+        line.seek(0)
+        line.truncate()
+    yield line.getvalue()
+
+def export_drawio(model_id, nodes, edges):
+    # Loaded before the first node page is read, so the export never needs two connections
+    positions = get_model_layout(model_id)['positions']
+    yield (f'<mxfile host="DataVaultAssistant"><diagram id="model-{model_id}" name="Data Vault model {model_id}">'
+           '<mxGraphModel grid="1" gridSize="10" guides="1" page="0"><root>'
+           '<mxCell id="0"/><mxCell id="1" parent="0"/>\n')
+    
+    cell_ids = set()
+    for node in nodes:
+        node_id = str(node.get('id') or '')
+        if not node_id or node_id in cell_ids:
+            continue
+        cell_ids.add(node_id)
+        position = positions.get(node_id, {'x': 0, 'y': 0})
+        style = 'rounded=1;whiteSpace=wrap;html=1;' + DRAWIO_STYLES.get(node.get('type'), DRAWIO_STYLES['hub'])
+        yield (f'<mxCell id={quoteattr("n:" + node_id)} value={quoteattr(node_id)} style="{style}" vertex="1" parent="1">'
+               f'<mxGeometry x="{position["x"] - 90}" y="{position["y"] - 30}" width="180" height="60" as="geometry"/>'
+               '</mxCell>\n')
+    
+    for i, edge in enumerate(edges):
+        source, target = str(edge.get('from') or ''), str(edge.get('to') or '')
+        if source in cell_ids and target in cell_ids:
+            yield (f'<mxCell id="e:{i}" style="endArrow=none;html=1;" edge="1" parent="1" '
+                   f'source={quoteattr("n:" + source)} target={quoteattr("n:" + target)}>'
+                   '<mxGeometry relative="1" as="geometry"/></mxCell>\n')
+    
+    yield '</root></mxGraphModel></diagram></mxfile>\n'
+
+def sql_identifier(name):
+    identifier = re.sub(r'[^a-z0-9_]+', '_', str(name).lower()).strip('_') or 'unnamed'
+    return f"t_{identifier}" if identifier[0].isdigit() else identifier
+
+def hash_key_column(node_id):
+    """hk_<name> for a Hub_/Link_/Sat_ node id"""
+    return 'hk_' + sql_identifier(re.sub(r'^(hub|link|lnk|sat|satellite)_', '', str(node_id), flags=re.IGNORECASE))
+
+def export_ddl(model_id, nodes, edges):
+    yield f"-- Data Vault 2.1 DDL for model {model_id}\n"
+    for node in nodes:
+        node_type = node.get('type') or 'hub'
+        if node_type == 'link':
+            hash_key = hash_key_column(node['id'])
+            columns = [(hash_key, 'CHAR(32) NOT NULL')]
+            columns += [(hash_key_column(hub), 'CHAR(32) NOT NULL') for hub in node.get('connects') or []]
+            key = [hash_key]
+        elif node_type == 'satellite':
+            hash_key = hash_key_column(node.get('parent') or node['id'])
+            columns = [(hash_key, 'CHAR(32) NOT NULL'), ('hash_diff', 'CHAR(32) NOT NULL')]
+            columns += [(sql_identifier(a), 'VARCHAR(255)') for a in _join_values(node.get('attributes')).split('; ') if a]
+            key = [hash_key, 'load_dts']
+        else:
+            hash_key = hash_key_column(node['id'])
+            business_keys = [k.strip() for k in str(node.get('businessKey') or '').split(',') if k.strip()]
+            if not business_keys:
+                business_keys = [a for a in _join_values(node.get('attributes')).split('; ') if a][:1]
+            columns = [(hash_key, 'CHAR(32) NOT NULL')] + [(sql_identifier(k), 'VARCHAR(255) NOT NULL') for k in business_keys]
+            key = [hash_key]
+        columns += [('load_dts', 'TIMESTAMP NOT NULL'), ('record_source', 'VARCHAR(255) NOT NULL')]
+        
+        seen = set()
+        lines = []
+        for name, definition in columns:
+            if name not in seen:
+                seen.add(name)
+                lines.append(f"    {name} {definition}")
+        lines.append(f"    PRIMARY KEY ({', '.join(key)})")
+        yield f"\nCREATE TABLE {sql_identifier(node['id'])} (\n" + ',\n'.join(lines) + "\n);\n"
+
+EXPORTERS = {'json': export_json, 'csv': export_csv, 'drawio': export_drawio, 'ddl': export_ddl}
+
+def encoded_chunks(chunks, size=EXPORT_CHUNK_BYTES):
+    """Coalesce small text pieces into ~size byte chunks"""
+    pending = []
+    pending_bytes = 0
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        pending.append(data)
+        pending_bytes += len(data)
+        if pending_bytes >= size:
+            yield b''.join(pending)
+            pending = []
+            pending_bytes = 0
+    if pending:
+        yield b''.join(pending)
+
+def stream_export(model_id, fmt):
+    nodes, edges = iter_model_parts(model_id)
+    yield from encoded_chunks(EXPORTERS[fmt](model_id, nodes, edges))
+
+class ZipStream:
+    """Write-only sink that lets zipfile build an archive without a seekable file"""
+    
+    def __init__(self):
+        self.chunks = []
+    
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+    
+    def flush(self):
+        pass
+    
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+def stream_export_zip(model_ids, fmt):
+    """Zip archive of several exports, yielded as it is compressed"""
+    sink = ZipStream()
+    extension = EXPORT_FORMATS[fmt][1]
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for model_id in model_ids:
+            with archive.open(f"dv_model_{model_id}.{extension}", 'w') as entry:
+                for chunk in stream_export(model_id, fmt):
+                    entry.write(chunk)
+                    if sink.chunks:
+                        yield sink.drain()
+    # Remaining compressed data, data descriptors and the central directory
+    yield sink.drain()
+
+def parse_export_format(value):
+    fmt = (value or 'json').lower()
+    if fmt not in EXPORTERS:
+        raise ValueError(f"Invalid format '{value}' (expected {', '.join(EXPORTERS)})")
+    return fmt
+
+@app.route('/api/models/<int:model_id>/export', methods=['GET'])
+def export_model(model_id):
+    """Stream one model as JSON, CSV, Draw.io XML or DDL"""
+    try:
+        if not _db_initialized:
+            init_db()
+        
+        try:
+            fmt = parse_export_format(request.args.get('format'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        if not model_exists(model_id):
+            return jsonify({'error': 'Model not found'}), 404
+        
+        mimetype, extension = EXPORT_FORMATS[fmt]
+        logger.info(f"📤 Exporting model {model_id} as {fmt}")
+        return Response(
+            stream_with_context(stream_export(model_id, fmt)),
+            mimetype=mimetype,
+            headers={'Content-Disposition': f'attachment; filename="dv_model_{model_id}.{extension}"'}
+        )
+    
+    except Exception as e:
+        logger.error(f"❌ Export error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/models/export', methods=['GET', 'POST'])
+def export_models():
+    """Stream several models as a zip (ids as ?ids=1,2,3 or a JSON body)"""
+    try:
+        if not _db_initialized:
+            init_db()
+        
+        data = (request.get_json(silent=True) or {}) if request.method == 'POST' else {}
+        try:
+            fmt = parse_export_format(data.get('format') or request.args.get('format'))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        try:
+            raw_ids = data.get('ids') or [i for i in request.args.get('ids', '').split(',') if i.strip()]
+            model_ids = list(dict.fromkeys(int(i) for i in raw_ids))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'ids must be a list of model ids'}), 400
+        
+        if not model_ids:
+            return jsonify({'error': 'No model ids given'}), 400
+        if len(model_ids) > EXPORT_MAX_MODELS:
+            return jsonify({'error': f'At most {EXPORT_MAX_MODELS} models per export'}), 400
+        
+        found = existing_model_ids(model_ids)
+        missing = [i for i in model_ids if i not in found]
+        if missing:
+            return jsonify({'error': 'Models not found', 'missing': missing}), 404
+        
+        logger.info(f"📤 Exporting {len(model_ids)} models as {fmt} zip")
+        return Response(
+            stream_with_context(stream_export_zip(model_ids, fmt)),
+            mimetype='application/zip',
+            headers={'Content-Disposition': f'attachment; filename="dv_models_{fmt}.zip"'}
+        )
+    
+    except Exception as e:
+        logger.error(f"❌ Export error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def get_job_status(job_id):
+    """Get background job status and result"""
+    try:
+        if not _db_initialized:
+            init_db()
+        
+        job = get_job(job_id)
+        if not job:
+            return jsonify({'error': 'Not found'}), 404
+        
+        return jsonify({'success': True, 'job': job}), 200
+    
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/jobs/<job_id>/stream', methods=['GET'])
+def stream_job_status(job_id):
+    """Server-sent events for a background job until it finishes"""
+    if not _db_initialized:
+        init_db()
+    
+    if not get_job(job_id):
+        return jsonify({'error': 'Not found'}), 404
+    
+    def events():
+        last_state = None
+        idle = 0.0
+        
+        while True:
+            job = get_job(job_id)
+            if not job:
+                break
+            
+            state = (job['status'], job['progress'])
+            if state != last_state:
+                last_state = state
+                idle = 0.0
+                yield sse_event('status', job)
+            elif idle >= 15:
+                idle = 0.0
+                yield ": keepalive\n\n"
+            
+            if job['status'] in JOB_TERMINAL:
+                break
+            
+            with _job_updates:
+                _job_updates.wait(timeout=1.0)
+            idle += 1.0
+    
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def batch_cli(argv):
+    """python app.py batch DIR: convert every ERD image, PDF and DDL file under DIR"""
+    parser = argparse.ArgumentParser(prog='python app.py batch',
+                                     description='Convert a folder of ERD images, PDFs and DDL/schema text files')
+    parser.add_argument('directory')
+    parser.add_argument('--mode', default=DEFAULT_GENERATION_MODE, choices=GENERATION_MODES)
+    parser.add_argument('--grounded', action='store_true', help='ground generation in the knowledge docs')
+    parser.add_argument('--ocr-backend', default=None, choices=sorted(OCR_BACKENDS))
+    parser.add_argument('--force-refresh', action='store_true', help='regenerate even if a model exists')
+    parser.add_argument('--concurrency', type=int, default=BATCH_CONCURRENCY)
+    parser.add_argument('--report', default=None, help='summary report path (default batch_<id>_report.json)')
+    parser.add_argument('--restart', action='store_true', help='start a new batch instead of resuming')
+    parser.add_argument('--retry-failed', action='store_true', help='also retry files that failed last time')
+    args = parser.parse_args(argv)
+    
+    source = os.path.abspath(args.directory)
+    if not os.path.isdir(source):
+        parser.error(f"{args.directory} is not a directory")
+    
+    # The server may be running on the same database with jobs in flight
+    init_db(recover_jobs=False)
+    batch_id = None if args.restart else find_resumable_batch(source)
+    if batch_id:
+        print(f"↩️ Resuming batch {batch_id} with its original options", flush=True)
+    else:
+        items = []
+        skipped = 0
+        for root, dirs, files in os.walk(source):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                if not batch_file_kind(name):
+                    skipped += 1
+                    continue
+                items.append({'item_key': os.path.relpath(path, source), 'filename': secure_filename(name) or name,
+                              'source_path': path, 'file_digest': file_sha256(path)})
+        if skipped:
+            print(f"⏭️ Skipped {skipped} unsupported files", flush=True)
+        if not items:
+            print("❌ No convertible files found", flush=True)
+            return 1
+        options = {'grounded': args.grounded, 'force_refresh': args.force_refresh, 'mode': args.mode,
+                   'ocr_backend': args.ocr_backend}
+        batch_id = create_batch(source, items, options)
+    
+    started = time.perf_counter()
+    report = run_batch(batch_id, args.concurrency, args.retry_failed)
+    report['wall_seconds'] = round(time.perf_counter() - started, 3)
+    
+    report_path = args.report or f"batch_{batch_id[:8]}_report.json"
+    with open(report_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    
+    print(f"\n{'file':<40} {'status':<10} {'ocr s':>7} {'gen s':>7} {'total s':>8}  model")
+    for entry in report['files']:
+        timings = [f"{entry[k]:.2f}" if entry[k] is not None else '-' for k in ('ocr_seconds', 'generate_seconds', 'total_seconds')]
+        print(f"{entry['item_key'][:40]:<40} {entry['status']:<10} {timings[0]:>7} {timings[1]:>7} {timings[2]:>8}  "
+              f"{entry['model_id'] or entry['error'] or ''}")
+    counts = ', '.join(f"{count} {status}" for status, count in sorted(report['counts'].items()))
+    print(f"\n📦 Batch {batch_id}: {counts} in {report['wall_seconds']:.1f}s — report {report_path}", flush=True)
+    return 0 if report['status'] == 'completed' else 1
+
 @app.errorhandler(Exception)
 def handle_error(error):
     """Global error handler"""
-    print(f"❌ Unhandled: {error}", flush=True)
-    import traceback
-    traceback.print_exc()
+    logger.exception(f"❌ Unhandled: {error}")
     return jsonify({'error': 'Server error', 'details': str(error)}), 500
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        sys.exit(batch_cli(sys.argv[2:]))
     try:
-        print("🚀 Starting...", flush=True)
+        logger.info("🚀 Starting...")
         init_db()
         app.run(debug=True, host='0.0.0.0', port=5000)
     except Exception as e:
-        print(f"❌ Startup error: {e}", flush=True)
+        logger.error(f"❌ Startup error: {e}")
         raise
 else:
-    print("🚀 App loaded (gunicorn)", flush=True)
-    print(f"🔧 Database: SQLite", flush=True)
+    logger.info("🚀 App loaded (gunicorn)")
@@ -0,0 +1,530 @@
+"""ASGI entry point: the I/O-bound endpoints run as coroutines, everything else is the Flask app.
+
+    uvicorn asgi:app --host 0.0.0.0 --port 8000
+
+POST /api/upload and POST /api/generate await OCR.space and GROQ through httpx, so a request
+waiting on a provider holds no thread; generation drives app.py's pipeline steps, this module
+only supplies the async HTTP layer. Database calls run on a dedicated executor; CPU-bound
+OCR (PDFs, Tesseract), rules/hybrid and incremental generation and all other routes run on a
+small thread pool through a WSGI bridge. Request/response contracts are those of app.py.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import sys
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from flask import request, jsonify
+
+import app as core
+from app import logger
+
+# Threads for routes served by the Flask app and for blocking pipeline steps
+ASGI_THREADS = int(os.getenv('ASGI_THREADS', '16'))
+# Threads for database calls made by the async endpoints
+ASGI_DB_WORKERS = int(os.getenv('ASGI_DB_WORKERS', str(core.DB_POOL_SIZE)))
+# Concurrent provider connections per provider (rate limits still apply)
+ASGI_PROVIDER_CONNECTIONS = int(os.getenv('ASGI_PROVIDER_CONNECTIONS', '100'))
+
+_db_executor = ThreadPoolExecutor(max_workers=ASGI_DB_WORKERS, thread_name_prefix='asgi-db')
+_sync_executor = ThreadPoolExecutor(max_workers=ASGI_THREADS, thread_name_prefix='asgi-sync')
+
+def _run_in(executor, context, func, *args):
+    return asyncio.get_running_loop().run_in_executor(executor, functools.partial(context.run, func, *args))
+
+# The copied context carries the Flask request context and the request trace into the thread
+async def run_db(func, *args):
+    """Run a database call on the database executor"""
+    return await _run_in(_db_executor, contextvars.copy_context(), func, *args)
+
+async def run_sync(func, *args):
+    """Run blocking work on the sync executor"""
+    return await _run_in(_sync_executor, contextvars.copy_context(), func, *args)
+
+# Async provider clients: same rate limit, circuit breaker and counters as the sync ProviderClient
+class AsyncProviderClient:
+    """httpx counterpart of a ProviderClient"""
+
+    def __init__(self, client, connections=ASGI_PROVIDER_CONNECTIONS):
+        self.client = client
+        self.connections = connections
+        self._http = None
+
+    @property
+    def http(self):
+        if self._http is None:
+            self._http = httpx.AsyncClient(limits=httpx.Limits(
+                max_connections=self.connections, max_keepalive_connections=self.connections
+            ))
+        return self._http
+
+    async def post(self, url, **kwargs):
+        """POST with retries on 429/5xx and connection errors"""
+        with core.span(self.client.span_name):
+            response = await self._post(url, **kwargs)
+        core.PROVIDER_RESPONSES.inc(self.client.name, response.status_code)
+        return response
+
+    async def _post(self, url, **kwargs):
+        client = self.client
+        attempt = 0
+        while True:
+            admitted = client.breaker.allow()
+            if not admitted:
+                client._bump('rejected')
+                raise core.CircuitOpenError(
+                    f"{client.name} temporarily unavailable (circuit open), retry in {client.breaker.retry_in()}s"
+                )
+
+            try:
+                throttled = 0.0
+                delay = client.bucket.try_acquire()
+                while delay:
+                    await asyncio.sleep(delay)
+                    throttled += delay
+                    delay = client.bucket.try_acquire()
+                client._bump('throttled_seconds', throttled)
+                client._bump('requests')
+
+                try:
+                    response = await self.http.post(url, **kwargs)
+                except httpx.TransportError as e:
+                    client.breaker.record_failure()
+                    client._bump('failures')
+                    if attempt >= client.max_retries or isinstance(e, httpx.ReadTimeout):
+                        raise
+                    delay = client._backoff(attempt)
+                else:
+                    if response.status_code not in core.RETRY_STATUSES:
+                        client.breaker.record_success()
+                        return response
+
+                    # 429 means we are being throttled, not that the provider is down
+                    if response.status_code >= 500:
+                        client.breaker.record_failure()
+                        client._bump('failures')
+                    else:
+                        client.breaker.record_success()
+
+                    if attempt >= client.max_retries:
+                        return response
+                    delay = client._backoff(attempt, response)
+                    await response.aclose()
+            finally:
+                # A cancelled request (CancelledError) must not leave the half-open probe taken
+                if admitted == 'probe':
+                    client.breaker.release_probe()
+
+            attempt += 1
+            client._bump('retries')
+            logger.info(f"🔁 {client.name} retry {attempt}/{client.max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+ocr_client = AsyncProviderClient(core.ocr_client)
+groq_client = AsyncProviderClient(core.groq_client)
+
+# OCR
+async def ocr_space_async(ocr_backend, file_bytes, filename):
+    """OcrSpaceBackend.image_to_text, awaited"""
+    logger.info(f"📤 Sending to OCR.space...")
+    response = await ocr_client.post(core.OCR_API_URL, **ocr_backend.request_args(file_bytes, filename))
+    return ocr_backend.read_response(response)
+
+async def extract_text_async(file_bytes, filename, backend=None):
+    """extract_text_bytes with the OCR.space calls awaited; PDFs and Tesseract run on the sync executor"""
+    ocr_backend = core.get_ocr_backend(backend)
+    if not isinstance(ocr_backend, core.OcrSpaceBackend) or core.sniff_file_type(file_bytes[:8]) == 'pdf':
+        return await run_sync(core.extract_text_bytes, file_bytes, filename, backend)
+    ocr_backend.check()
+
+    with core.span('ocr_call'):
+        try:
+            # Preprocessing is CPU work; the tiles it yields are sent concurrently
+            parts, columns = await run_sync(core.prepare_ocr_image, file_bytes, filename)
+            texts = await asyncio.gather(*(ocr_space_async(ocr_backend, data, name) for name, data in parts))
+            text = texts[0] if len(texts) == 1 else core.merge_tile_texts(texts, columns)
+
+            if not text or not text.strip():
+                raise Exception('Empty OCR text')
+
+            logger.info(f"✅ OCR extracted {len(text)} chars")
+            return text
+
+        except httpx.TimeoutException:
+            raise Exception("OCR timeout - try smaller image")
+        except Exception as e:
+            logger.error(f"❌ OCR error: {e}")
+            raise Exception(f"OCR error: {str(e)}")
+
+async def process_upload_async(filename, file_bytes, file_digest, ocr_backend=None):
+    """process_upload with OCR awaited"""
+    existing = await run_db(core.find_ocr_by_digest, file_digest)
+    if existing:
+        logger.info(f"⚡ Duplicate upload: reusing OCR ID {existing['id']}")
+        return core.upload_result(existing['id'], existing['extracted_text'], duplicate=True)
+
+    extracted_text = await extract_text_async(file_bytes, filename, ocr_backend)
+    logger.info(f"✅ Text extracted: {len(extracted_text)} chars")
+
+    ocr_id = await run_db(core.store_ocr_result, filename, extracted_text, file_digest)
+    return core.upload_result(ocr_id, extracted_text, duplicate=False)
+
+# Generation: app.py's pipeline steps, with provider calls awaited and blocking steps on the executors
+ASYNC_CLIENTS = {core.ocr_client: ocr_client, core.groq_client: groq_client}
+
+async def run_steps(steps):
+    """app.run_steps for coroutines; returns the step generator's result"""
+    value, error = None, None
+    while True:
+        try:
+            step = steps.throw(error) if error is not None else steps.send(value)
+        except StopIteration as stop:
+            return stop.value
+        value, error = None, None
+        try:
+            if isinstance(step, core.Post):
+                value = await ASYNC_CLIENTS[step.client].post(step.url, **step.kwargs)
+            elif isinstance(step, core.Gather):
+                value = await gather_steps(step.steps)
+            elif step.executor == 'db':
+                value = await run_db(step.func, *step.args)
+            else:
+                value = await run_sync(step.func, *step.args)
+        except Exception as e:
+            error = e
+
+async def gather_steps(steps_list):
+    """app.gather_steps with at most GENERATION_CONCURRENCY generators awaited at once"""
+    semaphore = asyncio.Semaphore(core.GENERATION_CONCURRENCY)
+
+    async def run(steps):
+        async with semaphore:
+            return await run_steps(steps)
+
+    tasks = [asyncio.ensure_future(run(steps)) for steps in steps_list]
+    results = []
+    for task in tasks:
+        try:
+            results.append(await task)
+        except BaseException:
+            for pending in tasks:
+                pending.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+    return results
+
+# Generations share app.generation_flights with the Flask views, so /api/generate here and
+# /api/generate/stream through the WSGI bridge coalesce with each other
+async def wait_flight(call):
+    """generation_flights.wait for coroutines: awaits the leader without holding a thread"""
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+
+    def wake():
+        try:
+            loop.call_soon_threadsafe(lambda: done.done() or done.set_result(None))
+        except RuntimeError:
+            pass  # the loop closed while waiting
+
+    core.generation_flights.on_done(call, wake)
+    await done
+    return core.generation_flights.wait(call)
+
+def _finish_flight(key, call, task):
+    if task.cancelled():
+        core.generation_flights.finish(key, call, error=RuntimeError('Identical generation was cancelled'))
+    elif task.exception() is not None:
+        core.generation_flights.finish(key, call, error=task.exception())
+    else:
+        core.generation_flights.finish(key, call, task.result())
+
+async def process_generate_async(ocr_id, grounded=False, force_refresh=False, mode='llm', incremental=True,
+                                 parent_id=None):
+    """process_generate with the LLM calls awaited"""
+    ocr_text, knowledge = await run_db(core.load_generation_inputs, ocr_id, grounded)
+    key = core.generation_flight_key(ocr_id, ocr_text, grounded, knowledge, mode, force_refresh, incremental,
+                                     parent_id)
+
+    call, leader = core.generation_flights.begin(key)
+    if not leader:
+        logger.info(f"🔗 Joining generation in flight for OCR ID {ocr_id}")
+        return dict(await wait_flight(call), coalesced=True)
+
+    task = asyncio.ensure_future(run_steps(core.generate_and_store_steps(
+        ocr_id, ocr_text, knowledge, grounded, force_refresh, mode, incremental, parent_id
+    )))
+    task.add_done_callback(functools.partial(_finish_flight, key, call))
+    # Shielded: a disconnecting leader does not cancel the call for the others
+    return dict(await asyncio.shield(task), coalesced=False)
+
+# Async views: same validation and responses as the Flask views in app.py
+def idempotent_async(view):
+    """idempotent for async views"""
+    @functools.wraps(view)
+    async def wrapper(*args, **kwargs):
+        key, early = await run_db(core.begin_idempotent_request)
+        if early is not None:
+            return early
+        if key is None:
+            return await view(*args, **kwargs)
+
+        try:
+            response = core.app.make_response(await view(*args, **kwargs))
+        except BaseException:
+            await run_db(core.finish_idempotent_request, key)
+            raise
+        await run_db(core.finish_idempotent_request, key, response)
+        return response
+    return wrapper
+
+async def upload_file():
+    """Handle file upload and OCR"""
+    logger.info("📤 Upload request received")
+
+    try:
+        if not core._db_initialized:
+            await run_db(core.init_db)
+
+        upload, error = await run_sync(core.read_upload_request)
+        if error:
+            return error
+        filename, file_bytes, file_digest, ocr_backend = upload
+
+        try:
+            if core.wants_async(request.form):
+                job_id = await run_db(
+                    core.submit_job, 'ocr', {'filename': filename, 'file_digest': file_digest, 'ocr_backend': ocr_backend},
+                    core.process_upload, filename, file_bytes, file_digest, ocr_backend
+                )
+                logger.info(f"📨 Queued OCR job {job_id}")
+                return jsonify({'success': True, 'job_id': job_id, 'status': 'queued'}), 202
+
+            result = await process_upload_async(filename, file_bytes, file_digest, ocr_backend)
+
+            logger.info("✅ Upload complete")
+
+            return jsonify(result), 200
+
+        except core.JobQueueFull as e:
+            return jsonify({'error': str(e)}), 503
+
+        except Exception as e:
+            logger.exception(f"❌ Processing error: {e}")
+            return jsonify({'error': str(e)}), 500
+
+    except Exception as e:
+        logger.exception(f"❌ Request error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@idempotent_async
+async def generate_model():
+    """Generate Data Vault model"""
+    logger.info("🧠 Generate request")
+
+    try:
+        if not core._db_initialized:
+            await run_db(core.init_db)
+
+        data = request.get_json()
+        options, error = core.read_generate_options(data)
+        if error:
+            return error
+        ocr_id, grounded, force_refresh, mode, incremental, parent_id = options
+
+        try:
+            if core.wants_async(data):
+                if not await run_db(core.ocr_result_exists, ocr_id):
+                    return jsonify({'error': 'OCR result not found'}), 404
+
+                job_id = await run_db(
+                    core.submit_job, 'generate', {'ocr_id': ocr_id, 'grounded': bool(grounded), 'mode': mode},
+                    core.process_generate, ocr_id, grounded, force_refresh, mode, incremental, parent_id
+                )
+                logger.info(f"📨 Queued generate job {job_id}")
+                return jsonify({'success': True, 'job_id': job_id, 'status': 'queued'}), 202
+
+            result = await process_generate_async(ocr_id, grounded, force_refresh, mode, incremental, parent_id)
+
+            return jsonify(result), 200
+
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+
+        except core.JobQueueFull as e:
+            return jsonify({'error': str(e)}), 503
+
+        except Exception as e:
+            logger.exception(f"❌ Generation error: {e}")
+            return jsonify({'error': str(e)}), 500
+
+    except Exception as e:
+        logger.error(f"❌ Request error: {e}")
+        return jsonify({'error': str(e)}), 500
+
+ASYNC_VIEWS = {
+    ('POST', '/api/upload'): upload_file,
+    ('POST', '/api/generate'): generate_model,
+}
+
+# ASGI <-> Flask plumbing
+async def read_body(receive):
+    """Request body spooled like uploads; stops reading once past MAX_CONTENT_LENGTH (Flask then answers 413)"""
+    limit = core.app.config.get('MAX_CONTENT_LENGTH')
+    body = tempfile.SpooledTemporaryFile(
+        max_size=core.UPLOAD_SPOOL_BYTES, prefix='dv-asgi-', dir=core.app.config['UPLOAD_FOLDER']
+    )
+    size = 0
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            body.close()
+            return None, size
+        chunk = message.get('body', b'')
+        size += len(chunk)
+        if limit and size > limit:
+            break
+        body.write(chunk)
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body, size
+
+def build_environ(scope, body, size):
+    """WSGI environ for an ASGI HTTP scope"""
+    root_path = scope.get('root_path', '')
+    path = scope['path']
+    if root_path and path.startswith(root_path):
+        path = path[len(root_path):]
+    server = scope.get('server') or ('localhost', 80)
+
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': root_path.encode('utf-8').decode('latin-1'),
+        'PATH_INFO': path.encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': str(server[0]),
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(size),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'], environ['REMOTE_PORT'] = scope['client'][0], str(scope['client'][1])
+
+    for raw_name, raw_value in scope['headers']:
+        name, value = raw_name.decode('latin-1').upper().replace('-', '_'), raw_value.decode('latin-1')
+        if name == 'CONTENT_LENGTH':
+            continue
+        key = name if name == 'CONTENT_TYPE' else f"HTTP_{name}"
+        if key in environ:
+            value = f"{environ[key]}{'; ' if key == 'HTTP_COOKIE' else ','}{value}"
+        environ[key] = value
+    return environ
+
+def response_start(status, headers):
+    return {
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+    }
+
+async def dispatch_async_view(view, environ, send):
+    """Run an async view inside a Flask request context so before/after hooks, error handlers and metrics apply"""
+    flask_app = core.app
+    with flask_app.request_context(environ):
+        try:
+            rv = flask_app.preprocess_request()
+            if rv is None:
+                rv = await view()
+        except Exception as e:
+            rv = flask_app.handle_user_exception(e)
+        response = flask_app.finalize_request(rv)
+
+    try:
+        await send(response_start(response.status_code, response.headers.items()))
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+    finally:
+        response.close()
+
+async def dispatch_wsgi(environ, send):
+    """Serve a request with the Flask app on the sync executor, streaming the body chunk by chunk"""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'], started['headers'] = int(status.split(' ', 1)[0]), headers
+        return lambda data: started.setdefault('written', []).append(data)
+
+    # One context for the whole response: streamed generators keep the request context they pushed
+    context = contextvars.copy_context()
+    iterable = await _run_in(_sync_executor, context, core.app, environ, start_response)
+    try:
+        iterator = iter(iterable)
+        chunk = await _run_in(_sync_executor, context, next, iterator, None)
+        await send(response_start(started['status'], started['headers']))
+        for data in started.get('written', ()):
+            await send({'type': 'http.response.body', 'body': data, 'more_body': True})
+        while chunk is not None:
+            if chunk:
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            chunk = await _run_in(_sync_executor, context, next, iterator, None)
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(iterable, 'close'):
+            await _run_in(_sync_executor, context, iterable.close)
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            try:
+                await run_db(core.init_db)
+                logger.info(f"🚀 App loaded (asgi, {ASGI_THREADS} threads, {ASGI_DB_WORKERS} db workers)")
+                await send({'type': 'lifespan.startup.complete'})
+            except Exception as e:
+                logger.exception(f"❌ Startup error: {e}")
+                await send({'type': 'lifespan.startup.failed', 'message': str(e)})
+        elif message['type'] == 'lifespan.shutdown':
+            await ocr_client.aclose()
+            await groq_client.aclose()
+            await run_db(core.db.flush)
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    """ASGI application"""
+    if scope['type'] == 'lifespan':
+        await lifespan(receive, send)
+        return
+    if scope['type'] != 'http':
+        return
+
+    body, size = await read_body(receive)
+    if body is None:
+        return
+    try:
+        environ = build_environ(scope, body, size)
+        view = ASYNC_VIEWS.get((scope['method'], scope['path']))
+        if view is not None:
+            await dispatch_async_view(view, environ, send)
+        else:
+            await dispatch_wsgi(environ, send)
+    finally:
+        body.close()
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run('asgi:app', host='0.0.0.0', port=int(os.getenv('PORT', '8000')))
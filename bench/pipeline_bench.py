@@ -0,0 +1,419 @@
+"""Benchmark the request pipeline end to end against recorded provider fixtures.
+
+    python bench/pipeline_bench.py --requests 200 --concurrency 8
+    python bench/pipeline_bench.py --save-baseline bench/baseline.json
+    python bench/pipeline_bench.py --baseline bench/baseline.json --tolerance 0.2
+
+Replays bench/fixtures through the stub providers, drives /api/upload,
+/api/manual-schema, /api/generate and /api/models with a pool of client
+threads and reports p50/p95/p99 latency, requests/sec, SQLite lock waits
+and peak RSS per endpoint. The scaling section times parsing, validation,
+merge and generation on synthetic schemas of 10, 100 and 1000 tables.
+Exits non-zero when a run regresses past --tolerance against --baseline.
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+from stub_providers import StubProviders, load_fixtures  # noqa: E402
+from synthetic import SIZES, synthetic_schema  # noqa: E402
+
+ENDPOINTS = ('upload', 'manual_schema', 'generate', 'models')
+COMPARED_METRICS = {'p50_ms': 1, 'p95_ms': 1, 'p99_ms': 1, 'rps': -1}
+WRITE_PREFIXES = ('insert', 'update', 'delete', 'replace', 'begin')
+PNG_HEADER = b'\x89PNG\r\n\x1a\n'
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def current_rss():
+    """Resident set size in bytes (falls back to the process peak off Linux)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RssSampler:
+    """Track peak RSS on a background thread while a phase runs"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = current_rss()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+class LockProbe:
+    """Count SQLite writes that stalled on the database lock.
+
+    The app runs in WAL mode with a 30s busy_timeout, so contention shows up
+    as write statements or commits that block instead of failing. Any write
+    slower than the threshold is counted as a lock wait.
+    """
+
+    def __init__(self, threshold=0.005):
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.waits = 0
+            self.wait_seconds = 0.0
+            self.locked_errors = 0
+
+    def timed(self, func, *args):
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e):
+                with self.lock:
+                    self.locked_errors += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            if elapsed >= self.threshold:
+                with self.lock:
+                    self.waits += 1
+                    self.wait_seconds += elapsed
+
+    def snapshot(self):
+        with self.lock:
+            return {'lock_waits': self.waits, 'lock_wait_ms': round(self.wait_seconds * 1000, 1),
+                    'locked_errors': self.locked_errors}
+
+
+class ProbedCursor:
+    def __init__(self, cursor, probe):
+        self._cursor = cursor
+        self._probe = probe
+
+    def execute(self, sql, *args):
+        if sql.lstrip().lower().startswith(WRITE_PREFIXES):
+            self._probe.timed(self._cursor.execute, sql, *args)
+        else:
+            self._cursor.execute(sql, *args)
+        return self
+
+    def executemany(self, sql, *args):
+        self._probe.timed(self._cursor.executemany, sql, *args)
+        return self
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class ProbedConnection:
+    def __init__(self, conn, probe):
+        self._conn = conn
+        self._probe = probe
+
+    def cursor(self):
+        return ProbedCursor(self._conn.cursor(), self._probe)
+
+    def execute(self, sql, *args):
+        return ProbedCursor(self._conn.cursor(), self._probe).execute(sql, *args)
+
+    def commit(self):
+        return self._probe.timed(self._conn.commit)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def install_probe(app, probe):
+    connect = app.db.backend.connect
+    app.db.backend.connect = lambda: ProbedConnection(connect(), probe)
+    app.db.reset()
+
+
+class Driver:
+    """Issue requests against the Flask app from a pool of client threads"""
+
+    def __init__(self, flask_app):
+        self.flask_app = flask_app
+        self._local = threading.local()
+
+    @property
+    def client(self):
+        if not hasattr(self._local, 'client'):
+            self._local.client = self.flask_app.test_client()
+        return self._local.client
+
+    def upload(self, i):
+        body = PNG_HEADER + f"bench-upload-{i}-{time.time_ns()}".encode() + b'0' * 20000
+        return self.client.post('/api/upload', data={'file': (io.BytesIO(body), f"schema_{i}.png")},
+                                content_type='multipart/form-data')
+
+    def manual_schema(self, i, schema_text):
+        return self.client.post('/api/manual-schema', json={'schema_text': schema_text})
+
+    def generate(self, ocr_id, force_refresh=True, mode='llm'):
+        return self.client.post('/api/generate', json={'ocr_id': ocr_id, 'force_refresh': force_refresh, 'mode': mode})
+
+    def models(self, i):
+        return self.client.get('/api/models')
+
+
+def run_endpoint(name, call, count, concurrency, probe):
+    """Run count calls across concurrency threads and summarize them"""
+    latencies = []
+    errors = 0
+
+    def timed(i):
+        start = time.perf_counter()
+        response = call(i)
+        return time.perf_counter() - start, response.status_code
+
+    probe.reset()
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for future in [pool.submit(timed, i) for i in range(count)]:
+                try:
+                    elapsed, status = future.result()
+                    latencies.append(elapsed)
+                    if status >= 400:
+                        errors += 1
+                except Exception:
+                    errors += 1
+        elapsed = time.perf_counter() - start
+
+    stats = {
+        'requests': count,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'mean_ms': round((statistics.mean(latencies) if latencies else 0) * 1000, 2),
+        'rps': round(count / elapsed, 1) if elapsed else 0.0,
+        'peak_rss_mb': round(rss.peak / (1024 * 1024), 1),
+    }
+    stats.update(probe.snapshot())
+    return stats
+
+
+def time_call(func, repeat):
+    """Median wall time of func in milliseconds, plus its last result"""
+    samples = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append(time.perf_counter() - start)
+    return round(statistics.median(samples) * 1000, 2), result
+
+
+def run_scaling(app, driver, sizes, repeat):
+    """Time the pipeline stages on synthetic schemas of increasing size"""
+    results = {}
+    for size in sizes:
+        schema_text = synthetic_schema(size)
+        row = {'chars': len(schema_text)}
+
+        row['parse_ms'], tables = time_call(lambda: app.parse_schema(schema_text), repeat)
+        row['chunk_ms'], chunks = time_call(lambda: app.chunk_schema(schema_text), repeat)
+        row['rules_model_ms'], (model, _) = time_call(lambda: app.build_rules_model(tables), repeat)
+
+        def validate():
+            try:
+                app.validate_dv_model(model)
+            except ValueError:
+                pass
+        row['validate_ms'], _ = time_call(validate, repeat)
+
+        chunk_models = [app.build_rules_model(app.parse_schema(chunk))[0] for chunk in chunks]
+        row['merge_ms'], merged = time_call(lambda: app.merge_dv_models(chunk_models), repeat)
+
+        ocr_id = driver.manual_schema(0, schema_text).get_json()['ocr_id']
+        for mode in ('rules', 'llm'):
+            def generate():
+                response = driver.generate(ocr_id, force_refresh=True, mode=mode)
+                if response.status_code != 200:
+                    raise RuntimeError(f"generate {mode} failed: {response.get_json()}")
+            row[f"generate_{mode}_ms"], _ = time_call(generate, repeat)
+
+        row.update({'tables': len(tables), 'chunks': len(chunks), 'nodes': len(model['nodes']),
+                    'merged_nodes': len(merged['nodes'])})
+        results[str(size)] = row
+    return results
+
+
+def compare(current, baseline, tolerance):
+    """Print deltas against a baseline run and return the regressions"""
+    regressions = []
+    print(f"\nvs baseline ({baseline.get('meta', {}).get('recorded_at', 'unknown')}), tolerance {tolerance:.0%}")
+    for endpoint, stats in current['endpoints'].items():
+        base = baseline.get('endpoints', {}).get(endpoint)
+        if not base:
+            continue
+        cells = []
+        for metric, direction in COMPARED_METRICS.items():
+            if not base.get(metric):
+                continue
+            change = (stats[metric] - base[metric]) / base[metric]
+            flag = ''
+            if change * direction > tolerance:
+                flag = ' !'
+                regressions.append(f"{endpoint}.{metric} {base[metric]} -> {stats[metric]}")
+            cells.append(f"{metric}={change:+.0%}{flag}")
+        print(f"  {endpoint:<14} " + '  '.join(cells))
+
+    for size, row in current.get('scaling', {}).items():
+        base = baseline.get('scaling', {}).get(size)
+        if not base:
+            continue
+        for metric, value in row.items():
+            if metric.endswith('_ms') and base.get(metric) and (value - base[metric]) / base[metric] > tolerance:
+                regressions.append(f"scaling[{size}].{metric} {base[metric]} -> {value}")
+    return regressions
+
+
+def print_results(results):
+    print(f"\n{'endpoint':<14} {'n':>5} {'err':>4} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>7} "
+          f"{'lockwait':>9} {'rss':>8}")
+    for endpoint, s in results['endpoints'].items():
+        print(f"{endpoint:<14} {s['requests']:>5} {s['errors']:>4} {s['p50_ms']:>6.1f}ms {s['p95_ms']:>6.1f}ms "
+              f"{s['p99_ms']:>6.1f}ms {s['rps']:>7.1f} {s['lock_waits']:>3}/{s['lock_wait_ms']:>5.0f}ms "
+              f"{s['peak_rss_mb']:>6.1f}MB")
+
+    if results.get('scaling'):
+        print(f"\n{'tables':>6} {'chunks':>6} {'parse':>8} {'rules':>8} {'validate':>9} {'merge':>8} "
+              f"{'gen rules':>10} {'gen llm':>9}")
+        for size, row in results['scaling'].items():
+            print(f"{size:>6} {row['chunks']:>6} {row['parse_ms']:>6.1f}ms {row['rules_model_ms']:>6.1f}ms "
+                  f"{row['validate_ms']:>7.1f}ms {row['merge_ms']:>6.1f}ms {row['generate_rules_ms']:>8.1f}ms "
+                  f"{row['generate_llm_ms']:>7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=100, help='requests per endpoint')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.02, help='simulated provider latency in seconds')
+    parser.add_argument('--fixtures', default=os.path.join(BENCH_DIR, 'fixtures'))
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS))
+    parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES), help="synthetic table counts ('' to skip)")
+    parser.add_argument('--repeat', type=int, default=3, help='repetitions per scaling measurement')
+    parser.add_argument('--cache', action='store_true', help='let /api/generate hit the model cache')
+    parser.add_argument('--lock-threshold', type=float, default=0.005, help='seconds before a write counts as a lock wait')
+    parser.add_argument('--baseline', help='baseline JSON to compare against')
+    parser.add_argument('--save-baseline', help='write this run as a baseline JSON')
+    parser.add_argument('--tolerance', type=float, default=0.2)
+    parser.add_argument('--verbose', action='store_true', help='keep app logging on stdout')
+    args = parser.parse_args()
+
+    endpoints = [e for e in args.endpoints.split(',') if e]
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    baseline_path = os.path.abspath(args.baseline) if args.baseline else None
+    save_path = os.path.abspath(args.save_baseline) if args.save_baseline else None
+
+    with StubProviders(latency=args.latency, **load_fixtures(args.fixtures)) as stub:
+        os.environ.update({
+            'OCR_API_URL': stub.ocr_url,
+            'GROQ_API_URL': stub.groq_url,
+            'OCR_SPACE_KEY': os.getenv('OCR_SPACE_KEY', 'stub'),
+            'GROQ_API_KEY': os.getenv('GROQ_API_KEY', 'stub'),
+            'OCR_RATE_PER_SEC': '0',
+            'GROQ_RATE_PER_SEC': '0',
+        })
+        os.chdir(tempfile.mkdtemp(prefix='dv-bench-'))
+
+        quiet = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(open(os.devnull, 'w'))
+        with quiet:
+            import app
+            app.init_db()
+            probe = LockProbe(args.lock_threshold)
+            install_probe(app, probe)
+            driver = Driver(app.app)
+
+            seed_schema = synthetic_schema(10)
+            ocr_ids = [driver.manual_schema(i, seed_schema).get_json()['ocr_id'] for i in range(args.concurrency)]
+            calls = {
+                'upload': driver.upload,
+                'manual_schema': lambda i: driver.manual_schema(i, seed_schema),
+                'generate': lambda i: driver.generate(ocr_ids[i % len(ocr_ids)], force_refresh=not args.cache),
+                'models': driver.models,
+            }
+
+            results = {
+                'meta': {
+                    'recorded_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                    'python': platform.python_version(),
+                    'platform': platform.platform(),
+                    'requests': args.requests,
+                    'concurrency': args.concurrency,
+                    'provider_latency': args.latency,
+                    'cache': args.cache,
+                },
+                'endpoints': {},
+                'scaling': {},
+            }
+            for endpoint in endpoints:
+                results['endpoints'][endpoint] = run_endpoint(endpoint, calls[endpoint], args.requests,
+                                                              args.concurrency, probe)
+            results['scaling'] = run_scaling(app, driver, sizes, args.repeat)
+            results['meta']['stub_counts'] = dict(stub.config.counts)
+
+    print_results(results)
+
+    if save_path:
+        with open(save_path, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nbaseline written to {save_path}")
+
+    if baseline_path:
+        with open(baseline_path) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        if regressions:
+            print('regressions:\n  ' + '\n  '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+"""Benchmark the outbound OCR.space / GROQ clients against the local stub server.
+
+    python bench/provider_bench.py --requests 50 --concurrency 4 --latency 0.05 --fail-rate 0.1
+
+Reports latency percentiles for pooled-client calls versus a fresh
+requests.post per call, plus the retry / circuit breaker counters.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from stub_providers import StubProviders  # noqa: E402
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run(label, func, count, concurrency):
+    latencies = []
+    errors = 0
+
+    def timed(_):
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for future in [pool.submit(timed, i) for i in range(count)]:
+            try:
+                latencies.append(future.result())
+            except Exception:
+                errors += 1
+    elapsed = time.perf_counter() - start
+
+    print(f"{label:<28} n={count:<4} err={errors:<3} "
+          f"p50={percentile(latencies, 50) * 1000:7.1f}ms "
+          f"p95={percentile(latencies, 95) * 1000:7.1f}ms "
+          f"mean={(statistics.mean(latencies) if latencies else 0) * 1000:7.1f}ms "
+          f"rps={count / elapsed:6.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--requests', type=int, default=50)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--fail-rate', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=0.05)
+    args = parser.parse_args()
+
+    with StubProviders(latency=args.latency, fail_rate=args.fail_rate,
+                       fail_status=503, retry_after=args.retry_after) as stub:
+        os.environ.update({
+            'OCR_API_URL': stub.ocr_url,
+            'GROQ_API_URL': stub.groq_url,
+            'OCR_SPACE_KEY': os.getenv('OCR_SPACE_KEY', 'stub'),
+            'GROQ_API_KEY': os.getenv('GROQ_API_KEY', 'stub'),
+            'OCR_RATE_PER_SEC': '0',
+            'GROQ_RATE_PER_SEC': '0',
+            'OCR_BACKOFF_BASE': '0.05',
+            'GROQ_BACKOFF_BASE': '0.05',
+        })
+        os.chdir(tempfile.mkdtemp(prefix='dv-bench-'))
+
+        import requests
+        import app
+
+        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as f:
+            f.write(b'\x89PNG\r\n\x1a\n' + b'0' * 20000)
+            image_path = f.name
+
+        payload = app.groq_payload('system', 'user')
+        run('groq fresh requests.post', lambda: requests.post(stub.groq_url, json=payload, timeout=10),
+            args.requests, args.concurrency)
+        run('groq pooled client', lambda: app.groq_client.post(stub.groq_url, json=payload, timeout=10),
+            args.requests, args.concurrency)
+        run('extract_text_ocr', lambda: app.extract_text_ocr(image_path), args.requests, args.concurrency)
+        run('generate_dv_model', lambda: app.generate_dv_model(app.normalize_schema_text('Table: a')),
+            args.requests, args.concurrency)
+
+        print(f"stub counts: {stub.config.counts}")
+        print(f"ocr client:  {app.ocr_client.snapshot()}")
+        print(f"groq client: {app.groq_client.snapshot()}")
+
+
+if __name__ == '__main__':
+    main()
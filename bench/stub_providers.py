@@ -0,0 +1,232 @@
+"""Local stand-in for the OCR.space and GROQ APIs.
+
+Used to benchmark the outbound clients offline. Point the app at it with
+OCR_API_URL=http://127.0.0.1:<port>/parse/image and
+GROQ_API_URL=http://127.0.0.1:<port>/openai/v1/chat/completions.
+
+    python bench/stub_providers.py --port 8099 --latency 0.2 --fail-first 2 --fail-status 429
+
+Pass --fixtures bench/fixtures to replay recorded provider responses
+instead of the built-in sample payloads.
+"""
+import argparse
+import json
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_SCHEMA = """Table: customers
+Columns: customer_id (PK), name, email
+
+Table: orders
+Columns: order_id (PK), customer_id (FK -> customers.customer_id), order_date, amount
+"""
+
+SAMPLE_MODEL = {
+    "nodes": [
+        {"id": "Hub_Customer", "type": "hub", "businessKey": "customer_id", "attributes": ["customer_id"],
+         "reasoning": "Passes HUB TEST: customers are independent business entities."},
+        {"id": "Hub_Order", "type": "hub", "businessKey": "order_id", "attributes": ["order_id"],
+         "reasoning": "Passes HUB TEST: orders are queried independently."},
+        {"id": "Link_Customer_Order", "type": "link", "connects": ["Hub_Customer", "Hub_Order"],
+         "reasoning": "Passes LINK TEST: relates customers to their orders."},
+        {"id": "Sat_Customer_Details", "type": "satellite", "parent": "Hub_Customer", "attributes": ["name", "email"],
+         "reasoning": "Passes SAT TEST: descriptive customer attributes."},
+        {"id": "Sat_Order_Details", "type": "satellite", "parent": "Hub_Order", "attributes": ["order_date", "amount"],
+         "reasoning": "Passes SAT TEST: descriptive order attributes."}
+    ],
+    "edges": []
+}
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures')
+OCR_FIXTURE = 'ocr_space_parse.json'
+GROQ_FIXTURE = 'groq_chat_completion.json'
+
+
+def load_fixtures(path=FIXTURES_DIR):
+    """Load recorded OCR.space / GROQ responses from a fixtures directory"""
+    fixtures = {}
+    for key, name in (('ocr_response', OCR_FIXTURE), ('groq_response', GROQ_FIXTURE)):
+        fixture_path = os.path.join(path, name)
+        if os.path.exists(fixture_path):
+            with open(fixture_path, encoding='utf-8') as f:
+                fixtures[key] = json.load(f)
+    return fixtures
+
+
+class StubConfig:
+    """Behavior knobs shared by all handler threads"""
+
+    def __init__(self, latency=0.0, jitter=0.0, fail_first=0, fail_status=503, fail_rate=0.0,
+                 retry_after=None, ocr_text=SAMPLE_SCHEMA, model=None, chunk_size=40,
+                 ocr_response=None, groq_response=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.fail_rate = fail_rate
+        self.retry_after = retry_after
+        self.ocr_text = ocr_text
+        self.model = model or SAMPLE_MODEL
+        self.chunk_size = chunk_size
+        self.ocr_response = ocr_response
+        self.groq_response = groq_response
+        self.lock = threading.Lock()
+        self.counts = {'ocr': 0, 'groq': 0, 'failed': 0}
+
+    def should_fail(self, total):
+        if total <= self.fail_first:
+            return True
+        return self.fail_rate > 0 and random.random() < self.fail_rate
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        config = self.config
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+
+        kind = 'ocr' if self.path.startswith('/parse') else 'groq'
+        with config.lock:
+            config.counts[kind] += 1
+            total = config.counts['ocr'] + config.counts['groq']
+            fail = config.should_fail(total)
+            if fail:
+                config.counts['failed'] += 1
+
+        time.sleep(max(0.0, config.latency + random.uniform(-config.jitter, config.jitter)))
+
+        if fail:
+            headers = {'Retry-After': str(config.retry_after)} if config.retry_after is not None else {}
+            self._send_json(config.fail_status, {'error': {'message': 'stub failure'}}, headers)
+            return
+
+        if kind == 'ocr':
+            if config.ocr_response is not None:
+                self._send_json(200, config.ocr_response)
+                return
+            self._send_json(200, {
+                'ParsedResults': [{'ParsedText': config.ocr_text}],
+                'IsErroredOnProcessing': False
+            })
+            return
+
+        request_json = json.loads(body or b'{}')
+        if config.groq_response is not None:
+            content = config.groq_response['choices'][0]['message']['content']
+        else:
+            content = json.dumps(config.model, indent=2)
+
+        if not request_json.get('stream'):
+            if config.groq_response is not None:
+                self._send_json(200, config.groq_response)
+                return
+            self._send_json(200, {
+                'choices': [{'message': {'role': 'assistant', 'content': content}, 'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': len(body) // 4, 'completion_tokens': len(content) // 4}
+            })
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for i in range(0, len(content), config.chunk_size):
+            chunk = {'choices': [{'delta': {'content': content[i:i + config.chunk_size]}}]}
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        usage = {'prompt_tokens': len(body) // 4, 'completion_tokens': len(content) // 4}
+        final = {'choices': [{'delta': {}, 'finish_reason': 'stop'}], 'x_groq': {'usage': usage}}
+        self.wfile.write(f"data: {json.dumps(final)}\n\n".encode('utf-8'))
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+
+class StubProviders:
+    """Run the stub server on a background thread"""
+
+    def __init__(self, host='127.0.0.1', port=0, **config):
+        self.config = StubConfig(**config)
+        handler = type('BoundStubHandler', (StubHandler,), {'config': self.config})
+        # Large listen backlog so hundreds of concurrent clients are not refused
+        server_class = type('StubServer', (ThreadingHTTPServer,), {'request_queue_size': 512})
+        self.server = server_class((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def ocr_url(self):
+        return f"{self.base_url}/parse/image"
+
+    @property
+    def groq_url(self):
+        return f"{self.base_url}/openai/v1/chat/completions"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub OCR.space / GROQ server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    parser.add_argument('--jitter', type=float, default=0.0)
+    parser.add_argument('--fail-first', type=int, default=0, help='fail the first N requests')
+    parser.add_argument('--fail-status', type=int, default=503)
+    parser.add_argument('--fail-rate', type=float, default=0.0, help='probability of a failure after that')
+    parser.add_argument('--retry-after', type=float, default=None)
+    parser.add_argument('--fixtures', default=None, help='directory of recorded provider responses')
+    args = parser.parse_args()
+
+    fixtures = load_fixtures(args.fixtures) if args.fixtures else {}
+    stub = StubProviders(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                         fail_first=args.fail_first, fail_status=args.fail_status,
+                         fail_rate=args.fail_rate, retry_after=args.retry_after, **fixtures)
+    print(f"Stub providers on {stub.base_url}")
+    print(f"  OCR_API_URL={stub.ocr_url}")
+    print(f"  GROQ_API_URL={stub.groq_url}")
+    try:
+        stub.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
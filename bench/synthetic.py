@@ -0,0 +1,101 @@
+"""Synthetic schemas for scaling benchmarks.
+
+    python bench/synthetic.py --tables 100 > schema.txt
+
+Produces OCR-style "Table: / Columns:" text (or CREATE TABLE DDL with
+--ddl) with a realistic mix of entity tables, association tables and a
+few keyless tables, so parsing, validation and model merge all see the
+shapes they meet in real uploads.
+"""
+import argparse
+import random
+
+SIZES = (10, 100, 1000)
+
+NOUNS = ['customer', 'order', 'product', 'supplier', 'invoice', 'payment', 'shipment', 'warehouse',
+         'employee', 'department', 'account', 'contract', 'policy', 'claim', 'store', 'region',
+         'campaign', 'ticket', 'vendor', 'asset', 'project', 'course', 'student', 'device']
+ATTRIBUTES = ['name', 'description', 'status', 'created_at', 'updated_at', 'amount', 'currency', 'email',
+              'phone', 'address', 'city', 'country', 'quantity', 'price', 'start_date', 'end_date',
+              'category', 'notes', 'rating', 'code']
+
+
+def _table_name(index):
+    noun = NOUNS[index % len(NOUNS)]
+    return noun if index < len(NOUNS) else f"{noun}_{index // len(NOUNS)}"
+
+
+def synthetic_tables(table_count, seed=42):
+    """Table specs as dicts with name, columns, pk and fks (column → target table)"""
+    rng = random.Random(seed)
+    tables = []
+    entities = []
+
+    for i in range(table_count):
+        roll = rng.random()
+        if len(entities) >= 2 and roll < 0.2:
+            left, right = rng.sample(entities, 2)
+            columns = [f"{left}_id", f"{right}_id", 'created_at']
+            tables.append({'name': f"{left}_{right}_map", 'columns': columns,
+                           'pk': columns[:2], 'fks': {f"{left}_id": left, f"{right}_id": right}})
+        elif roll > 0.97:
+            columns = ['message', 'logged_at', 'source']
+            tables.append({'name': f"audit_log_{i}", 'columns': columns, 'pk': [], 'fks': {}})
+        else:
+            name = _table_name(i)
+            key = f"{name}_id"
+            fks = {f"{target}_id": target for target in rng.sample(entities, min(len(entities), rng.randint(0, 2)))}
+            columns = [key] + list(fks) + rng.sample(ATTRIBUTES, rng.randint(3, 6))
+            tables.append({'name': name, 'columns': columns, 'pk': [key], 'fks': fks})
+            entities.append(name)
+
+    return tables
+
+
+def _ocr_column(table, column):
+    markers = []
+    if column in table['pk']:
+        markers.append('PK')
+    if column in table['fks']:
+        target = table['fks'][column]
+        markers.append(f"FK -> {target}.{target}_id")
+    return f"{column} ({', '.join(markers)})" if markers else column
+
+
+def _ddl_column(table, column):
+    kind = 'int' if column.endswith('_id') else 'varchar(255)'
+    definition = f"  {column} {kind}"
+    if table['pk'] == [column]:
+        definition += ' PRIMARY KEY'
+    if column in table['fks']:
+        target = table['fks'][column]
+        definition += f" REFERENCES {target}({target}_id)"
+    return definition
+
+
+def synthetic_schema(table_count, seed=42, ddl=False):
+    """Schema text with table_count tables"""
+    blocks = []
+    for table in synthetic_tables(table_count, seed):
+        if ddl:
+            lines = [_ddl_column(table, column) for column in table['columns']]
+            if len(table['pk']) > 1:
+                lines.append(f"  PRIMARY KEY ({', '.join(table['pk'])})")
+            blocks.append(f"CREATE TABLE {table['name']} (\n" + ',\n'.join(lines) + '\n);')
+        else:
+            columns = ', '.join(_ocr_column(table, column) for column in table['columns'])
+            blocks.append(f"Table: {table['name']}\nColumns: {columns}")
+    return '\n\n'.join(blocks) + '\n'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic schema')
+    parser.add_argument('--tables', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--ddl', action='store_true', help='emit CREATE TABLE statements')
+    args = parser.parse_args()
+    print(synthetic_schema(args.tables, args.seed, args.ddl), end='')
+
+
+if __name__ == '__main__':
+    main()
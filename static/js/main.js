@@ -1,6 +1,8 @@
 let cy;
 let currentOcrId = null;
 let currentModel = null;
+let currentModelId = null;
+let currentLayout = null;
 let fullOcrText = '';
 
 // Initialize Cytoscape with enhanced layout
@@ -200,6 +202,32 @@ async function parseJSON(response) {
     }
 }
 
+// Wait for a background job via its server-sent event stream
+function waitForJob(jobId, statusElementId) {
+    return new Promise((resolve, reject) => {
+        const source = new EventSource(`/api/jobs/${jobId}/stream`);
+        
+        source.addEventListener('status', function(event) {
+            const job = JSON.parse(event.data);
+            
+            if (job.status === 'succeeded') {
+                source.close();
+                resolve(job.result);
+            } else if (job.status === 'failed') {
+                source.close();
+                reject(new Error(job.error || 'Job failed'));
+            } else if (statusElementId && job.progress) {
+                showStatus(statusElementId, `${job.progress}...`, 'info');
+            }
+        });
+        
+        source.onerror = function() {
+            source.close();
+            reject(new Error('Lost connection to job status stream'));
+        };
+    });
+}
+
 // Check API configuration
 async function checkConfig() {
     try {
@@ -277,6 +305,7 @@ async function uploadSource() {
     
     const formData = new FormData();
     formData.append('file', file);
+    formData.append('async', 'true');
     
     document.getElementById('uploadBtn').disabled = true;
     showStatus('uploadStatus', 'Extracting text via OCR... This may take up to 2 minutes.', 'info');
@@ -293,7 +322,10 @@ async function uploadSource() {
             return;
         }
         
-        const data = await parseJSON(response);
+        let data = await parseJSON(response);
+        if (data.job_id) {
+            data = await waitForJob(data.job_id, 'uploadStatus');
+        }
         
         if (data.success) {
             currentOcrId = data.ocr_id;
@@ -422,29 +454,14 @@ async function generateModel() {
     showStatus('generateStatus', 'Generating Data Vault 2.1 model with AI... This may take up to 60 seconds.', 'info');
     
     try {
-        const response = await fetch('/api/generate', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json'
-            },
-            body: JSON.stringify({
-                ocr_id: currentOcrId,
-                grounded: grounded
-            })
-        });
-        
-        if (!response.ok) {
-            const data = await parseJSON(response);
-            showStatus('generateStatus', `${data.error || 'Generation failed'}`, 'error');
-            return;
-        }
-        
-        const data = await parseJSON(response);
+        const data = await streamGeneration(grounded);
         
         if (data.success && data.model) {
             currentModel = data.model;
+            currentModelId = data.model_id;
+            currentLayout = await fetchLayout(data.model_id);
             showStatus('generateStatus', 'Model generated successfully!', 'success');
-            visualizeModel(data.model);
+            visualizeModel(data.model, currentLayout);
             updateStats(data.model);
         } else {
             showStatus('generateStatus', `${data.error || 'No model returned'}`, 'error');
@@ -457,8 +474,96 @@ async function generateModel() {
     }
 }
 
+// Fetch precomputed node positions; null falls back to the client-side grid
+async function fetchLayout(modelId) {
+    if (!modelId) return null;
+    try {
+        const response = await fetch(`/api/models/${modelId}?include=layout&reasoning=false`);
+        const data = await parseJSON(response);
+        return response.ok && data.layout ? data.layout : null;
+    } catch (error) {
+        console.warn('Layout unavailable, using client layout:', error);
+        return null;
+    }
+}
+
+// Add one model node to Cytoscape WITH FULL NAME and REASONING
+function addModelNode(node, position) {
+    const borderColor = node.type === 'hub' ? '#2c5aa0' : 
+                       node.type === 'link' ? '#43a047' : '#f57c00';
+    
+    const element = {
+        group: 'nodes',
+        data: {
+            id: node.id,
+            label: node.id,
+            type: node.type || 'hub',
+            businessKey: node.businessKey || '',
+            parent: node.parent || '',
+            connects: node.connects || [],
+            attributes: node.attributes || [],
+            reasoning: node.reasoning || 'No reasoning provided',
+            borderColor: borderColor
+        }
+    };
+    if (position) {
+        element.position = position;
+    }
+    
+    return cy.add(element);
+}
+
+// Add a node received from the generation stream in a provisional row per type
+function addStreamedNode(node) {
+    if (!node || !node.id) return false;
+    
+    const id = String(node.id).trim();
+    if (cy.getElementById(id).length > 0) return false;
+    
+    const type = node.type || 'hub';
+    const rowY = type === 'hub' ? 100 : type === 'link' ? 500 : 900;
+    const index = cy.nodes(`[type="${type}"]`).length;
+    
+    addModelNode({ ...node, id }, { x: 100 + index * 180, y: rowY });
+    cy.fit(cy.elements(), 80);
+    return true;
+}
+
+// Generate via server-sent events, drawing nodes as they arrive
+function streamGeneration(grounded) {
+    return new Promise((resolve, reject) => {
+        const params = new URLSearchParams({ ocr_id: currentOcrId, grounded: grounded });
+        const source = new EventSource(`/api/generate/stream?${params}`);
+        let received = 0;
+        
+        cy.elements().remove();
+        
+        source.addEventListener('node', function(event) {
+            if (addStreamedNode(JSON.parse(event.data))) {
+                received++;
+                showStatus('generateStatus', `Generating... ${received} nodes received`, 'info');
+            }
+        });
+        
+        source.addEventListener('model', function(event) {
+            source.close();
+            resolve(JSON.parse(event.data));
+        });
+        
+        source.addEventListener('failed', function(event) {
+            source.close();
+            reject(new Error(JSON.parse(event.data).error || 'Generation failed'));
+        });
+        
+        source.onerror = function() {
+            source.close();
+            reject(new Error('Lost connection to generation stream'));
+        };
+    });
+}
+
 // Visualize model with proper 3-layer hierarchy - NO OVERLAPPING
-function visualizeModel(model) {
+function visualizeModel(model, layout) {
     cy.elements().remove();
     
     if (!model.nodes || model.nodes.length === 0) {
@@ -490,25 +595,9 @@ function visualizeModel(model) {
         console.log(`${hubNodes.length} hubs, ${linkNodes.length} links, ${satelliteNodes.length} satellites`);
         
         // Add nodes to Cytoscape WITH FULL NAMES and REASONING
-        validNodes.forEach(node => {
-            const borderColor = node.type === 'hub' ? '#2c5aa0' : 
-                               node.type === 'link' ? '#43a047' : '#f57c00';
-            
-            cy.add({
-                group: 'nodes',
-                data: {
-                    id: node.id,
-                    label: node.id,
-                    type: node.type || 'hub',
-                    businessKey: node.businessKey || '',
-                    parent: node.parent || '',
-                    connects: node.connects || [],
-                    attributes: node.attributes || [],
-                    reasoning: node.reasoning || 'No reasoning provided',
-                    borderColor: borderColor
-                }
-            });
-        });
+        const positions = layout && layout.positions ? layout.positions : null;
+        cy.startBatch();
+        validNodes.forEach(node => addModelNode(node, positions ? positions[node.id] : undefined));
         
         // Add edges
         const edgeArray = [];
@@ -540,60 +629,66 @@ function visualizeModel(model) {
             });
         });
         
+        cy.endBatch();
         console.log(`Added ${edgeArray.length} edges`);
         
-        // PROPER 3-LAYER POSITIONING WITH NO OVERLAP
-        const viewportWidth = document.getElementById('cy').offsetWidth || 1400;
-        const viewportHeight = document.getElementById('cy').offsetHeight || 800;
-        const centerX = viewportWidth / 2;
-        
-        // LAYER 1: HUBS (TOP)
-        const hubY = 100;
-        const hubSpacing = 280;
-        const hubsPerRow = Math.min(5, Math.max(1, Math.ceil(Math.sqrt(hubNodes.length))));
-        
-        hubNodes.forEach((node, idx) => {
-            const row = Math.floor(idx / hubsPerRow);
-            const col = idx % hubsPerRow;
-            const totalWidth = (hubsPerRow - 1) * hubSpacing;
-            const x = centerX - totalWidth / 2 + col * hubSpacing;
-            const y = hubY + row * 150;
-            cy.getElementById(node.id).position({ x, y });
-        });
+        if (positions) {
+            // Server-computed layered layout; nodes it doesn't cover keep the default position
+            console.log(`Using server layout (${layout.algorithm} v${layout.version})`);
+        } else {
+            // PROPER 3-LAYER POSITIONING WITH NO OVERLAP
+            const viewportWidth = document.getElementById('cy').offsetWidth || 1400;
+            const viewportHeight = document.getElementById('cy').offsetHeight || 800;
+            const centerX = viewportWidth / 2;
+        
+            // LAYER 1: HUBS (TOP)
+            const hubY = 100;
+            const hubSpacing = 280;
+            const hubsPerRow = Math.min(5, Math.max(1, Math.ceil(Math.sqrt(hubNodes.length))));
+        
+            hubNodes.forEach((node, idx) => {
+                const row = Math.floor(idx / hubsPerRow);
+                const col = idx % hubsPerRow;
+                const totalWidth = (hubsPerRow - 1) * hubSpacing;
+                const x = centerX - totalWidth / 2 + col * hubSpacing;
+                const y = hubY + row * 150;
+                cy.getElementById(node.id).position({ x, y });
+            });
         
-        const hubHeight = Math.ceil(hubNodes.length / hubsPerRow) * 150 + hubY;
+            const hubHeight = Math.ceil(hubNodes.length / hubsPerRow) * 150 + hubY;
         
-        // LAYER 2: LINKS (MIDDLE) - SIGNIFICANT VERTICAL GAP
-        const linkY = hubHeight + 300;
-        const linkSpacing = 280;
-        const linksPerRow = Math.min(5, Math.max(1, Math.ceil(Math.sqrt(linkNodes.length))));
+            // LAYER 2: LINKS (MIDDLE) - SIGNIFICANT VERTICAL GAP
+            const linkY = hubHeight + 300;
+            const linkSpacing = 280;
+            const linksPerRow = Math.min(5, Math.max(1, Math.ceil(Math.sqrt(linkNodes.length))));
         
-        linkNodes.forEach((node, idx) => {
-            const row = Math.floor(idx / linksPerRow);
-            const col = idx % linksPerRow;
-            const totalWidth = (linksPerRow - 1) * linkSpacing;
-            const x = centerX - totalWidth / 2 + col * linkSpacing;
-            const y = linkY + row * 170;
-            cy.getElementById(node.id).position({ x, y });
-        });
+            linkNodes.forEach((node, idx) => {
+                const row = Math.floor(idx / linksPerRow);
+                const col = idx % linksPerRow;
+                const totalWidth = (linksPerRow - 1) * linkSpacing;
+                const x = centerX - totalWidth / 2 + col * linkSpacing;
+                const y = linkY + row * 170;
+                cy.getElementById(node.id).position({ x, y });
+            });
         
-        const linkHeight = Math.ceil(linkNodes.length / linksPerRow) * 170 + linkY;
+            const linkHeight = Math.ceil(linkNodes.length / linksPerRow) * 170 + linkY;
         
-        // LAYER 3: SATELLITES (BOTTOM) - WIDER SPREAD, LARGER GAP
-        const satY = linkHeight + 300;
-        const satSpacing = 220;
-        const satsPerRow = Math.min(7, Math.max(1, Math.ceil(Math.sqrt(satelliteNodes.length))));
+            // LAYER 3: SATELLITES (BOTTOM) - WIDER SPREAD, LARGER GAP
+            const satY = linkHeight + 300;
+            const satSpacing = 220;
+            const satsPerRow = Math.min(7, Math.max(1, Math.ceil(Math.sqrt(satelliteNodes.length))));
         
-        satelliteNodes.forEach((node, idx) => {
-            const row = Math.floor(idx / satsPerRow);
-            const col = idx % satsPerRow;
-            const totalWidth = (satsPerRow - 1) * satSpacing;
-            const x = centerX - totalWidth / 2 + col * satSpacing;
-            const y = satY + row * 140;
-            cy.getElementById(node.id).position({ x, y });
-        });
+            satelliteNodes.forEach((node, idx) => {
+                const row = Math.floor(idx / satsPerRow);
+                const col = idx % satsPerRow;
+                const totalWidth = (satsPerRow - 1) * satSpacing;
+                const x = centerX - totalWidth / 2 + col * satSpacing;
+                const y = satY + row * 140;
+                cy.getElementById(node.id).position({ x, y });
+            });
         
-        console.log(`Positioned: Hubs at ${hubY}, Links at ${linkY}, Satellites at ${satY}`);
+            console.log(`Positioned: Hubs at ${hubY}, Links at ${linkY}, Satellites at ${satY}`);
+        }
         
         // Apply preset layout
         cy.layout({
@@ -641,7 +736,7 @@ function resetLayout() {
         alert('No model to reset. Please generate a model first.');
         return;
     }
-    visualizeModel(currentModel);
+    visualizeModel(currentModel, currentLayout);
 }
 
 function fitToScreen() {
@@ -658,45 +753,34 @@ function zoomOut() {
     cy.center();
 }
 
-// Export functions
-function exportJSON() {
-    if (!currentModel) {
+// Export functions: files are streamed by the server
+function exportModel(format) {
+    if (!currentModel || !currentModelId) {
         alert('No model to export. Please generate a model first.');
         return;
     }
     
-    const dataStr = JSON.stringify(currentModel, null, 2);
-    downloadFile(dataStr, 'data_vault_model.json', 'application/json');
+    const link = document.createElement('a');
+    link.href = `/api/models/${currentModelId}/export?format=${format}`;
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+}
+
+function exportJSON() {
+    exportModel('json');
 }
 
 function exportCSV() {
-    if (!currentModel) {
-        alert('No model to export. Please generate a model first.');
-        return;
-    }
-    
-    let csv = 'Entity,Type,Parent,BusinessKey,Connects,Attributes,Reasoning\n';
-    
-    currentModel.nodes.forEach(node => {
-        const connects = (node.connects || []).join('; ');
-        const attributes = (node.attributes || []).join('; ');
-        const reasoning = (node.reasoning || '').replace(/"/g, '""');
-        csv += `"${node.id}","${node.type}","${node.parent || ''}","${node.businessKey || ''}","${connects}","${attributes}","${reasoning}"\n`;
-    });
-    
-    downloadFile(csv, 'data_vault_model.csv', 'text/csv');
+    exportModel('csv');
 }
 
-function downloadFile(content, filename, mimeType) {
-    const blob = new Blob([content], { type: mimeType });
-    const url = URL.createObjectURL(blob);
-    const link = document.createElement('a');
-    link.href = url;
-    link.download = filename;
-    document.body.appendChild(link);
-    link.click();
-    document.body.removeChild(link);
-    URL.revokeObjectURL(url);
+function exportDrawIO() {
+    exportModel('drawio');
+}
+
+function exportDDL() {
+    exportModel('ddl');
 }
 
 function showStatus(elementId, message, type) {
@@ -0,0 +1,14 @@
+import app
+
+
+def test_check_reports_non_dict_edges():
+    model = {'nodes': [{'id': 'h', 'type': 'hub', 'label': 'x'}], 'edges': ['bad']}
+    issues = app.check_dv_model(model)
+    assert {'node': None, 'code': 'bad_edge', 'message': "Edge 'bad' is not a {from, to} object"} in issues
+
+
+def test_autofix_drops_non_dict_edges():
+    model = {'nodes': [{'id': 'h', 'type': 'hub', 'label': 'x'}], 'edges': ['bad', None]}
+    fixes, issues = app.autofix_dv_model(model)
+    assert model['edges'] == []
+    assert [issue['code'] for issue in issues] == ['missing_reasoning']